@@ -0,0 +1,123 @@
+"""
+Compares ways of decoding the output of a CLI command: the original
+decode/split/filter approach, and speedify._parse_cmd_output() (reverse scan
+of the raw bytes) with the json module and with orjson.
+
+By default it uses generated outputs shaped like show servers, show adapters
+and a speedtest with progress lines.  Pass a file written by
+speedify.RecordingTransport to use recorded outputs instead.
+
+ex: python bench_decode.py
+    python bench_decode.py --recording session.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import speedify
+
+
+def split_and_parse(stdout):
+    """The decoding _parse_cmd_output() used to do."""
+    resultstr = stdout.decode("utf-8").strip()
+    lines = [line for line in resultstr.split("\n") if line.strip()]
+    return json.loads(lines[-1])
+
+
+def show_servers(count):
+    servers = [
+        {
+            "tag": "us-nyc-" + str(i),
+            "country": "us",
+            "city": "nyc",
+            "num": i,
+            "isPrivate": False,
+            "friendlyName": "New York City, NY #" + str(i),
+            "dataCenter": "dc-" + str(i % 7),
+            "torrentAllowed": i % 3 == 0,
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"public": servers, "private": []}).encode("utf-8") + b"\n"
+
+
+def show_adapters(count):
+    adapters = [
+        {
+            "adapterID": "adapter-" + str(i),
+            "description": "Ethernet adapter " + str(i),
+            "name": "eth" + str(i),
+            "state": "connected",
+            "type": "Ethernet",
+            "priority": "always",
+            "connectedNetworkName": "network " + str(i),
+            "rateLimit": 0,
+            "dataUsage": {"usageMonthly": 123456789 * i, "usageDaily": 12345 * i},
+        }
+        for i in range(count)
+    ]
+    return json.dumps(adapters).encode("utf-8") + b"\n"
+
+
+def speedtest(progress_lines):
+    progress = b"".join(
+        json.dumps({"status": "running", "percent": i, "downloadSpeed": 1e6 * i}).encode("utf-8") + b"\n"
+        for i in range(progress_lines)
+    )
+    return progress + json.dumps([{"downloadSpeed": 9.5e7, "uploadSpeed": 2.1e7, "latency": 23}]).encode("utf-8") + b"\n\n"
+
+
+def generated_outputs():
+    return {
+        "show servers (5000)": show_servers(5000),
+        "show adapters (16)": show_adapters(16),
+        "speedtest (500 lines)": speedtest(500),
+        "state": b'{"state": "CONNECTED"}\n',
+    }
+
+
+def recorded_outputs(path):
+    outputs = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("returncode") == 0 and record.get("stdout", "").strip():
+                name = " ".join(record["args"])
+                outputs[name] = record["stdout"].encode("utf-8", "surrogateescape")
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--recording", help="file written by speedify.RecordingTransport")
+    parser.add_argument("--number", type=int, default=0, help="runs per measurement (default: auto)")
+    options = parser.parse_args()
+
+    outputs = recorded_outputs(options.recording) if options.recording else generated_outputs()
+
+    def reverse_scan(data):
+        return speedify._parse_cmd_output(["bench"], data)
+
+    # (label, parser, orjson module to use)
+    parsers = [("split + json", split_and_parse, None), ("reverse scan + json", reverse_scan, None)]
+    if speedify.orjson is not None:
+        parsers.append(("reverse scan + orjson", reverse_scan, speedify.orjson))
+
+    for name, data in outputs.items():
+        print(f"{name}  ({len(data)} bytes)")
+        for label, parse, module in parsers:
+            with patch("speedify.orjson", module):
+                assert parse(data) == split_and_parse(data)
+                timer = timeit.Timer(lambda: parse(data))
+                number = options.number or timer.autorange()[0]
+                best = min(timer.repeat(5, number)) / number
+            print(f"    {label:<24} {best * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
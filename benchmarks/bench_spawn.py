@@ -0,0 +1,75 @@
+"""
+Compares the latency of running CLI commands with subprocess.run (the default)
+and with PreforkSpawner.
+
+Without a Speedify install, a stand-in shell script that prints a JSON state is
+used as the CLI.  --ballast grows this process first, to show how the cost of
+forking a large Python process affects the default path.
+
+ex: python bench_spawn.py --runs 500 --ballast 1024
+    SPEEDIFY_CLI=/usr/share/speedify/speedify_cli python bench_spawn.py
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from speedify import PreforkSpawner, SpeedifyClient
+
+FAKE_CLI = """#!/bin/sh
+echo '{"state": "CONNECTED"}'
+"""
+
+
+def fake_cli(directory):
+    path = os.path.join(directory, "speedify_cli")
+    with open(path, "w") as f:
+        f.write(FAKE_CLI)
+    os.chmod(path, 0o755)
+    return path
+
+
+def measure(client, runs):
+    client.show_state()  # warm up
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.show_state()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def report(name, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    mean = statistics.mean(latencies) * 1000
+    print(f"{name:<22} mean {mean:7.2f} ms   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--ballast", type=int, default=0, help="MiB of memory to allocate first")
+    parser.add_argument("--workers", type=int, default=2)
+    options = parser.parse_args()
+
+    ballast = bytearray(options.ballast * 1024 * 1024)  # noqa: F841  (kept alive on purpose)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1  # touch every page so it is really mapped
+
+    with tempfile.TemporaryDirectory() as directory:
+        cli = os.environ.get("SPEEDIFY_CLI") or fake_cli(directory)
+        print(f"cli {cli}, {options.runs} runs, {options.ballast} MiB ballast")
+        report("subprocess.run", measure(SpeedifyClient(cli_path=cli), options.runs))
+        with PreforkSpawner(workers=options.workers) as spawner:
+            client = SpeedifyClient(cli_path=cli, transport=spawner)
+            report("PreforkSpawner", measure(client, options.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,12 @@ from setuptools import setup
 
 setup(
     extras_require={
+        "fast": [
+            "orjson>=3.0",
+        ],
+        "numpy": [
+            "numpy>=1.20",
+        ],
         "test": [
             "pytest>=7.0",
             "pytest-mock>=3.10",
@@ -1,15 +1,30 @@
 #!/usr/bin/python3
 # Uses Python 3.7
 
+import atexit
+import contextvars
+import copy
+import inspect
 import json
 import logging
 import subprocess
 import os
 import platform
+import re
 import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing, contextmanager
 from enum import Enum
 from functools import wraps
 
+try:
+    # Optional, faster JSON decoder: pip install speedify-py[fast]
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -214,10 +229,19 @@ class Priority(Enum):
 class SpeedifyError(Exception):
     """Generic error thrown by library."""
 
+    # Exit code of the CLI command that failed, if it ran to its end
+    returncode = None
+    # The speedify.hooks.Operation it was raised in, when hooks are added
+    operation = None
+
     def __init__(self, message):
         self.message = message
 
 
+class SpeedifyTimeoutError(SpeedifyError):
+    """Error thrown if a command, or a retried command's deadline, timed out."""
+
+
 class SpeedifyAPIError(SpeedifyError):
     """Error thrown if speedify gave a bad json response."""
 
@@ -230,6 +254,10 @@ class SpeedifyAPIError(SpeedifyError):
 
 _cli_path = None
 
+# When set, _run_speedify_cmd() hands its arguments to this callable instead of
+# running the CLI itself.  speedify.aio uses it to drive the synchronous wrappers.
+_cmd_interceptor = contextvars.ContextVar("speedify_cmd_interceptor", default=None)
+
 
 def set_cli(new_cli_path):
     """Change the path to the cli after importing the module.
@@ -252,6 +280,880 @@ def get_cli():
     return _cli_path
 
 
+# ============================================================================
+# Client
+# ============================================================================
+
+# Commands whose second word names the operation, e.g. "show settings" or
+# "adapter priority".  Used to key per-command configuration.
+_SUBCOMMAND_FAMILIES = {
+    "adapter",
+    "captiveportal",
+    "daemon",
+    "dscp",
+    "log",
+    "networksharing",
+    "privacy",
+    "refresh",
+    "route",
+    "safebrowsing",
+    "show",
+    "streaming",
+    "streamingbypass",
+}
+
+# Commands that only sometimes take a subcommand ("fixeddelay 100" vs "fixeddelay domains ...")
+_OPTIONAL_SUBCOMMANDS = {
+    ("fixeddelay", "domains"),
+    ("fixeddelay", "ips"),
+    ("fixeddelay", "ports"),
+    ("login", "auto"),
+    ("login", "oauth"),
+}
+
+# Public functions that don't run CLI commands, so SpeedifyClient and
+# speedify.aio don't offer them as commands.
+_NOT_COMMANDS = {
+    "ping_internet",
+    "use_shell",
+    "using_speedify",
+    "set_cli",
+    "get_cli",
+    "find_state_for_string",
+    "exception_wrapper",
+    "connectmethod_as_string",
+    "get_default_client",
+    "set_default_client",
+}
+
+
+# Timeouts for commands that legitimately take longer than the default
+_DEFAULT_TIMEOUTS = {
+    "speedtest": 600,
+    "streamtest": 600,
+}
+
+
+def _command_name(args):
+    """
+    Returns the name of the CLI command in args, without its parameters.
+
+    Example:
+        _command_name(["show", "settings"])          # "show settings"
+        _command_name(["adapter", "priority", "wlan0", "always"])  # "adapter priority"
+        _command_name(["connect", "us", "nyc"])      # "connect"
+
+    :param args: List of command arguments as passed to speedify_cli.
+    :type args: list
+    :returns: str -- The command name.
+    """
+    if len(args) > 1 and (args[0] in _SUBCOMMAND_FAMILIES or (args[0], args[1]) in _OPTIONAL_SUBCOMMANDS):
+        return args[0] + " " + args[1]
+    return args[0]
+
+
+# Commands (or command names) that only read from the daemon.  Everything else
+# is assumed to change its state.
+_READ_ONLY_COMMANDS = {
+    "show",
+    "state",
+    "version",
+    "captiveportal check",
+    "networksharing availableshares",
+    "networksharing discovery",
+    "networksharing settings",
+    "safebrowsing stats",
+}
+
+# Commands that print the full connection settings (the "show settings" JSON) after the change
+_SETTINGS_COMMANDS = {
+    "adapter encryption",
+    "adapter expose-dscp",
+    "encryption",
+    "fixeddelay",
+    "fixeddelay domains",
+    "fixeddelay ips",
+    "fixeddelay ports",
+    "headercompression",
+    "jumbo",
+    "maxredundant",
+    "mode",
+    "overflow",
+    "packetaggr",
+    "packetpool",
+    "ports",
+    "priorityoverflow",
+    "route default",
+    "startupconnect",
+    "subnets",
+    "targetconnections",
+    "transport",
+    "transportretry",
+}
+
+# Marks a cache miss, or a command that failed when passed to ReadCache.update()
+_MISSING = object()
+
+
+def _is_read_only(args):
+    return args[0] in _READ_ONLY_COMMANDS or _command_name(args) in _READ_ONLY_COMMANDS
+
+
+class ReadCache:
+    """
+    Short-lived cache of read-only command results (show_*, show_state, show_version, ...),
+    keyed by the command arguments.
+
+    Any other command run through the same client empties the cache, since it may
+    have changed what the daemon would report.  Commands that print the settings
+    JSON (mode, encryption, transport, ...) store it as the new "show settings"
+    result, so show_settings() right after a change doesn't spawn the CLI.
+
+    Results are copied in and out of the cache, so callers may modify them.
+
+    Example:
+        client = SpeedifyClient(cache=ReadCache(default_ttl=1, ttls={"show servers": 60, "state": 0.25}))
+
+    :param default_ttl: Seconds a result stays valid, for commands not in ttls.
+    :type default_ttl: float
+    :param ttls: Per-command time to live in seconds, keyed by command name.  0 turns off caching for that command.
+    :type ttls: dict
+    """
+
+    def __init__(self, default_ttl=1.0, ttls=None):
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Bumped on every invalidation, so reads that started before a change
+        # don't store their (possibly stale) results afterwards.
+        self.generation = 0
+
+    def ttl_for(self, args):
+        """
+        :returns: float -- Time to live in seconds for the results of this command.
+        """
+        return self.ttls.get(_command_name(args), self.default_ttl)
+
+    def lookup(self, args):
+        """
+        Returns a copy of the cached result of a read-only command, or _MISSING.
+        """
+        if not _is_read_only(args):
+            return _MISSING
+        key = tuple(args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return _MISSING
+            self.hits += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def update(self, args, result, generation):
+        """
+        Records the outcome of a command that was run after a lookup() miss.
+
+        :param args: The command arguments.
+        :type args: list
+        :param result: The parsed result, or _MISSING if the command failed.
+        :param generation: The value of self.generation when the command was started.
+        :type generation: int
+        """
+        if _is_read_only(args):
+            if result is not _MISSING:
+                self._put(args, result, generation)
+            return
+
+        self.invalidate()
+        if (
+            result is not _MISSING
+            and _command_name(args) in _SETTINGS_COMMANDS
+            and isinstance(result, dict)
+            and "bondingMode" in result
+        ):
+            self._put(["show", "settings"], result, self.generation)
+
+    def invalidate(self):
+        """Drops every cached result."""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def _put(self, args, result, generation):
+        ttl = self.ttl_for(args)
+        if ttl <= 0:
+            return
+        value = copy.deepcopy(result)
+        with self._lock:
+            if generation == self.generation:
+                self._entries[tuple(args)] = (time.monotonic() + ttl, value)
+
+
+class AdaptiveTimeouts:
+    """
+    Timeouts derived from how long each command has recently taken, so that a hung
+    "state" fails after a few seconds instead of a minute while slow commands keep
+    the time they need.
+
+    A command's timeout is a percentile of its recent latencies (as recorded in the
+    client's MetricsRegistry) times a multiplier, kept between floor and ceiling.
+    Until a command has min_samples latencies, or when the client has a timeout
+    configured for it, the client's timeouts apply as before.  Timeouts are recorded
+    as latencies too, so the estimate grows if the daemon slows down.
+
+    Example:
+        client = SpeedifyClient(adaptive_timeouts=AdaptiveTimeouts(floor=2, ceiling=30))
+
+    :param percentile: Percentile of recent latencies to start from.
+    :type percentile: float
+    :param multiplier: Factor applied to that percentile.
+    :type multiplier: float
+    :param floor: Shortest timeout in seconds.
+    :type floor: float
+    :param ceiling: Longest timeout in seconds.  Defaults to the client's default_timeout.
+    :type ceiling: float
+    :param min_samples: Latencies needed before a command's timeout adapts.
+    :type min_samples: int
+    """
+
+    def __init__(self, percentile=99, multiplier=3.0, floor=2.0, ceiling=None, min_samples=20):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+
+    def timeout_for(self, command, metrics, default_timeout):
+        """
+        :param command: Command name, e.g. "show adapters".
+        :type command: str
+        :param metrics: Where the command's latencies are recorded.
+        :type metrics: speedify.metrics.MetricsRegistry
+        :param default_timeout: The client's default timeout, the ceiling unless one is set.
+        :type default_timeout: float
+        :returns: float -- Timeout in seconds, or None if there are too few latencies.
+        """
+        latency = metrics.percentile(command, self.percentile, self.min_samples)
+        if latency is None:
+            return None
+        ceiling = self.ceiling if self.ceiling is not None else default_timeout
+        return min(ceiling, max(self.floor, latency * self.multiplier))
+
+
+class _InFlight:
+    """A read-only command being run on behalf of one or more callers."""
+
+    __slots__ = ("done", "waiters", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = _MISSING
+        self.error = None
+
+
+class SpeedifyClient:
+    """
+    Runs speedify_cli commands with its own configuration.
+
+    A client holds the CLI path, the transport that launches the CLI (by default
+    subprocess, with the platform spawn flags worked out once, when the client is
+    created), the default and per-command timeouts (optionally adapted to observed
+    latencies), and an optional ReadCache.  Identical read-only commands issued at the same time from several
+    threads share a single CLI process and all receive its result or error.  The
+    module-level functions run through a default client which is created on first
+    use; create your own to keep separate control loops isolated from each other.
+
+    Every command wrapper in the module is also available as a method of the client:
+
+    Example:
+        client = SpeedifyClient(default_timeout=10, timeouts={"speedtest": 600})
+        client.show_adapters()
+        client.adapter_priority("wlan0", Priority.BACKUP)
+
+        # or run any code against the client
+        with client.activate():
+            speedify.connect_closest()
+
+    :param cli_path: Full path to speedify_cli.  If not given, the module's path is used (see get_cli()).
+    :type cli_path: str
+    :param default_timeout: Seconds to wait for a command that has no other timeout.
+    :type default_timeout: float
+    :param timeouts: Per-command timeouts in seconds, keyed by command name (e.g. "show servers", "state").
+        These are added to the defaults, which give speedtest and streamtest 600 seconds.
+    :type timeouts: dict
+    :param shell: Run the CLI through the shell.  Defaults to use_shell() for this platform.
+        Only used by the default transport.
+    :type shell: bool
+    :param cache: Optional cache for read-only commands.  Off by default.
+    :type cache: speedify.ReadCache
+    :param coalesce: Let concurrent identical read-only commands (same arguments and timeout) share one CLI process.
+    :type coalesce: bool
+    :param transport: How the CLI is launched (see speedify.transports).  Defaults to a
+        SubprocessTransport; a PreforkSpawner avoids forking this process for every command,
+        and a FakeTransport or ReplayTransport needs no CLI or daemon at all.
+    :type transport: speedify.Transport
+    :param metrics: Where the commands run are recorded.  Defaults to speedify.metrics.default_registry.
+    :type metrics: speedify.metrics.MetricsRegistry
+    :param scheduler: Limits how many commands run at once and how fast they start.
+        Defaults to speedify.scheduler.default_scheduler, shared by the whole process.
+    :type scheduler: speedify.scheduler.SpawnScheduler
+    :param adaptive_timeouts: Derive the timeouts of commands without a configured timeout
+        from their recent latencies.  Off by default.
+    :type adaptive_timeouts: speedify.AdaptiveTimeouts
+    :param retry: Retry commands that fail for transient reasons, and optionally hedge slow reads.
+        Off by default.
+    :type retry: speedify.retry.RetryPolicy
+    """
+
+    def __init__(
+        self,
+        cli_path=None,
+        default_timeout=60,
+        timeouts=None,
+        shell=None,
+        cache=None,
+        coalesce=True,
+        transport=None,
+        metrics=None,
+        scheduler=None,
+        adaptive_timeouts=None,
+        retry=None,
+    ):
+        self._lock = threading.Lock()
+        self._cli_path = cli_path
+        self.default_timeout = default_timeout
+        self.timeouts = dict(_DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.transport = transport if transport is not None else SubprocessTransport(shell)
+        self.metrics = metrics if metrics is not None else default_registry
+        self.scheduler = scheduler if scheduler is not None else default_scheduler
+        self.adaptive_timeouts = adaptive_timeouts
+        self.retry = retry
+        self.cache = cache
+        self.coalesce = coalesce
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        function = globals().get(name)
+        if name.startswith("_") or name in _NOT_COMMANDS or not inspect.isfunction(function):
+            raise AttributeError(
+                "'" + type(self).__name__ + "' object has no attribute '" + name + "'"
+            )
+
+        @wraps(function)
+        def method(*args, **kwargs):
+            with self.activate():
+                return function(*args, **kwargs)
+
+        return method
+
+    @contextmanager
+    def activate(self):
+        """
+        Context manager that runs the module-level functions against this client
+        in the current thread (or asyncio task).
+        """
+        token = _active_client_var.set(self)
+        try:
+            yield self
+        finally:
+            _active_client_var.reset(token)
+
+    def set_cli(self, new_cli_path):
+        """
+        Change the path to the cli used by this client.
+
+        :param new_cli_path:  Full path to speedify_cli.
+        :type new_cli_path: str
+        """
+        with self._lock:
+            self._cli_path = new_cli_path
+
+    def get_cli(self):
+        """
+        :returns:  str -- The full path to the speedify cli used by this client.
+        """
+        if self._cli_path:
+            return self._cli_path
+        return get_cli()
+
+    def command_line(self, args):
+        """
+        Returns the complete command line that runs a CLI command.
+
+        :param args: List of command arguments, e.g. ["show", "adapters"].
+        :type args: list
+        :returns: list -- The CLI path, the -s flag and the arguments.
+        """
+        if self.transport.needs_cli:
+            cli = self.get_cli()
+        else:
+            cli = self._cli_path or "speedify_cli"
+        # -s flag for single-line JSON
+        return [cli, "-s"] + list(args)
+
+    def set_timeout(self, command, seconds):
+        """
+        Set the timeout of one command.
+
+        Example:
+            client.set_timeout("state", 5)
+
+        :param command: Command name, e.g. "state" or "show adapters".
+        :type command: str
+        :param seconds: Timeout in seconds, or None to go back to the default.
+        :type seconds: float
+        """
+        with self._lock:
+            timeouts = dict(self.timeouts)
+            if seconds is None:
+                timeouts.pop(command, None)
+            else:
+                timeouts[command] = seconds
+            self.timeouts = timeouts
+
+    def timeout_for(self, args, cmdtimeout=None):
+        """
+        Returns the timeout to use for a command: the one requested by the caller,
+        else the one configured for the command, else one adapted to its recent
+        latencies if adaptive_timeouts is set, else the default timeout.
+
+        :param args: List of command arguments.
+        :type args: list
+        :param cmdtimeout: Timeout requested by the caller, which takes precedence.
+        :type cmdtimeout: float
+        :returns: float -- Timeout in seconds.
+        """
+        if cmdtimeout is not None:
+            return cmdtimeout
+        command = _command_name(args)
+        timeout = self.timeouts.get(command)
+        if timeout is not None:
+            return timeout
+        if self.adaptive_timeouts is not None:
+            timeout = self.adaptive_timeouts.timeout_for(command, self.metrics, self.default_timeout)
+            if timeout is not None:
+                return timeout
+        return self.default_timeout
+
+    def run(self, args, cmdtimeout=None, progress=None):
+        """
+        Runs a speedify_cli command and returns its parsed JSON response.
+        See _run_speedify_cmd().
+
+        :param args: List of command arguments to pass to speedify_cli (e.g., ["connect", "closest"])
+        :type args: list
+        :param cmdtimeout: Maximum time in seconds to wait, overriding the client's timeouts.
+        :type cmdtimeout: float
+        :param progress: Optional function called with every JSON object the command prints, as it is printed.
+        :type progress: function
+        :returns: dict -- Parsed JSON response object from the CLI
+        """
+        cache = self.cache
+        if cache is None:
+            return self._run_uncached(args, cmdtimeout, progress)
+
+        if progress is None:
+            result = cache.lookup(args)
+            if result is not _MISSING:
+                return result
+        generation = cache.generation
+        try:
+            result = self._run_uncached(args, cmdtimeout, progress)
+        except BaseException:
+            cache.update(args, _MISSING, generation)
+            raise
+        cache.update(args, result, generation)
+        return result
+
+    def run_all(self, args, cmdtimeout=None):
+        """
+        Runs a speedify_cli command and returns every JSON object it printed,
+        e.g. the progress reports of a speedtest followed by its result.
+
+        :param args: List of command arguments to pass to speedify_cli (e.g., ["speedtest"])
+        :type args: list
+        :param cmdtimeout: Maximum time in seconds to wait, overriding the client's timeouts.
+        :type cmdtimeout: float
+        :returns: list -- The parsed JSON objects, in order; the last one is the result.
+        """
+        results = []
+        self.run(args, cmdtimeout, progress=results.append)
+        return results
+
+    def run_iter(self, args, cmdtimeout=None):
+        """
+        Runs a speedify_cli command, yielding each JSON object it prints as soon as
+        it is printed.  The last object is the command's result.  Errors are raised
+        once the command has ended; if the loop stops early, the CLI is stopped.
+        The client's cache is not used.
+
+        Example:
+            for report in client.run_iter(["speedtest"]):
+                print(report)
+
+        :param args: List of command arguments to pass to speedify_cli (e.g., ["speedtest"])
+        :type args: list
+        :param cmdtimeout: Maximum time in seconds for the whole command, overriding the client's timeouts.
+        :type cmdtimeout: float
+        :returns: generator -- The parsed JSON objects.
+        :raises SpeedifyError: For general CLI errors, timeouts, or invalid output
+        :raises SpeedifyAPIError: For API errors returned by the Speedify daemon (exit code 1)
+        """
+        cmd = self.command_line(args)
+        self.scheduler.acquire(args)
+        try:
+            yield from self._stream_results(args, cmd, cmdtimeout)
+        finally:
+            self.scheduler.release()
+
+    def _stream_results(self, args, cmd, cmdtimeout):
+        start = time.perf_counter()
+        try:
+            stream = self.transport.stream(cmd, capture_stderr=True)
+        except OSError:
+            self.metrics.record(_command_name(args), time.perf_counter() - start, SPAWN_FAILED)
+            raise
+
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            stream.close()
+
+        timer = threading.Timer(self.timeout_for(args, cmdtimeout), expire)
+        timer.daemon = True
+        timer.start()
+        output = _OutputLines(args)
+        failure = None
+        try:
+            try:
+                for line in stream:
+                    result = output.parse(line)
+                    if result is not _MISSING and not timed_out.is_set():
+                        yield result
+            finally:
+                timer.cancel()
+                stream.close()
+
+            if timed_out.is_set():
+                failure = TIMEOUT
+                logger.error("Command timed out")
+                raise SpeedifyTimeoutError("Command timed out: " + args[0])
+            error = output.error(stream.returncode, stream.stderr)
+            if error is not None:
+                failure = stream.returncode or INVALID_OUTPUT
+                raise error
+        finally:
+            # A loop that stopped early is not counted as a failure
+            _record_process(
+                self.metrics,
+                _command_name(args),
+                time.perf_counter() - start,
+                stream.returncode,
+                failure,
+                output.stdout_bytes,
+                output.parse_seconds,
+            )
+
+    def _run_uncached(self, args, cmdtimeout, progress=None):
+        if progress is not None or not self.coalesce or not _is_read_only(args):
+            return self._run_retried(args, cmdtimeout, progress)
+
+        # Callers with different timeouts don't share a process
+        key = (tuple(args), cmdtimeout)
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            if call is None:
+                call = self._inflight[key] = _InFlight()
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.result is _MISSING:
+                # The leader was interrupted (KeyboardInterrupt, SystemExit): that's not ours to raise
+                return self._run_retried(args, cmdtimeout)
+            return copy.deepcopy(call.result)
+
+        try:
+            result = self._run_retried(args, cmdtimeout)
+        except Exception as err:
+            call.error = err
+            raise
+        else:
+            call.result = result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            if call.waiters and call.result is not _MISSING:
+                # The caller may change its result, so keep an untouched copy for the others
+                call.result = copy.deepcopy(call.result)
+            call.done.set()
+        return result
+
+    def _run_retried(self, args, cmdtimeout, progress=None):
+        # Commands reporting progress aren't retried: the caller has seen some of it
+        if self.retry is None or progress is not None:
+            return self._execute(args, cmdtimeout, progress)
+        return self.retry.run(self, args, cmdtimeout)
+
+    def _execute(self, args, cmdtimeout, progress=None):
+        if progress is not None:
+            result = _MISSING
+            with closing(self.run_iter(args, cmdtimeout)) as results:
+                for result in results:
+                    progress(result)
+            return result
+
+        cmd = self.command_line(args)
+        command = _command_name(args)
+        with self.scheduler.slot(args):
+            start = time.perf_counter()
+            try:
+                returncode, stdout, stderr = self.transport.run(cmd, self.timeout_for(args, cmdtimeout))
+            except subprocess.TimeoutExpired:
+                self.metrics.record(command, time.perf_counter() - start, TIMEOUT)
+                logger.error("Command timed out")
+                raise SpeedifyTimeoutError("Command timed out: " + args[0])
+            except OSError:
+                self.metrics.record(command, time.perf_counter() - start, SPAWN_FAILED)
+                raise
+        return _record_and_parse(self.metrics, args, time.perf_counter() - start, returncode, stdout, stderr)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+# The client used by the module-level functions in the current thread or task,
+# when one has been activated with SpeedifyClient.activate().
+_active_client_var = contextvars.ContextVar("speedify_active_client", default=None)
+
+
+def get_default_client():
+    """
+    Returns the client used by the module-level functions, creating it on first use.
+
+    :returns:  speedify.SpeedifyClient -- The default client.
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = SpeedifyClient()
+    return _default_client
+
+
+def set_default_client(client):
+    """
+    Replace the client used by the module-level functions.
+
+    Example:
+        set_default_client(SpeedifyClient(default_timeout=10))
+
+    :param client: The new default client, or None to create a fresh one on next use.
+    :type client: speedify.SpeedifyClient
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+
+def _active_client():
+    client = _active_client_var.get()
+    if client is None:
+        client = get_default_client()
+    return client
+
+
+# ============================================================================
+# Batches
+# ============================================================================
+
+class BatchCommand:
+    """
+    One command to run with batch().
+
+    Example:
+        BatchCommand(adapter_priority, args=("wlan0", Priority.ALWAYS), name="wlan0")
+        BatchCommand(connect_closest, name="connect", after=["wlan0"])
+
+    :param function: The speedify function to call, e.g. speedify.adapter_priority.
+    :type function: function
+    :param args: Positional arguments for the function.
+    :type args: tuple
+    :param kwargs: Keyword arguments for the function.
+    :type kwargs: dict
+    :param name: Name other commands can refer to in their after list.
+    :type name: str
+    :param after: Names of commands that must complete successfully before this one starts.
+    :type after: list
+    """
+
+    def __init__(self, function, args=(), kwargs=None, name=None, after=()):
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.name = name
+        self.after = list(after)
+
+    def __repr__(self):
+        return "BatchCommand(" + getattr(self.function, "__name__", repr(self.function)) + ", name=" + repr(self.name) + ")"
+
+
+class BatchResult:
+    """
+    Outcome of one command run by batch().
+
+    :ivar command: The BatchCommand that was run.
+    :ivar result: What the function returned, or None if it failed.
+    :ivar error: The exception it raised, or None if it succeeded.
+    """
+
+    def __init__(self, command, result=None, error=None):
+        self.command = command
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        """True if the command succeeded."""
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "BatchResult(" + repr(self.command) + ", result=" + repr(self.result) + ")"
+        return "BatchResult(" + repr(self.command) + ", error=" + repr(self.error) + ")"
+
+
+def _batch_command(spec):
+    if isinstance(spec, BatchCommand):
+        return spec
+    if isinstance(spec, (tuple, list)) and spec and callable(spec[0]):
+        return BatchCommand(spec[0], args=spec[1:])
+    if callable(spec):
+        return BatchCommand(spec)
+    raise ValueError("Not a batch command: " + repr(spec))
+
+
+def batch(commands, max_workers: int = 4):
+    """
+    batch(commands, max_workers=4)
+    Runs many commands, up to max_workers at a time, and returns the outcome of each.
+
+    Commands run concurrently unless one names others in its after list, in which case
+    it starts only once those have succeeded.  If one of them fails, the command is not
+    run and its result holds a SpeedifyError saying why.  A failing command does not
+    stop the rest of the batch.
+
+    Commands run against the active client, so client.batch(...) works too.
+
+    Example:
+        results = batch([
+            BatchCommand(adapter_priority, args=("wlan0", Priority.ALWAYS)),
+            BatchCommand(adapter_priority, args=("eth0", Priority.BACKUP)),
+            (dscp_queues_add, 46, "on"),
+            BatchCommand(mode, args=("speed",), name="mode"),
+            BatchCommand(connect_closest, after=["mode"]),
+        ])
+        failed = [r for r in results if not r.ok]
+
+    :param commands: BatchCommand objects, or (function, arg, ...) tuples, or functions without arguments.
+    :type commands: list
+    :param max_workers: Maximum number of commands to run at the same time.
+    :type max_workers: int
+    :returns: list -- A BatchResult for each command, in the order given.
+    :raises ValueError: If an after list names an unknown command, or the dependencies form a cycle.
+    """
+    commands = [_batch_command(spec) for spec in commands]
+
+    by_name = {}
+    for index, command in enumerate(commands):
+        if command.name is not None:
+            if command.name in by_name:
+                raise ValueError("Duplicate batch command name: " + command.name)
+            by_name[command.name] = index
+
+    waiting_on = []
+    dependents = [[] for _ in commands]
+    for index, command in enumerate(commands):
+        deps = set()
+        for name in command.after:
+            if name not in by_name:
+                raise ValueError("Unknown batch command in after: " + str(name))
+            if by_name[name] not in deps:
+                deps.add(by_name[name])
+                dependents[by_name[name]].append(index)
+        waiting_on.append(deps)
+
+    # Refuse circular dependencies before running anything
+    unmet = [len(deps) for deps in waiting_on]
+    startable = [index for index, count in enumerate(unmet) if count == 0]
+    reachable = 0
+    while startable:
+        reachable += 1
+        for dependent in dependents[startable.pop()]:
+            unmet[dependent] -= 1
+            if unmet[dependent] == 0:
+                startable.append(dependent)
+    if reachable != len(commands):
+        raise ValueError("Batch commands have circular dependencies")
+
+    results = [None] * len(commands)
+    ready = [index for index, deps in enumerate(waiting_on) if not deps]
+
+    def finish(index, result):
+        # Record an outcome and release (or skip) the commands waiting for it
+        results[index] = result
+        for dependent in dependents[index]:
+            if results[dependent] is not None:
+                continue
+            if not result.ok:
+                finish(
+                    dependent,
+                    BatchResult(
+                        commands[dependent],
+                        error=SpeedifyError(
+                            "Skipped, " + str(commands[index].name) + " failed"
+                        ),
+                    ),
+                )
+                continue
+            waiting_on[dependent].discard(index)
+            if not waiting_on[dependent]:
+                ready.append(dependent)
+
+    def run(command):
+        try:
+            return BatchResult(command, result=command.function(*command.args, **command.kwargs))
+        except Exception as err:
+            return BatchResult(command, error=err)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while ready or running:
+            while ready:
+                index = ready.pop(0)
+                # Worker threads don't inherit our context, which holds the active client
+                future = executor.submit(contextvars.copy_context().run, run, commands[index])
+                running[future] = index
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(running.pop(future), future.result())
+
+    return results
+
+
 def find_state_for_string(mystate):
     """
     Converts a string representation of a Speedify state to a State enum.
@@ -272,6 +1174,9 @@ def exception_wrapper(argument):
     and then re-raises the exception. It's applied to most public API functions to ensure
     consistent error handling and logging throughout the module.
 
+    When hooks are added (see speedify.hooks), the outermost decorated function called
+    also opens the operation that the commands it runs belong to, named after it.
+
     :param argument: Contextual error message prefix to use when logging errors.
     :type argument: str
     :returns: function -- The decorated function with error handling.
@@ -286,6 +1191,9 @@ def exception_wrapper(argument):
         @wraps(function)
         def wrapper(*args, **kwargs):
             try:
+                if hooks._registered and hooks.current_operation() is None:
+                    with hooks.operation(function.__name__):
+                        return function(*args, **kwargs)
                 result = function(*args, **kwargs)
                 return result
             except SpeedifyError as err:
@@ -301,24 +1209,46 @@ def exception_wrapper(argument):
 
 
 @exception_wrapper("Failed to connect")
-def connect(server: str = ""):
+def connect(server: str = "", progress=None):
     """
-    connect(server="")
+    connect(server="", progress=None)
     Tell Speedify to connect. Returns serverInformation if success, raises Speedify if unsuccessful.
     See show_servers() for the list of servers available.
 
     Example:
         connect()
         connect("us nyc 11") # server numbers may change, use show_servers()
+        connect("closest", progress=print)
 
     :param server: Server to connect to.
     :type server: str
+    :param progress: Optional function called with each JSON object the CLI prints while connecting, the result last.
+    :type progress: function
     :returns:  dict -- :ref:`JSON currentserver <connect>` from speedify.
     """
     args = ["connect"] + server.split()
+    if progress is not None:
+        return _run_speedify_cmd(args, progress=progress)
     return _run_speedify_cmd(args)
 
 
+def connect_iter(server: str = ""):
+    """
+    connect_iter(server="")
+    Like connect(), but yields each JSON object the CLI prints as it is printed.
+    The last one is the server connected to.
+
+    Example:
+        for report in connect_iter("closest"):
+            print(report)
+
+    :param server: Server to connect to.
+    :type server: str
+    :returns:  generator -- JSON objects from speedify.
+    """
+    return _active_client().run_iter(["connect"] + server.split())
+
+
 def connect_closest():
     """Connects to the closest server
 
@@ -2425,34 +3355,76 @@ def routedefault(is_default: bool = True):
 
 
 @exception_wrapper("Failed to run streamtest")
-def streamtest():
+def streamtest(progress=None):
     """
-    streamtest()
+    streamtest(progress=None)
 
     Runs stream test.
     Returns final results.
     Will take around 30 seconds.
 
+    Example:
+        streamtest(progress=lambda report: print(report))
+
+    :param progress: Optional function called with each JSON object the CLI prints during the test, the result last.
+    :type progress: function
     :returns:  dict -- :ref:`JSON streamtest <speedtest>` from speedify
     """
-    return _run_speedify_cmd(["speedtest"], cmdtimeout=600)
+    if progress is not None:
+        return _run_speedify_cmd(["streamtest"], progress=progress)
+    return _run_speedify_cmd(["streamtest"])
+
+
+def streamtest_iter():
+    """
+    streamtest_iter()
+
+    Runs stream test, yielding each JSON object the CLI prints as it is printed.
+    The last one holds the final results.
+
+    :returns:  generator -- JSON objects from speedify
+    """
+    return _active_client().run_iter(["streamtest"])
 
 
 @exception_wrapper("Failed to run speedtest")
-def speedtest():
+def speedtest(progress=None):
     """
-    speedtest()
+    speedtest(progress=None)
 
     Runs speed test.
     Returns final results.
     Will take around 30 seconds.
 
+    Example:
+        speedtest(progress=lambda report: print(report))
+
+    :param progress: Optional function called with each JSON object the CLI prints during the test, the result last.
+    :type progress: function
     :returns:  dict -- :ref:`JSON speedtest <speedtest>` from speedify
     """
-    jret = _run_speedify_cmd(["speedtest"], cmdtimeout=600)
+    if progress is not None:
+        return _run_speedify_cmd(["speedtest"], progress=progress)
+    jret = _run_speedify_cmd(["speedtest"])
     return jret
 
 
+def speedtest_iter():
+    """
+    speedtest_iter()
+
+    Runs speed test, yielding each JSON object the CLI prints as it is printed.
+    The last one holds the final results.
+
+    Example:
+        for report in speedtest_iter():
+            print(report)
+
+    :returns:  generator -- JSON objects from speedify
+    """
+    return _active_client().run_iter(["speedtest"])
+
+
 @exception_wrapper("Failed to set transport")
 def transport(transport: str = "auto"):
     """
@@ -2511,18 +3483,39 @@ def targetconnections(upload_connections: int, download_connections: int):
 
 
 @exception_wrapper("Failed getting stats")
-def stats(time: int = 1):
+def stats(time: int = 1, last: int = None, summary: bool = False):
     """
-    stats(time=1)
+    stats(time=1, last=None, summary=False)
     calls stats returns a list of all the parsed json objects it gets back
 
+    To use the same memory however long it runs, keep only the last events of each
+    type, or a summary (see speedify.summary).
+
+    Example:
+        speedify.stats(3600, last=10)
+        speedify.stats(3600, summary=True).adapters["wlan0"].max_receive_bps
+
     :param time: How long to run the stats command.
     :type time: int
+    :param last: Keep only the last events of each type.
+    :type last: int
+    :param summary: Return a speedify.summary.StatsSummary instead of the events.
+    :type summary: bool
     :returns:  list -- list JSON stat responses from speedify.
     """
     if time == 0:
         logger.error("stats cannot be run with 0, would never return")
         raise SpeedifyError("Stats cannot be run with 0")
+    if summary:
+        if last is not None:
+            raise SpeedifyError("stats can't keep both the last events and a summary")
+        result = StatsSummary()
+        stats_callback(time, result.add)
+        return result
+    if last is not None:
+        result = LastEvents(last)
+        stats_callback(time, result.add)
+        return result.events()
 
     class list_callback:
         def __init__(self):
@@ -2547,11 +3540,156 @@ def stats_callback(time: int, callback):
     :type callback: function
     """
     args = ["stats", str(time)]
-    cmd = [get_cli(), "-s"] + args
+    cmd = _active_client().command_line(args)
 
     _run_long_command(cmd, callback)
 
 
+def stats_stream(
+    time: int, callback, types=None, typed: bool = False, queue_size: int = None, overflow="block", restart=None
+):
+    """
+    stats_stream(time, callback, types=None, typed=False, queue_size=None, overflow="block", restart=None)
+    like stats_callback(), in a background thread. 0 is forever
+
+    Example:
+        handle = speedify.stats_stream(0, on_stats)
+        ...
+        handle.stop()  # kills the CLI
+
+        # Other events are skipped without being parsed
+        speedify.stats_stream(0, on_state, types=["state"])
+
+        # Called from its own thread; only the latest event of each type waits for it
+        speedify.stats_stream(0, save_to_database, queue_size=10, overflow="coalesce")
+
+        # Restarted if the CLI dies, with a ["gap", {...}] event and fresh state and adapters
+        speedify.stats_stream(0, on_stats, restart=RestartPolicy())
+
+    :param time: How long to run the stats command.
+    :type time: int
+    :param callback: Callback function, called from the stream's thread
+    :type callback: function
+    :param types: Event types to pass to the callback, e.g. ["state", "adapters"], or None for all.
+    :type types: list
+    :param typed: Pass speedify.events classes (StateEvent, AdaptersEvent...) instead of lists.
+    :type typed: bool
+    :param queue_size: Most events waiting for the callback, which is then called from a thread
+        of its own so it can't hold up reading; None to call it from the reading thread.
+    :type queue_size: int
+    :param overflow: What to do with events when the queue is full: "block", "drop_oldest",
+        "drop_newest" or "coalesce" (see speedify.dispatch.Overflow).
+    :type overflow: str
+    :param restart: Restart the stream whenever the CLI fails, or ends with a time of 0; see StreamHandle.
+    :type restart: speedify.retry.RestartPolicy
+    :returns: speedify.StreamHandle -- The running stream, to stop() or join().
+    """
+    args = ["stats", str(time)]
+    cmdarray = _active_client().command_line(args)
+    handle = StreamHandle(
+        cmdarray, callback, types=types, typed=typed, queue_size=queue_size, overflow=overflow, restart=restart
+    )
+    return handle.start()
+
+
+# Periods the stats command can report on, besides a number of hours
+_STATS_PERIODS = {"current", "day", "week", "month", "total"}
+# Most periods speedify_cli stats reports at once
+_MAX_STATS_PERIODS = 5
+
+
+def iter_stats(duration: int = None, periods=(), networksharing: bool = False, types=None, typed: bool = False):
+    """
+    iter_stats(duration=None, periods=(), networksharing=False, types=None, typed=False)
+    yields the stats events as speedify prints them, e.g. ["adapters", [...]]
+
+    Nothing is kept once an event has been yielded, so it can be consumed forever.
+    Closing the generator (or leaving the loop) stops the CLI.  Events not in types
+    are skipped without being parsed.
+
+    Example:
+        for event_type, data in speedify.iter_stats(periods=["current", "day"]):
+            if event_type == "connection_stats":
+                ...
+
+        for _, state in speedify.iter_stats(types=["state"]):
+            ...
+
+        for event in speedify.iter_stats(typed=True):
+            if event.type == "state":
+                print(event.state, event.received)
+
+    :param duration: Seconds to run the stats command.  None (or 0) runs until closed.
+    :type duration: int
+    :param periods: Up to 5 periods to report usage for: "current", "day", "week", "month", "total" or a
+        number of hours (an int or a string such as "24").
+    :type periods: list
+    :param networksharing: Include Pair & Share stats.
+    :type networksharing: bool
+    :param types: Event types to yield, e.g. ["state", "adapters"], or None for all.
+    :type types: list
+    :param typed: Yield speedify.events classes (StateEvent, AdaptersEvent...) instead of lists.
+    :type typed: bool
+    :returns: generator -- The stats events.
+    """
+    client = _active_client()
+    cmdarray = client.command_line(_stats_args(duration, periods, networksharing))
+    return _iter_long_command(cmdarray, client, types=_EventTypes(types), typed=typed)
+
+
+def astats(duration: int = None, periods=(), networksharing: bool = False, types=None, typed: bool = False):
+    """
+    astats(duration=None, periods=(), networksharing=False, types=None, typed=False)
+    like iter_stats(), as an async iterator for asyncio code; see speedify.aio.iter_stats()
+
+    Example:
+        async for event_type, data in speedify.astats():
+            ...
+
+    :returns: async generator -- The stats events.
+    """
+    from . import aio
+
+    return aio.iter_stats(duration, periods, networksharing, types, typed)
+
+
+def asafebrowsing_errors(duration: int = None):
+    """
+    asafebrowsing_errors(duration=None)
+    an async iterator over the safe browsing errors; see speedify.aio.iter_safebrowsing_errors()
+
+    :returns: async generator -- The errors.
+    """
+    from . import aio
+
+    return aio.iter_safebrowsing_errors(duration)
+
+
+def _stats_args(duration, periods, networksharing):
+    # Always given, or the CLI would take the first period in hours for a duration in seconds
+    args = ["stats", str(duration or 0)]
+    if networksharing:
+        args.append("networksharing")
+    periods = list(periods)
+    if len(periods) > _MAX_STATS_PERIODS:
+        raise SpeedifyError("At most " + str(_MAX_STATS_PERIODS) + " stats periods, got " + str(len(periods)))
+    for period in periods:
+        args.append(_stats_period(period))
+    return args
+
+
+def _stats_period(period):
+    """Returns a stats period as passed to the CLI: a period name, or a positive number of hours."""
+    if isinstance(period, str):
+        if period in _STATS_PERIODS:
+            return period
+        if period.isdigit() and int(period) > 0:
+            return str(int(period))
+    elif isinstance(period, int) and not isinstance(period, bool) and period > 0:
+        return str(period)
+    raise SpeedifyError("Unknown stats period: " + str(period))
+
+
 @exception_wrapper("Failed to initialize safe browsing")
 def safebrowsing_initialize(settings: str):
     args = ["safebrowsing", "initialize", settings]
@@ -2572,12 +3710,26 @@ def safebrowsing_enable(enable: bool):
 
 
 @exception_wrapper("Failed getting safebrowsing error")
-def safebrowsing_error(time: int = 1):
+def safebrowsing_error(time: int = 1, last: int = None):
+    """
+    safebrowsing_error(time=1, last=None)
+    returns the safe browsing errors printed in time seconds
+
+    :param time: How long to run the safebrowsing errors command.
+    :type time: int
+    :param last: Keep only the last errors, so memory use doesn't grow with time.
+    :type last: int
+    :returns: list -- The errors.
+    """
     if time == 0:
         logger.error("safebrowsing error cannot be run with 0, would never return")
         raise SpeedifyError(
             "safebrowsing error cannot be run with 0, would never return"
         )
+    if last is not None:
+        result = LastEvents(last)
+        safebrowsing_error_callback(time, result.add)
+        return result.events()
 
     class list_callback:
         def __init__(self):
@@ -2593,17 +3745,347 @@ def safebrowsing_error(time: int = 1):
 
 def safebrowsing_error_callback(time: int, callback):
     args = ["safebrowsing", "errors", str(time)]
-    cmd = [get_cli(), "-s"] + args
+    cmd = _active_client().command_line(args)
 
     _run_long_command(cmd, callback)
 
 
+def safebrowsing_error_stream(time: int, callback, queue_size: int = None, overflow="block", restart=None):
+    """
+    safebrowsing_error_stream(time, callback, queue_size=None, overflow="block", restart=None)
+    like safebrowsing_error_callback(), in a background thread. 0 is forever
+
+    Example:
+        with speedify.safebrowsing_error_stream(0, print):
+            serve_forever()
+
+    :param time: How long to run the safebrowsing errors command.
+    :type time: int
+    :param callback: Callback function, called from the stream's thread
+    :type callback: function
+    :param queue_size: Most errors waiting for the callback; see stats_stream().
+    :type queue_size: int
+    :param overflow: What to do with errors when the queue is full; see stats_stream().
+    :type overflow: str
+    :param restart: Restart the stream whenever the CLI fails, or ends with a time of 0; see StreamHandle.
+    :type restart: speedify.retry.RestartPolicy
+    :returns: speedify.StreamHandle -- The running stream, to stop() or join().
+    """
+    args = ["safebrowsing", "errors", str(time)]
+    cmdarray = _active_client().command_line(args)
+    return StreamHandle(cmdarray, callback, queue_size=queue_size, overflow=overflow, restart=restart).start()
+
+
+class StreamHandle:
+    """
+    A long-running stream (stats, safebrowsing errors) running in a background
+    thread, returned by stats_stream() and safebrowsing_error_stream().
+
+    stop() kills the speedify_cli process and waits for it to exit, so no CLI process
+    outlives the handle; streams still running when the interpreter exits are
+    stopped too.  Using the handle as a context manager stops it on exit.
+
+    The stream runs with the client and hook operation active when it was created.
+    An error starting or running it (e.g. the CLI not being found) is kept in error.
+
+    With a restart policy, the stream is supervised: when the CLI exits by itself
+    (the daemon restarted, the CLI crashed), it is started again after a backoff.
+    Before it restarts, the callback gets a ["gap", {"seconds": ..., "restarts": ...,
+    "error": ...}] event with the length of the outage, whatever the types asked for,
+    and stats streams get fresh ["state", ...] and ["adapters", ...] events, so
+    anything built from the events can be brought up to date.
+
+    By default the callback is called from the thread reading the CLI, so a slow
+    callback holds up the reading.  With a queue_size, events are queued for a
+    second thread that calls the callback, and the queue's overflow policy decides
+    what happens when the callback falls behind (see speedify.dispatch).
+
+    :param cmdarray: Complete command array including CLI path and -s flag.
+    :type cmdarray: list
+    :param callback: Function called from the stream's thread with each JSON object.
+    :type callback: function
+    :param done: Optional function called from the stream's thread with the handle once the stream has ended.
+    :type done: function
+    :param types: Event types to pass to the callback, or None for all.  Others are skipped without being parsed.
+    :type types: list
+    :param typed: Pass stats events as speedify.events classes.
+    :type typed: bool
+    :param queue_size: Most events waiting for the callback, or None to call it from the reading thread.
+    :type queue_size: int
+    :param overflow: What to do with events when the queue is full, e.g. "drop_oldest".
+    :type overflow: speedify.dispatch.Overflow
+    :param restart: Restart the stream when the CLI fails or an endless stream ends, or None not to.
+    :type restart: speedify.retry.RestartPolicy
+    :ivar restarts: Times the stream was restarted.
+
+    Example:
+        with speedify.stats_stream(0, print) as handle:
+            time.sleep(60)
+
+        handle = speedify.safebrowsing_error_stream(0, on_error)
+        ...
+        handle.stop()
+    """
+
+    def __init__(
+        self, cmdarray, callback, done=None, types=None, typed=False, queue_size=None, overflow="block", restart=None
+    ):
+        self.args = cmdarray[2:]
+        self.error = None
+        self.restarts = 0
+        self._restart = restart
+        self._callback = callback
+        self._done = done
+        self._types = _EventTypes(types)
+        self._typed = typed
+        self._queue = None if queue_size is None else EventQueue(queue_size, overflow)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stream = None
+        # Run with the caller's client, hooks operation and lane
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(
+            target=context.run,
+            args=(self._run, cmdarray),
+            name="speedify " + _command_name(self.args),
+            daemon=True,
+        )
+        self._dispatcher = None
+        if self._queue is not None:
+            self._dispatcher = threading.Thread(
+                target=context.copy().run,
+                args=(self._dispatch,),
+                name="speedify " + _command_name(self.args) + " callback",
+                daemon=True,
+            )
+
+    def start(self):
+        """Starts the stream.  Called by the functions returning handles."""
+        with _live_streams_lock:
+            _live_streams.add(self)
+        self._thread.start()
+        return self
+
+    @property
+    def stopped(self):
+        """True once stop() has been called."""
+        return self._stop.is_set()
+
+    @property
+    def running(self):
+        """True until the stream has ended and the CLI has exited."""
+        return self._thread.is_alive()
+
+    @property
+    def dropped(self):
+        """Events dropped because the queue was full."""
+        return self._queue.dropped if self._queue is not None else 0
+
+    @property
+    def coalesced(self):
+        """Events replaced in the queue by a newer event of the same type."""
+        return self._queue.coalesced if self._queue is not None else 0
+
+    def stop(self, timeout=None):
+        """
+        Stops the stream: no more callbacks are made, and the CLI process is killed
+        and reaped.  Returns once the stream has ended.  Safe to call more than
+        once, and from any thread except the stream's own (e.g. its callback), where
+        it only asks the stream to stop.
+
+        :param timeout: Most seconds to wait for the stream to end.
+        :type timeout: float
+        :returns: bool -- True if the stream has ended.
+        """
+        self._halt()
+        if threading.current_thread() in (self._thread, self._dispatcher):
+            return False
+        return self.join(timeout)
+
+    def join(self, timeout=None):
+        """
+        Waits for the stream to end, by itself or after stop().
+
+        :param timeout: Most seconds to wait.
+        :type timeout: float
+        :returns: bool -- True if the stream has ended.
+        """
+        if self._thread.ident is not None:
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _halt(self):
+        """Asks the stream to stop, without waiting for it."""
+        self._stop.set()
+        with self._lock:
+            stream = self._stream
+        if stream is not None:
+            stream.close()
+        if self._queue is not None:
+            # Wakes a reader waiting for room
+            self._queue.close()
+
+    def _attach(self, stream):
+        """Called with the CLI's stream once it has started."""
+        with self._lock:
+            self._stream = stream
+        if self._stop.is_set():
+            stream.close()
+
+    def _deliver(self, message):
+        if not self._stop.is_set():
+            self._callback(message)
+
+    def _run(self, cmdarray):
+        try:
+            if not self._stop.is_set():
+                callback = self._deliver
+                if self._queue is not None:
+                    self._dispatcher.start()
+                    callback = self._queue.put
+                if self._restart is None:
+                    _run_long_command(cmdarray, callback, self, self._types, self._typed)
+                else:
+                    self._supervise(cmdarray, callback)
+        except Exception as err:
+            self._fail(err)
+        finally:
+            if self._queue is not None:
+                # The callback gets the events already queued, unless the stream was stopped
+                self._queue.close()
+                if self._dispatcher.ident is not None:
+                    self._dispatcher.join()
+            with _live_streams_lock:
+                _live_streams.discard(self)
+            if self._done is not None:
+                self._done(self)
+
+    def _supervise(self, cmdarray, callback):
+        """Runs the stream, starting it again whenever it ends by itself, until stopped."""
+        policy = self._restart
+        restart = 0
+        while True:
+            started = time.monotonic()
+            error = None
+            try:
+                _run_long_command(cmdarray, callback, self, self._types, self._typed)
+            except Exception as err:
+                error = err
+            if self._stop.is_set():
+                return
+            ended = time.monotonic()
+            if ended - started >= policy.reset_after:
+                restart = 0
+            if error is None:
+                returncode = self._stream.returncode if self._stream is not None else None
+                if returncode == 0 and _stream_duration(self.args):
+                    # Ran for the time asked for
+                    return
+                error = SpeedifyError("speedify_cli exited with code " + str(returncode))
+            logger.warning("Stream " + _command_name(self.args) + " ended, restarting: " + str(error))
+
+            # Waits until the daemon answers again
+            reason = error.message if isinstance(error, SpeedifyError) else str(error)
+            while True:
+                restart += 1
+                if policy.gives_up(restart):
+                    raise error
+                if self._stop.wait(policy.backoff_delay(restart)):
+                    return
+                try:
+                    snapshot = self._snapshot()
+                except SpeedifyError as err:
+                    error = err
+                    continue
+                break
+
+            self.restarts += 1
+            gap = {"seconds": time.monotonic() - ended, "restarts": restart, "error": reason}
+            for message in [["gap", gap]] + snapshot:
+                if self._typed:
+                    message = events.from_message(message)
+                _do_callback(callback, message)
+
+    def _snapshot(self):
+        """Returns the events re-priming the callback after a gap: the current state and adapters."""
+        if self.args[0] != "stats":
+            return []
+        tags = self._types.tags
+        snapshot = []
+        if tags is None or b"state" in tags:
+            snapshot.append(["state", self._fresh(["state"])])
+        if tags is None or b"adapters" in tags:
+            snapshot.append(["adapters", self._fresh(["show", "adapters"])])
+        if not snapshot:
+            # Still checks the daemon answers before restarting
+            self._fresh(["state"])
+        return snapshot
+
+    def _fresh(self, args):
+        """
+        Runs a read for the snapshot on the stream's client, bypassing its cache and
+        coalescing (what they hold may predate the outage), and refreshes the cache.
+        """
+        client = _active_client()
+        cache = client.cache
+        generation = cache.generation if cache is not None else None
+        if hooks._registered:
+            result = hooks._run_hooked(args, client._run_retried, args, None)
+        else:
+            result = client._run_retried(args, None)
+        if cache is not None:
+            cache.update(args, result, generation)
+        return result
+
+    def _dispatch(self):
+        """Calls the callback with the queued events, on its own thread."""
+        try:
+            for message in self._queue:
+                _do_callback(self._deliver, message)
+        except Exception as err:
+            # As when the callback runs on the reading thread, its errors end the stream
+            self._fail(err)
+            self._halt()
+
+    def _fail(self, err):
+        if self.error is None:
+            self.error = err
+        logger.error("Stream " + _command_name(self.args) + " failed: " + str(err))
+
+
+def _stream_duration(args):
+    """Returns the seconds a stream command was asked to run for, or 0 if it runs until stopped."""
+    index = 2 if args[:2] == ["safebrowsing", "errors"] else 1
+    if len(args) > index and args[index].isdigit():
+        return int(args[index])
+    return 0
+
+
+# Handles whose streams are running, stopped at exit so no CLI process is left behind
+_live_streams = set()
+_live_streams_lock = threading.Lock()
+
+
+@atexit.register
+def _stop_live_streams():
+    with _live_streams_lock:
+        handles = list(_live_streams)
+    for handle in handles:
+        handle.stop(timeout=5)
+
+
 #
 # Internal functions
 #
 
 
-def _run_speedify_cmd(args, cmdtimeout: int = 60):
+def _run_speedify_cmd(args, cmdtimeout: int = None, progress=None):
     """
     Core function that executes Speedify CLI commands and parses JSON responses.
 
@@ -2621,109 +4103,379 @@ def _run_speedify_cmd(args, cmdtimeout: int = 60):
     - Exit code 1: API error from daemon, structured JSON error in stderr
     - Exit code 2-4: CLI parameter errors, plain text error messages
 
+    Some commands (connect, speedtest, streamtest) print progress reports before the
+    result.  With a progress function, the output is read as it is printed and every
+    object, the result included, is passed to it on arrival.
+
+    The command runs through the active SpeedifyClient (the default client unless one was
+    activated), which supplies the CLI path, spawn flags and timeouts.  If a command
+    interceptor is active in the current context (see speedify.aio), the arguments are
+    handed to it instead.  Hooks added with speedify.hooks.add_hook() are called
+    before and after the command.
+
     :param args: List of command arguments to pass to speedify_cli (e.g., ["connect", "closest"])
     :type args: list
-    :param cmdtimeout: Maximum time in seconds to wait for command completion (default: 60)
+    :param cmdtimeout: Maximum time in seconds to wait for command completion (default: the client's timeout for the command, normally 60)
     :type cmdtimeout: int
+    :param progress: Optional function called with each JSON object the command prints, as it is printed.
+    :type progress: function
     :returns: dict -- Parsed JSON response object from the CLI
     :raises SpeedifyError: For general CLI errors, timeouts, or invalid output
     :raises SpeedifyAPIError: For API errors returned by the Speedify daemon (exit code 1)
     """
-    resultstr = ""
-    try:
-        # Build the full command: CLI path + "-s" flag for single-line JSON + user arguments
-        cmd = [get_cli(), "-s"] + args
-
-        # Execute the CLI command with appropriate settings
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,  # Capture stdout for JSON response
-            stderr=subprocess.PIPE,  # Capture stderr for error messages
-            shell=use_shell(),       # Platform-specific: True on Windows, False on Unix
-            check=True,              # Raise CalledProcessError on non-zero exit
-            timeout=cmdtimeout,      # Prevent indefinite hangs
-        )
+    interceptor = _cmd_interceptor.get()
+    if interceptor is not None:
+        return interceptor(args, cmdtimeout, progress)
+    if hooks._registered:
+        return hooks._run_hooked(args, _active_client().run, args, cmdtimeout, progress)
+    return _active_client().run(args, cmdtimeout, progress)
 
-        # Parse the JSON response from stdout
-        resultstr = result.stdout.decode("utf-8").strip()
 
-        # With -s flag, CLI outputs one JSON object per line
-        # Split by newlines and take the last non-empty line
-        lines = [line for line in resultstr.split('\n') if line.strip()]
+def _parse_cmd_output(args, stdout):
+    """
+    Parses the stdout of a successful speedify_cli command.
 
-        if len(lines) > 0:
-            # Parse and return the last JSON object (the final result)
-            return json.loads(lines[-1])
+    With the -s flag, the CLI outputs one JSON object per line; the last non-empty
+    line holds the final result.  It is found by scanning back from the end of the
+    raw bytes, so earlier lines (and large outputs like show servers) are never
+    decoded or copied.
 
+    :param args: The command arguments, used for error messages.
+    :type args: list
+    :param stdout: Raw stdout of the CLI process.
+    :type stdout: bytes
+    :returns: dict -- Parsed JSON response object from the CLI
+    :raises SpeedifyError: If there was no output, or it was not valid JSON
+    """
+    line = _last_line(stdout)
+    if line is None:
         # No output received (shouldn't happen with a successful exit code)
         logger.error("command " + args[0] + " had NO records")
         raise SpeedifyError("No output from command " + args[0])
 
-    except subprocess.TimeoutExpired:
-        logger.error("Command timed out")
-        raise SpeedifyError("Command timed out: " + args[0])
+    try:
+        # Parse and return the last JSON object (the final result)
+        return _json_loads(line)
     except ValueError:
         # JSON parsing failed - CLI returned non-JSON or malformed JSON
-        logger.error("Running cmd, bad json: (" + resultstr + ")")
+        logger.error("Running cmd, bad json: (" + line.decode("utf-8", "replace") + ")")
         raise SpeedifyError("Invalid output from CLI")
-    except subprocess.CalledProcessError as cpe:
+
+
+def _last_line(data):
+    """
+    Returns the last line of data that isn't only whitespace, stripped, or None.
+
+    :param data: Raw command output.
+    :type data: bytes
+    :returns: bytes -- The line.
+    """
+    end = len(data or b"")
+    while end > 0:
+        start = data.rfind(b"\n", 0, end) + 1
+        line = data[start:end].strip()
+        if line:
+            return line
+        end = start - 1
+    return None
+
+
+def _json_loads(data):
+    """
+    Parses JSON from bytes, with orjson if it is installed.
+
+    :param data: UTF-8 encoded JSON.
+    :type data: bytes
+    :returns: The parsed value.
+    :raises ValueError: If data is not valid JSON.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects a few inputs json accepts (e.g. NaN): give json the last word
+            pass
+    # Decoding first is faster than letting json detect the encoding of bytes
+    return json.loads(data.decode("utf-8"))
+
+
+# The type tag at the start of a stats line, e.g. b'["adapters",[...]]' -> b"adapters"
+_EVENT_TYPE = re.compile(rb'\[\s*"([^"\\]*)"')
+
+
+class _EventTypes:
+    """
+    The event types a stream's consumers want, as the encoded type tags of their
+    lines.  Can be changed while the stream runs.
+    """
+
+    __slots__ = ("tags",)
+
+    def __init__(self, types=None):
+        self.set(types)
+
+    def set(self, types):
+        """
+        :param types: Event type names, e.g. ["state"], or None for all.
+        :type types: list
+        """
+        self.tags = None if types is None else frozenset(t.encode("utf-8") for t in types)
+
+
+class _StreamLines:
+    """
+    Parses the lines of a long-running command.  Shared by _iter_long_command() and
+    speedify.aio.
+
+    Events whose type isn't wanted are recognized by the type tag at the start of
+    their line and skipped without being parsed, so a consumer of state events
+    doesn't pay for decoding large connection_stats payloads.  Lines without a
+    type tag (safebrowsing errors) are always parsed.  The events read and skipped
+    are added to the metrics about once a second while the stream runs.
+
+    With typed, tagged lines are returned as speedify.events classes, which parse
+    them on first access.
+    """
+
+    def __init__(self, metrics, command, types=None, typed=False):
+        self.metrics = metrics
+        self.command = command
+        self.types = types
+        self.typed = typed
+        self.stdout_bytes = 0
+        self.parse_seconds = 0.0
+        self._events = 0
+        self._skipped = 0
+        self._flushed = time.monotonic()
+
+    def parse(self, line):
+        """
+        :param line: One line of stdout.
+        :type line: bytes
+        :returns: The JSON object on the line, or _MISSING if it is empty or skipped.
+        :raises ValueError: If the line isn't JSON.
+        """
+        self.stdout_bytes += len(line)
+        line = line.strip()
+        if not line:
+            return _MISSING
+        self._events += 1
+        tags = self.types.tags if self.types is not None else None
+        if tags is not None or self.typed:
+            match = _EVENT_TYPE.match(line)
+            if match is not None:
+                if tags is not None and match.group(1) not in tags:
+                    self._skipped += 1
+                    self._count()
+                    return _MISSING
+                if self.typed:
+                    self._count()
+                    return events._from_line(match.group(1), line)
+        start = time.perf_counter()
+        message = _json_loads(line)
+        self.parse_seconds += time.perf_counter() - start
+        self._count()
+        return message if message else _MISSING
+
+    def flush(self):
+        """Adds the events counted so far to the metrics."""
+        if self._events:
+            self.metrics.record_events(self.command, self._events, self._skipped)
+            self._events = self._skipped = 0
+        self._flushed = time.monotonic()
+
+    def _count(self):
+        if time.monotonic() - self._flushed >= 1:
+            self.flush()
+
+
+class _OutputLines:
+    """
+    Parses the output of a speedify_cli command one line at a time, as it is printed.
+
+    Shared by SpeedifyClient.run_iter() and speedify.aio.  A line that isn't JSON
+    stops parsing, but is only reported once the exit code is known, since failing
+    commands may print plain text.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.last_line = b""
+        self.bad_line = None
+        self.count = 0
+        self.stdout_bytes = 0
+        self.parse_seconds = 0.0
+
+    def parse(self, line):
+        """
+        :param line: One line of stdout.
+        :type line: bytes
+        :returns: The JSON object on the line, or _MISSING if there is none.
+        """
+        self.stdout_bytes += len(line)
+        line = line.strip()
+        if not line:
+            return _MISSING
+        self.last_line = line
+        if self.bad_line is not None:
+            return _MISSING
+        start = time.perf_counter()
+        try:
+            result = _json_loads(line)
+        except ValueError:
+            self.bad_line = line
+            return _MISSING
+        finally:
+            self.parse_seconds += time.perf_counter() - start
+        self.count += 1
+        return result
+
+    def error(self, returncode, stderr):
+        """
+        :param returncode: Exit code of the CLI process.
+        :type returncode: int
+        :param stderr: Raw stderr of the CLI process.
+        :type stderr: bytes
+        :returns: SpeedifyError -- The error to raise now that the command has ended, or None.
+        """
+        if returncode != 0:
+            # The CLI command failed with a non-zero exit code
+            return _cmd_error(returncode, self.last_line, stderr)
+        if self.bad_line is not None:
+            logger.error("Running cmd, bad json: (" + self.bad_line.decode("utf-8", "replace") + ")")
+            return SpeedifyError("Invalid output from CLI")
+        if not self.count:
+            logger.error("command " + self.args[0] + " had NO records")
+            return SpeedifyError("No output from command " + self.args[0])
+        return None
+
+
+def _record_and_parse(metrics, args, seconds, returncode, stdout, stderr):
+    """
+    Records a finished command in a MetricsRegistry, then returns its parsed
+    result or raises its error.  Shared with speedify.aio.
+
+    :param metrics: The registry to record in.
+    :type metrics: speedify.metrics.MetricsRegistry
+    :param args: The command arguments.
+    :type args: list
+    :param seconds: How long the command ran.
+    :type seconds: float
+    :param returncode: Exit code of the CLI process.
+    :type returncode: int
+    :param stdout: Raw stdout of the CLI process.
+    :type stdout: bytes
+    :param stderr: Raw stderr of the CLI process.
+    :type stderr: bytes
+    :returns: dict -- Parsed JSON response object from the CLI
+    """
+    command = _command_name(args)
+    stdout_bytes = len(stdout or b"")
+    if returncode != 0:
+        _record_process(metrics, command, seconds, returncode, returncode, stdout_bytes)
         # The CLI command failed with a non-zero exit code
-        # Try stderr first (daemon errors), fall back to stdout if stderr is empty
-        out = cpe.stderr.decode("utf-8").strip()
-        if not out:
-            out = cpe.stdout.decode("utf-8").strip()
-
-        returncode = cpe.returncode
-
-        # Map exit codes to error categories
-        # Exit code meanings from speedify_cli:
-        # 1 = API error from daemon (structured JSON error)
-        # 2 = Invalid parameter value
-        # 3 = Missing required parameter
-        # 4 = Unknown/unrecognized parameter
-        errorKind = "Unknown"
-        if returncode == 1:
-            errorKind = "Speedify API"
-        elif returncode == 2:
-            errorKind = "Invalid Parameter"
-        elif returncode == 3:
-            errorKind = "Missing Parameter"
-        elif returncode == 4:
-            errorKind = "Unknown Parameter"
-            # Exit code 4 returns full usage message, just raise generic error
-            raise SpeedifyError(errorKind)
-
-        # Parse the error based on exit code
-        newerror = None
-        if returncode == 1:
-            # Exit code 1 means daemon returned a structured JSON error
-            try:
-                job = json.loads(out)
-                if "errorCode" in job:
-                    # Successfully parsed JSON error from daemon
-                    newerror = SpeedifyAPIError(
-                        job["errorCode"], job["errorType"], job["errorMessage"]
-                    )
-            except ValueError:
-                # JSON parsing failed, treat as generic error
-                logger.error("Could not parse Speedify API Error: " + out)
-                newerror = SpeedifyError(errorKind + ": Could not parse error message")
-        else:
-            # Exit codes 2-3 return plain text errors, extract last non-empty line
-            lastline = [i for i in out.split("\n") if i][-1]
-            if lastline:
-                newerror = SpeedifyError(str(lastline))
-            else:
-                newerror = SpeedifyError(errorKind + ": " + str("Unknown error"))
+        raise _cmd_error(returncode, stdout, stderr)
 
-        # Raise the constructed error
-        if newerror:
-            raise newerror
+    parse_start = time.perf_counter()
+    try:
+        result = _parse_cmd_output(args, stdout)
+    except SpeedifyError:
+        _record_process(
+            metrics, command, seconds, returncode, INVALID_OUTPUT, stdout_bytes, time.perf_counter() - parse_start
+        )
+        raise
+    _record_process(metrics, command, seconds, returncode, None, stdout_bytes, time.perf_counter() - parse_start)
+    return result
+
+
+def _record_process(metrics, command, seconds, returncode, error=None, stdout_bytes=0, parse_seconds=0.0):
+    """
+    Records a CLI process that ended in a MetricsRegistry, and in the CommandCall
+    seen by hooks, if any are added (see speedify.hooks).
+
+    :param returncode: Exit code of the process, None if it was stopped.
+    :type returncode: int
+    :param error: None if the command succeeded, else its exit code or INVALID_OUTPUT.
+    """
+    metrics.record(command, seconds, error, stdout_bytes, parse_seconds)
+    if hooks._registered:
+        hooks._note_process(returncode, stdout_bytes)
+
+
+def _cmd_error(returncode, stdout, stderr):
+    """
+    Builds the exception for a speedify_cli command that exited with a non-zero code.
+
+    Shared by the synchronous and asyncio (speedify.aio) command runners so both
+    map exit codes to the same errors.
+
+    :param returncode: Exit code of the CLI process.
+    :type returncode: int
+    :param stdout: Raw stdout of the CLI process.
+    :type stdout: bytes
+    :param stderr: Raw stderr of the CLI process.
+    :type stderr: bytes
+    :returns: SpeedifyError -- The error to raise (a SpeedifyAPIError for daemon errors),
+        with returncode set.
+    """
+    error = _exit_code_error(returncode, stdout, stderr)
+    error.returncode = returncode
+    return error
+
+
+def _exit_code_error(returncode, stdout, stderr):
+    # Try stderr first (daemon errors), fall back to stdout if stderr is empty
+    out = (stderr or b"").decode("utf-8").strip()
+    if not out:
+        out = (stdout or b"").decode("utf-8").strip()
+
+    # Map exit codes to error categories
+    # Exit code meanings from speedify_cli:
+    # 1 = API error from daemon (structured JSON error)
+    # 2 = Invalid parameter value
+    # 3 = Missing required parameter
+    # 4 = Unknown/unrecognized parameter
+    errorKind = "Unknown"
+    if returncode == 1:
+        errorKind = "Speedify API"
+    elif returncode == 2:
+        errorKind = "Invalid Parameter"
+    elif returncode == 3:
+        errorKind = "Missing Parameter"
+    elif returncode == 4:
+        errorKind = "Unknown Parameter"
+        # Exit code 4 returns full usage message, just raise generic error
+        return SpeedifyError(errorKind)
+
+    # Parse the error based on exit code
+    newerror = None
+    if returncode == 1:
+        # Exit code 1 means daemon returned a structured JSON error
+        try:
+            job = json.loads(out)
+            if "errorCode" in job:
+                # Successfully parsed JSON error from daemon
+                newerror = SpeedifyAPIError(
+                    job["errorCode"], job["errorType"], job["errorMessage"]
+                )
+        except ValueError:
+            # JSON parsing failed, treat as generic error
+            logger.error("Could not parse Speedify API Error: " + out)
+            newerror = SpeedifyError(errorKind + ": Could not parse error message")
+    else:
+        # Exit codes 2-3 return plain text errors, extract last non-empty line
+        lines = [i for i in out.split("\n") if i]
+        if lines:
+            newerror = SpeedifyError(str(lines[-1]))
         else:
-            # Fallback: treat the raw output as an error message
-            # This can happen with valid commands but invalid argument combinations
-            logger.error("runSpeedifyCmd CPE : " + out)
-            raise SpeedifyError(errorKind + ": " + str(": " + out))
+            newerror = SpeedifyError(errorKind + ": " + str("Unknown error"))
+
+    if newerror:
+        return newerror
+    # Fallback: treat the raw output as an error message
+    # This can happen with valid commands but invalid argument combinations
+    logger.error("runSpeedifyCmd CPE : " + out)
+    return SpeedifyError(errorKind + ": " + str(": " + out))
 
 
 #
@@ -2738,7 +4490,7 @@ def _run_speedify_cmd(args, cmdtimeout: int = 60):
 
 
 @exception_wrapper("SpeedifyError in longRunCommand")
-def _run_long_command(cmdarray, callback):
+def _run_long_command(cmdarray, callback, handle=None, types=None, typed=False):
     """
     Executes long-running Speedify CLI commands that stream multiple JSON responses.
 
@@ -2748,52 +4500,112 @@ def _run_long_command(cmdarray, callback):
     making parsing straightforward.
 
     Used internally by stats_callback() and safebrowsing_error_callback() to provide
-    real-time monitoring capabilities.
+    real-time monitoring capabilities.  The objects are read with _iter_long_command().
 
     :param cmdarray: Complete command array including CLI path and -s flag (e.g., ["/path/to/speedify_cli", "-s", "stats", "10"])
     :type cmdarray: list
     :param callback: Function to invoke with each parsed JSON object. Takes one argument: the JSON dict.
     :type callback: function
+    :param handle: The StreamHandle running the command in the background, if any.
+    :type handle: speedify.StreamHandle
+    :param types: The event types wanted, or None for all.
+    :type types: speedify._EventTypes
+    :param typed: Pass stats events as speedify.events classes.
+    :type typed: bool
     :returns: None
     """
-    with subprocess.Popen(cmdarray, stdout=subprocess.PIPE) as proc:
-        # With -s flag, each line is a complete JSON object
-        # Read and process each line as it becomes available
-        for line in proc.stdout:
-            line = line.decode("utf-8").strip()
+    for message in _iter_long_command(cmdarray, handle=handle, types=types, typed=typed):
+        _do_callback(callback, message)
+
 
-            if line:
-                # Non-empty line contains a complete JSON object
-                # Parse and invoke callback immediately
-                _do_callback(callback, line)
+def _iter_long_command(cmdarray, client=None, handle=None, types=None, typed=False):
+    """
+    Generator yielding the JSON objects a long-running command prints, as they are
+    printed, so memory use doesn't grow with how long it runs.  Events of types
+    that aren't wanted are skipped without being parsed (see _StreamLines).
+
+    The command is started by the transport of the client (by default the active
+    SpeedifyClient) once its scheduler allows, stopped when the generator is closed,
+    and recorded in the client's metrics once it ends.  Hooks added with
+    speedify.hooks.add_hook() are called when it starts and ends.
+
+    :param cmdarray: Complete command array including CLI path and -s flag.
+    :type cmdarray: list
+    :param client: The client to run the command with.
+    :type client: speedify.SpeedifyClient
+    :param handle: The StreamHandle running the command in the background, if any.
+    :type handle: speedify.StreamHandle
+    :param types: The event types wanted, or None for all.
+    :type types: speedify._EventTypes
+    :param typed: Yield stats events as speedify.events classes.
+    :type typed: bool
+    :returns: generator -- The parsed JSON objects.
+    """
+    if client is None:
+        client = _active_client()
+    args = cmdarray[2:]
+    command = _command_name(args)
+    call = hooks._start_call(args) if hooks._registered else None
+    stream = None
+    lines = _StreamLines(client.metrics, command, types, typed)
+    error = None
+    try:
+        # Streams run until stopped, so they only count against the spawn rate
+        client.scheduler.acquire(args, hold=False)
+        start = time.perf_counter()
+        try:
+            stream = client.transport.stream(cmdarray)
+        except OSError:
+            client.metrics.record(command, time.perf_counter() - start, SPAWN_FAILED)
+            raise
+        if handle is not None:
+            handle._attach(stream)
+
+        finished = False
+        try:
+            with stream:
+                # With -s flag, each line is a complete JSON object
+                # Read and process each line as it becomes available
+                for line in stream:
+                    message = lines.parse(line)
+                    if message is not _MISSING:
+                        yield message
+                finished = True
+        finally:
+            lines.flush()
+            # Only a stream that ran to its end, rather than being stopped, can have failed
+            stopped = handle is not None and handle.stopped
+            failure = stream.returncode if finished and stream.returncode and not stopped else None
+            client.metrics.record(
+                command, time.perf_counter() - start, failure, lines.stdout_bytes, lines.parse_seconds
+            )
+    except GeneratorExit:
+        raise
+    except BaseException as err:
+        error = err
+        raise
+    finally:
+        if call is not None:
+            call.returncode = stream.returncode if stream is not None else None
+            call.stdout_bytes = lines.stdout_bytes
+            hooks._end_call(call, error)
 
 
 def _do_callback(callback, message):
     """
-    Helper function that parses a JSON string and invokes a callback with the result.
+    Helper function that invokes a callback with a JSON object from a long-running command.
 
-    Used by _run_long_command() to process buffered output. This function:
-    1. Attempts to parse the message string as JSON
-    2. If successful, invokes the callback with the parsed JSON object
-    3. Logs any parsing or callback execution errors without raising exceptions
+    Used by _run_long_command(). Errors raised by the callback as SpeedifyError are
+    logged without being raised.
 
     :param callback: Function to invoke with the parsed JSON object
     :type callback: function
-    :param message: String containing JSON to parse
-    :type message: str
-    :returns: None
+    :param message: The parsed JSON object
     """
-    jsonret = ""
     try:
-        if message:
-            jsonret = json.loads(message)
+        callback(message)
     except SpeedifyError as e:
-        logger.debug("problem parsing json: " + str(e))
-    if jsonret:
-        try:
-            callback(jsonret)
-        except SpeedifyError as e:
-            logger.warning("problem callback: " + str(e))
+        logger.warning("problem callback: " + str(e))
 
 
 # Default cli search locations
@@ -2843,3 +4655,31 @@ def _find_cli():
 
     logging.error("Could not find speedify_cli!")
     raise SpeedifyError("Speedify CLI not found")
+
+
+# Transports need SpeedifyError and the helpers above
+from .transports import (  # noqa: E402
+    FakeTransport,
+    RecordingTransport,
+    ReplayTransport,
+    Stream,
+    SubprocessTransport,
+    Transport,
+)
+from .prefork import PreforkSpawner  # noqa: E402
+from .scheduler import Lane, SpawnScheduler, default_scheduler  # noqa: E402
+from .retry import RestartPolicy, RetryPolicy  # noqa: E402
+from .hub import StatsHub  # noqa: E402
+from . import hooks  # noqa: E402
+from . import events  # noqa: E402
+from .dispatch import EventQueue, Overflow  # noqa: E402
+from .summary import LastEvents, StatsSummary  # noqa: E402
+from .timeseries import TimeSeriesRecorder  # noqa: E402
+from .rollup import StatsRollup  # noqa: E402
+from .metrics import (  # noqa: E402
+    INVALID_OUTPUT,
+    SPAWN_FAILED,
+    TIMEOUT,
+    MetricsRegistry,
+    default_registry,
+)
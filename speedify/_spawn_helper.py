@@ -0,0 +1,143 @@
+"""
+Helper process for speedify.prefork.PreforkSpawner.
+
+Started once by the parent and kept running.  It reads one JSON request per line
+on stdin, launches the requested command with os.posix_spawn, and streams the
+command's output back on stdout as frames:
+
+    1 byte kind, 4 byte big-endian payload length, payload
+
+    b"o"  a chunk of the command's stdout
+    b"e"  a chunk of the command's stderr
+    b"x"  the command exited, payload is the exit code as ascii
+    b"t"  the command timed out and was killed
+    b"f"  the command could not be started, payload is "<errno> <message>"
+
+Any line received on stdin while a command is running cancels it (the command is
+killed and reported with b"x").
+
+This file is run as a script and must only use the standard library.
+"""
+
+import json
+import os
+import selectors
+import signal
+import struct
+import sys
+import time
+
+_HEADER = struct.Struct(">cI")
+_CHUNK = 65536
+
+
+def _send(kind, payload=b""):
+    data = _HEADER.pack(kind, len(payload)) + payload
+    while data:
+        written = os.write(1, data)
+        data = data[written:]
+
+
+def _exit_code(status):
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return status
+
+
+def _spawn(argv):
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    file_actions = [
+        (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+        (os.POSIX_SPAWN_DUP2, out_w, 1),
+        (os.POSIX_SPAWN_DUP2, err_w, 2),
+    ]
+    spawn = os.posix_spawn if os.sep in argv[0] else os.posix_spawnp
+    try:
+        pid = spawn(argv[0], argv, os.environ, file_actions=file_actions)
+    except BaseException:
+        for fd in (out_r, out_w, err_r, err_w):
+            os.close(fd)
+        raise
+    os.close(out_w)
+    os.close(err_w)
+    return pid, out_r, err_r
+
+
+def _run(request, stdin_buffer):
+    try:
+        pid, out_r, err_r = _spawn(request["argv"])
+    except OSError as err:
+        _send(b"f", (str(err.errno) + " " + str(err.strerror)).encode("utf-8"))
+        return stdin_buffer
+
+    timeout = request.get("timeout")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    selector.register(out_r, selectors.EVENT_READ, b"o")
+    selector.register(err_r, selectors.EVENT_READ, b"e")
+    selector.register(0, selectors.EVENT_READ, None)
+    open_pipes = 2
+    timed_out = False
+    try:
+        while open_pipes:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                timed_out = True
+                break
+            for key, _ in selector.select(wait):
+                if key.data is None:
+                    data = os.read(0, _CHUNK)
+                    if not data:
+                        # Parent went away: stop the command and exit
+                        os.kill(pid, signal.SIGKILL)
+                        os.waitpid(pid, 0)
+                        sys.exit(0)
+                    stdin_buffer += data
+                    if b"\n" in stdin_buffer:
+                        # Cancel request
+                        stdin_buffer = stdin_buffer.split(b"\n", 1)[1]
+                        os.kill(pid, signal.SIGKILL)
+                    continue
+                data = os.read(key.fd, _CHUNK)
+                if data:
+                    _send(key.data, data)
+                else:
+                    selector.unregister(key.fd)
+                    open_pipes -= 1
+    finally:
+        selector.close()
+        os.close(out_r)
+        os.close(err_r)
+
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        _send(b"t")
+    else:
+        _, status = os.waitpid(pid, 0)
+        _send(b"x", str(_exit_code(status)).encode("ascii"))
+    return stdin_buffer
+
+
+def main():
+    stdin_buffer = b""
+    while True:
+        while b"\n" not in stdin_buffer:
+            data = os.read(0, _CHUNK)
+            if not data:
+                return
+            stdin_buffer += data
+        line, stdin_buffer = stdin_buffer.split(b"\n", 1)
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        # A cancel that arrived after its command finished has nothing to do
+        if "argv" in request:
+            stdin_buffer = _run(request, stdin_buffer)
+
+
+if __name__ == "__main__":
+    main()
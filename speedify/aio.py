@@ -0,0 +1,541 @@
+"""
+.. module:: speedify.aio
+   :synopsis: asyncio interface to the Speedify CLI
+
+Awaitable equivalents of the command wrappers in the speedify module.  Every
+public function that talks to the daemon through speedify_cli (connect,
+show_adapters, adapter_priority, streamingbypass_*, ...) is available here
+under the same name and with the same arguments, but runs the CLI with
+asyncio.create_subprocess_exec instead of blocking in subprocess.run.
+
+Errors are mapped exactly as in the synchronous API: exit code 1 raises
+SpeedifyAPIError, exit codes 2-4, timeouts and bad output raise SpeedifyError.
+
+The async wrappers are generated from the synchronous ones, so argument
+handling and result conversion (e.g. show_state() returning a State) stay in
+one place.
+
+Example:
+    import asyncio
+    from speedify import aio
+
+    async def main():
+        state, adapters = await asyncio.gather(aio.show_state(), aio.show_adapters())
+        await aio.connect_closest()
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import contextvars
+import copy
+import inspect
+import logging
+import subprocess
+import time
+import weakref
+from functools import wraps
+
+import speedify
+from speedify import (
+    SpeedifyError,
+    SpeedifyTimeoutError,
+    SubprocessTransport,
+    _MISSING,
+    _cmd_interceptor,
+    _command_name,
+    _is_read_only,
+    _record_and_parse,
+    _record_process,
+)
+from speedify import hooks
+from speedify.metrics import INVALID_OUTPUT, SPAWN_FAILED, TIMEOUT
+from speedify.summary import LastEvents, StatsSummary
+
+logger = logging.getLogger(__name__)
+
+# Longest line read from a command's output when following its progress
+_LINE_LIMIT = 16 * 1024 * 1024
+
+# Public functions in speedify that are not CLI command wrappers, that
+# stream output through _run_long_command() or generators rather than
+# _run_speedify_cmd(), or that run commands on threads.
+_NOT_MIRRORED = speedify._NOT_COMMANDS | {
+    "batch",
+    "connect_iter",
+    "speedtest_iter",
+    "streamtest_iter",
+    "stats",
+    "stats_callback",
+    "safebrowsing_error",
+    "safebrowsing_error_callback",
+    "safebrowsing_error_stream",
+    "stats_stream",
+    "iter_stats",
+    "astats",
+    "asafebrowsing_errors",
+}
+
+
+async def _run_speedify_cmd(args, cmdtimeout: int = None, progress=None):
+    """
+    Asyncio counterpart of speedify._run_speedify_cmd().
+
+    Runs speedify_cli with the -s flag and parses the last JSON line of its output.
+    The CLI path, timeouts and read cache of the active SpeedifyClient are used, and
+    identical read-only commands awaited at the same time share one CLI process (if
+    the client coalesces commands).  Hooks added with speedify.hooks.add_hook() are
+    called before and after the command.
+
+    :param args: List of command arguments to pass to speedify_cli (e.g., ["connect", "closest"])
+    :type args: list
+    :param cmdtimeout: Maximum time in seconds to wait for command completion (default: the client's timeout for the command)
+    :type cmdtimeout: int
+    :param progress: Optional function called on the event loop with each JSON object the command prints, as it is printed.
+    :type progress: function
+    :returns: dict -- Parsed JSON response object from the CLI
+    :raises SpeedifyError: For general CLI errors, timeouts, or invalid output
+    :raises SpeedifyAPIError: For API errors returned by the Speedify daemon (exit code 1)
+    """
+    if not hooks._registered:
+        return await _run_client_cmd(args, cmdtimeout, progress)
+
+    call, token = hooks._begin(args)
+    try:
+        result = await _run_client_cmd(args, cmdtimeout, progress)
+    except BaseException as err:
+        hooks._finish(call, token, err)
+        raise
+    hooks._finish(call, token)
+    return result
+
+
+async def _run_client_cmd(args, cmdtimeout, progress):
+    client = speedify._active_client()
+    cache = client.cache
+    if cache is None:
+        return await _run_uncached(client, args, cmdtimeout, progress)
+
+    if progress is None:
+        result = cache.lookup(args)
+        if result is not _MISSING:
+            return result
+    generation = cache.generation
+    try:
+        result = await _run_uncached(client, args, cmdtimeout, progress)
+    except BaseException:
+        cache.update(args, _MISSING, generation)
+        raise
+    cache.update(args, result, generation)
+    return result
+
+
+# Coalesced commands in flight, per event loop: {(client, argv, timeout): [task, awaiters, awaiters still waiting]}
+_inflight = weakref.WeakKeyDictionary()
+
+
+async def _run_uncached(client, args, cmdtimeout, progress=None):
+    if progress is not None or not client.coalesce or not _is_read_only(args):
+        return await _run_retried(client, args, cmdtimeout, progress)
+
+    inflight = _inflight.setdefault(asyncio.get_event_loop(), {})
+    key = (client, tuple(args), cmdtimeout)
+    entry = inflight.get(key)
+    if entry is None:
+        task = asyncio.ensure_future(_run_retried(client, args, cmdtimeout))
+        entry = inflight[key] = [task, 0, 0]
+
+        def forget(task):
+            inflight.pop(key, None)
+            if not task.cancelled():
+                task.exception()  # retrieved, even if every awaiter was cancelled
+
+        task.add_done_callback(forget)
+    entry[1] += 1
+    entry[2] += 1
+
+    # Shielded so one awaiter being cancelled doesn't cancel the command for the others
+    try:
+        result = await asyncio.shield(entry[0])
+    except asyncio.CancelledError:
+        entry[2] -= 1
+        if entry[2] == 0:
+            # Nobody is left waiting: kill the CLI, and let new callers start afresh
+            if inflight.get(key) is entry:
+                del inflight[key]
+            entry[0].cancel()
+        raise
+    entry[2] -= 1
+    if entry[1] > 1:
+        result = copy.deepcopy(result)
+    return result
+
+
+async def _run_retried(client, args, cmdtimeout, progress=None):
+    if client.retry is None or progress is not None:
+        return await _execute(client, args, cmdtimeout, progress)
+    return await client.retry.run_async(client, args, cmdtimeout, _execute)
+
+
+async def _execute(client, args, cmdtimeout, progress=None):
+    if not isinstance(client.transport, SubprocessTransport):
+        # Other transports (prefork, fake, replay) block: keep them off the event loop
+        loop = asyncio.get_running_loop()
+        report = None
+        if progress is not None:
+            def report(result):
+                loop.call_soon_threadsafe(progress, result)
+        # With the caller's context, for hooks and lanes
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, client._execute, args, cmdtimeout, report)
+
+    await client.scheduler.acquire_async(args)
+    try:
+        return await _run_subprocess(client, args, cmdtimeout, progress)
+    finally:
+        client.scheduler.release()
+
+
+async def _run_subprocess(client, args, cmdtimeout, progress):
+    cmd = client.command_line(args)
+    timeout = client.timeout_for(args, cmdtimeout)
+    command = _command_name(args)
+    start = time.perf_counter()
+    # If the awaiting task is cancelled, the CLI process is killed.
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, limit=_LINE_LIMIT
+        )
+    except OSError:
+        client.metrics.record(command, time.perf_counter() - start, SPAWN_FAILED)
+        raise
+    try:
+        if progress is not None:
+            return await asyncio.wait_for(_read_progress(client, proc, args, progress, start), timeout)
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        client.metrics.record(command, time.perf_counter() - start, TIMEOUT)
+        logger.error("Command timed out")
+        raise SpeedifyTimeoutError("Command timed out: " + args[0])
+    except BaseException:
+        # Cancelled: don't leave the CLI running behind us
+        if proc.returncode is None:
+            proc.kill()
+        raise
+
+    return _record_and_parse(
+        client.metrics, args, time.perf_counter() - start, proc.returncode, stdout, stderr
+    )
+
+
+async def _read_progress(client, proc, args, progress, start):
+    """Reads a command's output line by line, passing each JSON object to progress."""
+    stderr = asyncio.ensure_future(proc.stderr.read())
+    output = speedify._OutputLines(args)
+    result = _MISSING
+    try:
+        async for line in proc.stdout:
+            parsed = output.parse(line)
+            if parsed is not _MISSING:
+                result = parsed
+                progress(result)
+        await proc.wait()
+        error = output.error(proc.returncode, await stderr)
+    finally:
+        stderr.cancel()
+    _record_process(
+        client.metrics,
+        _command_name(args),
+        time.perf_counter() - start,
+        proc.returncode,
+        None if error is None else proc.returncode or INVALID_OUTPUT,
+        output.stdout_bytes,
+        output.parse_seconds,
+    )
+    if error is not None:
+        raise error
+    return result
+
+
+def iter_stats(duration: int = None, periods=(), networksharing: bool = False, types=None, typed: bool = False):
+    """
+    Asyncio counterpart of speedify.iter_stats(), also available as speedify.astats().
+
+    Returns an async iterator over the stats events, read from the CLI line by line
+    without a thread per stream.  Leaving the loop, cancelling the task or closing
+    the iterator kills and reaps the CLI.  Events not in types are skipped without
+    being parsed.
+
+    Example:
+        async for event_type, data in aio.iter_stats():
+            ...
+
+        # Stops the CLI as soon as the block is left, rather than when the
+        # iterator is garbage collected
+        async with contextlib.aclosing(aio.iter_stats(periods=["day"])) as events:
+            async for event_type, data in events:
+                ...
+
+    :param duration: Seconds to run the stats command.  None (or 0) runs until closed.
+    :type duration: int
+    :param periods: Up to 5 periods to report usage for: "current", "day", "week", "month", "total" or a
+        number of hours (an int or a string such as "24").
+    :type periods: list
+    :param networksharing: Include Pair & Share stats.
+    :type networksharing: bool
+    :param types: Event types to yield, e.g. ["state", "adapters"], or None for all.
+    :type types: list
+    :param typed: Yield speedify.events classes (StateEvent, AdaptersEvent...) instead of lists.
+    :type typed: bool
+    :returns: async generator -- The stats events.
+    """
+    args = speedify._stats_args(duration, periods, networksharing)
+    return _iter_long_command(speedify._active_client(), args, speedify._EventTypes(types), typed)
+
+
+def iter_safebrowsing_errors(duration: int = None):
+    """
+    Returns an async iterator over the safe browsing errors, like iter_stats().
+    Also available as speedify.asafebrowsing_errors().
+
+    :param duration: Seconds to run the command.  None (or 0) runs until closed.
+    :type duration: int
+    :returns: async generator -- The errors.
+    """
+    return _iter_long_command(speedify._active_client(), ["safebrowsing", "errors", str(duration or 0)])
+
+
+async def stats(time: int = 1, last: int = None, summary: bool = False):
+    """
+    Asyncio counterpart of speedify.stats(): the stats events printed in time seconds.
+
+    :param time: How long to run the stats command.
+    :type time: int
+    :param last: Keep only the last events of each type.
+    :type last: int
+    :param summary: Return a speedify.summary.StatsSummary instead of the events.
+    :type summary: bool
+    :returns: list -- The stats events.
+    """
+    if time == 0:
+        raise SpeedifyError("Stats cannot be run with 0")
+    if summary:
+        if last is not None:
+            raise SpeedifyError("stats can't keep both the last events and a summary")
+        result = StatsSummary()
+    elif last is not None:
+        result = LastEvents(last)
+    else:
+        return [event async for event in iter_stats(time)]
+    async for event in iter_stats(time):
+        result.add(event)
+    return result if summary else result.events()
+
+
+async def safebrowsing_error(time: int = 1, last: int = None):
+    """
+    Asyncio counterpart of speedify.safebrowsing_error(): the errors printed in time seconds.
+
+    :param time: How long to run the safebrowsing errors command.
+    :type time: int
+    :param last: Keep only the last errors.
+    :type last: int
+    :returns: list -- The errors.
+    """
+    if time == 0:
+        raise SpeedifyError("safebrowsing error cannot be run with 0, would never return")
+    if last is None:
+        return [error async for error in iter_safebrowsing_errors(time)]
+    result = LastEvents(last)
+    async for error in iter_safebrowsing_errors(time):
+        result.add(error)
+    return result.events()
+
+
+async def _iter_long_command(client, args, types=None, typed=False):
+    """
+    Asyncio counterpart of speedify._iter_long_command(): yields the JSON objects a
+    long-running command prints, and kills the CLI when closed or cancelled.
+    """
+    command = _command_name(args)
+    call = hooks._start_call(args) if hooks._registered else None
+    lines = None
+    output = speedify._StreamLines(client.metrics, command, types, typed)
+    error = None
+    try:
+        # Streams run until stopped, so they only count against the spawn rate
+        await client.scheduler.acquire_async(args, hold=False)
+        start = time.perf_counter()
+        try:
+            lines = await _open_lines(client, client.command_line(args))
+        except OSError:
+            client.metrics.record(command, time.perf_counter() - start, SPAWN_FAILED)
+            raise
+
+        finished = False
+        try:
+            async for line in lines:
+                message = output.parse(line)
+                if message is not _MISSING:
+                    yield message
+            finished = True
+        finally:
+            await lines.close()
+            output.flush()
+            # Only a stream that ran to its end, rather than being stopped, can have failed
+            failure = lines.returncode if finished and lines.returncode else None
+            client.metrics.record(
+                command, time.perf_counter() - start, failure, output.stdout_bytes, output.parse_seconds
+            )
+    except GeneratorExit:
+        raise
+    except BaseException as err:
+        if not isinstance(err, asyncio.CancelledError):
+            error = err
+        raise
+    finally:
+        if call is not None:
+            call.returncode = lines.returncode if lines is not None else None
+            call.stdout_bytes = output.stdout_bytes
+            hooks._end_call(call, error)
+
+
+async def _open_lines(client, cmd):
+    if isinstance(client.transport, SubprocessTransport):
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, limit=_LINE_LIMIT)
+        return _ProcessLines(proc)
+    # Other transports block: read them on executor threads
+    return _ThreadedLines(client.transport.stream(cmd))
+
+
+class _ProcessLines:
+    """The output lines of an asyncio subprocess."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    def __aiter__(self):
+        return self.proc.stdout.__aiter__()
+
+    @property
+    def returncode(self):
+        return self.proc.returncode
+
+    async def close(self):
+        if self.proc.returncode is None:
+            self.proc.kill()
+        await self.proc.wait()
+
+
+class _ThreadedLines:
+    """The lines of a blocking transport Stream, each read on an executor thread."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lines = iter(stream)
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            line = await loop.run_in_executor(None, next, self._lines, None)
+            if line is None:
+                return
+            yield line
+
+    @property
+    def returncode(self):
+        return self.stream.returncode
+
+    async def close(self):
+        # Stream.close() may be called while another thread is reading
+        await asyncio.get_running_loop().run_in_executor(None, self.stream.close)
+
+
+class _PendingCommand(BaseException):
+    """Raised inside a synchronous wrapper when it needs a CLI result we don't have yet."""
+
+    def __init__(self, argv, cmdtimeout, progress):
+        self.argv = argv
+        self.cmdtimeout = cmdtimeout
+        self.progress = progress
+
+
+class _Replay:
+    """
+    Command interceptor that feeds already-collected CLI outcomes back into a
+    synchronous wrapper, in the order the wrapper asks for them.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.position = 0
+
+    def __call__(self, args, cmdtimeout, progress=None):
+        if self.position == len(self.outcomes):
+            raise _PendingCommand(args, cmdtimeout, progress)
+        result, error = self.outcomes[self.position]
+        self.position += 1
+        if error is not None:
+            raise error
+        return result
+
+
+def _make_async(function):
+    """
+    Turns a synchronous speedify wrapper into a coroutine function.
+
+    The wrapper is run with a _Replay interceptor installed.  Whenever it asks for a
+    command we haven't run yet, that command is awaited with the asyncio runner and
+    the wrapper is replayed with the extra outcome, until it returns or raises.
+    Wrappers are cheap, deterministic functions of their CLI results, so replaying
+    them is safe; most issue exactly one command.
+    """
+
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        if hooks._registered and hooks.current_operation() is None:
+            with hooks.operation(function.__name__):
+                return await replay(*args, **kwargs)
+        return await replay(*args, **kwargs)
+
+    async def replay(*args, **kwargs):
+        outcomes = []
+        while True:
+            token = _cmd_interceptor.set(_Replay(outcomes))
+            try:
+                return function(*args, **kwargs)
+            except _PendingCommand as pending:
+                command = pending
+            finally:
+                _cmd_interceptor.reset(token)
+
+            try:
+                outcomes.append(
+                    (await _run_speedify_cmd(command.argv, command.cmdtimeout, command.progress), None)
+                )
+            except SpeedifyError as err:
+                outcomes.append((None, err))
+
+    return wrapper
+
+
+def _mirror_wrappers():
+    names = []
+    for name, function in vars(speedify).items():
+        if (
+            name.startswith("_")
+            or name in _NOT_MIRRORED
+            or not inspect.isfunction(function)
+            or function.__module__ != speedify.__name__
+        ):
+            continue
+        globals()[name] = _make_async(function)
+        names.append(name)
+    return sorted(names)
+
+
+__all__ = sorted(
+    _mirror_wrappers() + ["iter_safebrowsing_errors", "iter_stats", "safebrowsing_error", "stats"]
+)
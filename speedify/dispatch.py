@@ -0,0 +1,167 @@
+"""
+.. module:: speedify.dispatch
+   :synopsis: Bounded queues between a stream's reader and its consumers
+
+A stream's callback normally runs on the thread reading the CLI's output, so a
+slow callback (a database write, a network call) stops the reading: the CLI
+blocks on its full pipe and the events are stale by the time they are handled.
+Given a queue_size, stats_stream() and safebrowsing_error_stream() read on one
+thread and call back from another, through an EventQueue.  StatsHub
+subscriptions are EventQueues too.
+
+When the queue is full, its Overflow policy decides what happens:
+
+- BLOCK: the reader waits for room, so nothing is lost but the CLI may stall
+- DROP_OLDEST: the oldest queued event is dropped, keeping the freshest
+- DROP_NEWEST: the new event is dropped
+- COALESCE: a queued event of the same type is replaced by the new one, in place,
+  so each type is only ever queued once (its latest value); if there is none, the
+  oldest event is dropped
+
+Dropped and coalesced events are counted.
+
+Example:
+    handle = speedify.stats_stream(0, save_to_database, queue_size=100, overflow="coalesce")
+    ...
+    print(handle.dropped, handle.coalesced)
+"""
+
+import queue
+import threading
+from collections import deque
+from enum import Enum
+
+from .events import StatsEvent
+
+
+class Overflow(Enum):
+    """What an EventQueue does with an event that doesn't fit."""
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    COALESCE = "coalesce"
+
+
+class EventQueue:
+    """
+    A thread-safe bounded queue of stream events.  Iterating over it blocks for
+    each event and stops once it is closed and empty.
+
+    :param maxsize: Most events queued.
+    :type maxsize: int
+    :param overflow: What to do with an event when the queue is full: an Overflow
+        or its value, e.g. "drop_oldest".
+    :type overflow: speedify.dispatch.Overflow
+    :ivar dropped: Events dropped because the queue was full.
+    :ivar coalesced: Events replaced by a newer event of the same type.
+    :ivar error: The error that ended the stream, if any.
+    """
+
+    def __init__(self, maxsize, overflow=Overflow.BLOCK):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.overflow = Overflow(overflow)
+        self.dropped = 0
+        self.coalesced = 0
+        self.error = None
+        # [type, event] entries; with COALESCE, the entry queued for each type
+        self._entries = deque()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._ended = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, event):
+        """
+        Queues an event, applying the overflow policy if the queue is full.
+        Events put once the queue is closed are ignored.
+
+        :param event: The event.
+        """
+        coalesce = self.overflow is Overflow.COALESCE
+        event_type = _type_of(event) if coalesce else None
+        with self._lock:
+            if coalesce and event_type is not None:
+                entry = self._pending.get(event_type)
+                if entry is not None:
+                    entry[1] = event
+                    self.coalesced += 1
+                    return
+            if len(self._entries) >= self.maxsize and not self._ended:
+                if self.overflow is Overflow.BLOCK:
+                    self._space.wait_for(lambda: len(self._entries) < self.maxsize or self._ended)
+                elif self.overflow is Overflow.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                else:
+                    self._forget(self._entries.popleft())
+                    self.dropped += 1
+            if self._ended:
+                return
+            entry = [event_type, event]
+            self._entries.append(entry)
+            if event_type is not None:
+                self._pending[event_type] = entry
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the next event, waiting for it if needed.
+
+        :param timeout: Most seconds to wait, or None to wait as long as it takes.
+        :type timeout: float
+        :returns: The event, e.g. ["adapters", [...]].
+        :raises queue.Empty: If no event arrived in time.
+        :raises EOFError: If the queue is closed and every event was read.
+        """
+        with self._lock:
+            if not self._ready.wait_for(lambda: self._entries or self._ended, timeout):
+                raise queue.Empty
+            if not self._entries:
+                raise EOFError("Event queue closed")
+            entry = self._entries.popleft()
+            self._forget(entry)
+            self._space.notify()
+            return entry[1]
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except EOFError:
+                return
+
+    @property
+    def closed(self):
+        """True once the queue has been closed."""
+        return self._ended
+
+    def close(self):
+        """Closes the queue.  The events already queued can still be read."""
+        self._end()
+
+    def _end(self, error=None):
+        with self._lock:
+            if not self._ended:
+                self._ended = True
+                self.error = error
+            self._ready.notify_all()
+            self._space.notify_all()
+
+    def _forget(self, entry):
+        """Called with the lock held when an entry leaves the queue."""
+        if entry[0] is not None and self._pending.get(entry[0]) is entry:
+            del self._pending[entry[0]]
+
+
+def _type_of(event):
+    """Returns the type of a stats event, or None for other events (safebrowsing errors)."""
+    if isinstance(event, (list, StatsEvent)) and event and isinstance(event[0], str):
+        return event[0]
+    return None
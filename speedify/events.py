@@ -0,0 +1,362 @@
+"""
+.. module:: speedify.events
+   :synopsis: Typed stats events, parsed lazily
+
+With typed=True, iter_stats(), stats_stream(), astats() and StatsHub yield these
+instead of ["state", {...}] lists.  The event is created from the raw line by
+looking at its type tag only: its JSON is parsed the first time its data (or a
+field) is read, so events that are dropped, coalesced or just counted are never
+parsed.  Every event carries received, the time.monotonic() at which its line
+was read.
+
+Event type names are interned, and so are adapter and connection IDs, state
+names and server tags as the event's data is parsed, so the same strings are
+shared by every event instead of being kept once per event.
+
+Events still unpack and index like the lists they replace, so code written for
+lists keeps working:
+
+    event_type, data = event
+    event[0] == event.type
+
+Example:
+    for event in speedify.iter_stats(typed=True):
+        if isinstance(event, StateEvent):
+            print(event.state)
+        elif isinstance(event, ConnectionStatsEvent):
+            for connection in event.connections:
+                print(connection.connection_id, connection.receive_bps)
+"""
+
+import sys
+import time
+
+from . import _MISSING, _json_loads
+
+
+class StatsEvent:
+    """
+    A stats event of a type without a class of its own.
+
+    :ivar type: The event type, e.g. "state".
+    :ivar received: time.monotonic() when the event was read.
+    """
+
+    __slots__ = ("type", "received", "_line", "_data")
+
+    def __init__(self, type, data=_MISSING, received=None, line=None):
+        self.type = type
+        self.received = time.monotonic() if received is None else received
+        self._line = line
+        self._data = data if data is _MISSING else self._intern(data)
+
+    @property
+    def data(self):
+        """The event's data, e.g. {"state": "CONNECTED"}, parsed on first access."""
+        if self._data is _MISSING:
+            self._data = self._intern(_json_loads(self._line)[1])
+            self._line = None
+        return self._data
+
+    def _intern(self, data):
+        """Interns the IDs and names in the event's data, in place, and returns it."""
+        return data
+
+    @property
+    def parsed(self):
+        """True once the event's data has been parsed."""
+        return self._data is not _MISSING
+
+    def __getitem__(self, index):
+        # event[0] doesn't parse the event
+        if index == 0:
+            return self.type
+        return (self.type, self.data)[index]
+
+    def __iter__(self):
+        yield self.type
+        yield self.data
+
+    def __len__(self):
+        return 2
+
+    def __eq__(self, other):
+        if isinstance(other, StatsEvent):
+            return self.type == other.type and self.data == other.data
+        if isinstance(other, (list, tuple)):
+            return len(other) == 2 and self.type == other[0] and self.data == other[1]
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        data = repr(self._data) if self.parsed else "..."
+        return type(self).__name__ + "(" + repr(self.type) + ", " + data + ")"
+
+
+class StateEvent(StatsEvent):
+    """The daemon's state changed: ["state", {"state": "CONNECTED"}]."""
+
+    __slots__ = ()
+
+    @property
+    def state(self):
+        """The state, e.g. "CONNECTED", or None."""
+        return self.data.get("state")
+
+    def _intern(self, data):
+        _intern_keys((data,), ("state",))
+        return data
+
+
+class _Fields:
+    """Read-only view of one JSON object of an event, with typed properties."""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def get(self, key, default=None):
+        """Returns a raw field of the object, like dict.get()."""
+        return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __eq__(self, other):
+        if isinstance(other, _Fields):
+            return self._data == other._data
+        return self._data == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + repr(self._data) + ")"
+
+
+class Adapter(_Fields):
+    """One network adapter in an AdaptersEvent."""
+
+    __slots__ = ()
+
+    @property
+    def adapter_id(self):
+        return self._data.get("adapterID")
+
+    @property
+    def type(self):
+        """e.g. "Wi-Fi", "Cellular", "Ethernet"."""
+        return self._data.get("type")
+
+    @property
+    def state(self):
+        """e.g. "connected"."""
+        return self._data.get("state")
+
+    @property
+    def name(self):
+        return self._data.get("name")
+
+    @property
+    def network_name(self):
+        """The Wi-Fi SSID or mobile network, if any."""
+        return self._data.get("connectedNetworkName")
+
+
+class AdaptersEvent(StatsEvent):
+    """The network adapters changed: ["adapters", [{...}, ...]]."""
+
+    __slots__ = ()
+
+    @property
+    def adapters(self):
+        """list -- The adapters, as speedify.events.Adapter."""
+        return [Adapter(adapter) for adapter in self.data]
+
+    def by_id(self):
+        """
+        :returns: dict -- The adapters by adapter ID.
+        """
+        return {adapter.adapter_id: adapter for adapter in self.adapters}
+
+    def _intern(self, data):
+        if type(data) is list:
+            _intern_keys(data, ("adapterID", "type", "state"))
+        return data
+
+
+class Connection(_Fields):
+    """One connection to the server in a ConnectionStatsEvent."""
+
+    __slots__ = ()
+
+    @property
+    def connection_id(self):
+        """e.g. "eth0%10.1.0.0/24"."""
+        return self._data.get("connectionID")
+
+    @property
+    def adapter_id(self):
+        return self._data.get("adapterID")
+
+    @property
+    def connected(self):
+        return self._data.get("connected")
+
+    @property
+    def congested(self):
+        return self._data.get("congested")
+
+    @property
+    def receive_bps(self):
+        """Download rate, in bytes per second."""
+        return self._data.get("receiveBps")
+
+    @property
+    def send_bps(self):
+        """Upload rate, in bytes per second."""
+        return self._data.get("sendBps")
+
+    @property
+    def latency_ms(self):
+        return self._data.get("latencyMs")
+
+    @property
+    def loss_receive(self):
+        return self._data.get("lossReceive")
+
+    @property
+    def loss_send(self):
+        return self._data.get("lossSend")
+
+
+class ConnectionStatsEvent(StatsEvent):
+    """Per-connection statistics: ["connection_stats", {"connections": [{...}, ...]}]."""
+
+    __slots__ = ()
+
+    @property
+    def connections(self):
+        """list -- The connections, as speedify.events.Connection."""
+        return [Connection(connection) for connection in self.data.get("connections", ())]
+
+    def _intern(self, data):
+        if type(data) is dict and type(data.get("connections")) is list:
+            _intern_keys(data["connections"], ("connectionID", "adapterID"))
+        return data
+
+
+class SessionStatsEvent(StatsEvent):
+    """Usage over the periods asked for: ["session_stats", {"current": {...}, "day": {...}, ...}]."""
+
+    __slots__ = ()
+
+    def period(self, name):
+        """
+        :param name: The period, e.g. "current", "day" or a number of hours.
+        :type name: str
+        :returns: dict -- The usage over the period, or None if it wasn't reported.
+        """
+        return self.data.get(str(name))
+
+
+class CurrentServerEvent(StatsEvent):
+    """The server connected to: ["current_server", {...}]."""
+
+    __slots__ = ()
+
+    @property
+    def tag(self):
+        """e.g. "us-atlanta-3"."""
+        return self.data.get("tag")
+
+    @property
+    def country(self):
+        return self.data.get("country")
+
+    @property
+    def city(self):
+        return self.data.get("city")
+
+    @property
+    def friendly_name(self):
+        return self.data.get("friendlyName")
+
+    def _intern(self, data):
+        _intern_keys((data,), ("tag", "country", "city"))
+        return data
+
+
+class GapEvent(StatsEvent):
+    """
+    Made up by a supervised stream that was restarted (see speedify.retry.RestartPolicy):
+    ["gap", {"seconds": 12.5, "restarts": 2, "error": "..."}].  Events were lost
+    during the outage.
+    """
+
+    __slots__ = ()
+
+    @property
+    def seconds(self):
+        """How long the stream was down."""
+        return self.data["seconds"]
+
+    @property
+    def restarts(self):
+        """Restarts in a row it took."""
+        return self.data["restarts"]
+
+    @property
+    def error(self):
+        """Why the stream ended, as text."""
+        return self.data["error"]
+
+
+# Classes of the event types, by type name
+EVENT_CLASSES = {
+    "state": StateEvent,
+    "adapters": AdaptersEvent,
+    "connection_stats": ConnectionStatsEvent,
+    "session_stats": SessionStatsEvent,
+    "current_server": CurrentServerEvent,
+    "gap": GapEvent,
+}
+
+# Interned type names by type tag, as found at the start of stats lines
+_type_names = {}
+
+
+def from_message(message, received=None):
+    """
+    Returns the typed event of an already parsed stats message.
+
+    :param message: The message, e.g. ["state", {"state": "CONNECTED"}].
+    :type message: list
+    :param received: time.monotonic() when it was read.  Defaults to now.
+    :type received: float
+    :returns: speedify.events.StatsEvent -- The event.
+    """
+    event_type = sys.intern(message[0])
+    return EVENT_CLASSES.get(event_type, StatsEvent)(event_type, message[1], received)
+
+
+def _from_line(tag, line):
+    """Returns the typed event of a stats line, without parsing it."""
+    event_type = _type_names.get(tag)
+    if event_type is None:
+        event_type = _type_names.setdefault(tag, sys.intern(tag.decode("utf-8")))
+    return EVENT_CLASSES.get(event_type, StatsEvent)(event_type, received=time.monotonic(), line=line)
+
+
+def _intern_keys(objects, keys):
+    """Interns the string values of keys in each of the JSON objects, in place."""
+    for obj in objects:
+        if type(obj) is dict:
+            for key in keys:
+                value = obj.get(key)
+                if type(value) is str:
+                    obj[key] = sys.intern(value)
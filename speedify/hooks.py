@@ -0,0 +1,228 @@
+"""
+.. module:: speedify.hooks
+   :synopsis: Functions called before and after every CLI command, for tracing and profiling
+
+Hooks added with add_hook() are called around every command run through
+_run_speedify_cmd() (all the command wrappers, in speedify and speedify.aio) and
+every stream run through _run_long_command() (stats_callback(),
+safebrowsing_error_callback()).  Each call is described by a CommandCall: its
+arguments, when it started and ended, the exit code and output size of the CLI
+process, the exception it raised, and a context dict where hooks can keep their
+own data, such as a tracing span.
+
+Calls are grouped into operations.  Every public speedify function opens one
+(see speedify.exception_wrapper) unless one is already open, and applications can
+open their own around related calls with operation().  Hooks can keep data for
+the whole operation in CommandCall.operation.context, and SpeedifyErrors raised
+out of it carry the operation in their operation attribute.
+
+With no hooks added, none of this is done.
+
+Example:
+    from speedify import hooks
+
+    def before(call):
+        call.context["span"] = tracer.start_span(call.command, parent=call.operation.context.get("span"))
+
+    def after(call):
+        call.context["span"].finish(error=call.error, bytes=call.stdout_bytes)
+
+    hook = hooks.add_hook(before, after)
+    with hooks.operation("refresh dashboard", span=tracer.start_span("refresh dashboard")):
+        speedify.show_state()
+        speedify.show_adapters()
+    hooks.remove_hook(hook)
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from . import SpeedifyError, _command_name
+
+logger = logging.getLogger(__name__)
+
+
+class Hook:
+    """A pair of functions added with add_hook()."""
+
+    __slots__ = ("before", "after")
+
+    def __init__(self, before=None, after=None):
+        self.before = before
+        self.after = after
+
+
+class Operation:
+    """
+    An application operation that runs one or more CLI commands.
+
+    :ivar name: Name of the operation, e.g. the speedify function called.
+    :ivar context: Data kept by hooks and the application for the whole operation.
+    """
+
+    __slots__ = ("name", "context")
+
+    def __init__(self, name, context=None):
+        self.name = name
+        self.context = dict(context or {})
+
+
+class CommandCall:
+    """
+    One command, as seen by hooks.
+
+    :ivar args: The command arguments, e.g. ["show", "adapters"].
+    :ivar command: The command name, e.g. "show adapters".
+    :ivar operation: The Operation the command is part of, or None.
+    :ivar start: time.monotonic() when the command was started.
+    :ivar end: time.monotonic() when it ended, None in before hooks.
+    :ivar returncode: Exit code of the last CLI process run for the command, or None
+        if none ended (cache hit, result shared with another caller, timeout...).
+    :ivar stdout_bytes: Bytes printed on stdout by the CLI processes run for the command.
+    :ivar error: The exception the command raised, or None.
+    :ivar context: Data kept by hooks for this command.
+    """
+
+    __slots__ = ("args", "command", "operation", "start", "end", "returncode", "stdout_bytes", "error", "context")
+
+    def __init__(self, args, operation):
+        self.args = list(args)
+        self.command = _command_name(args)
+        self.operation = operation
+        self.start = time.monotonic()
+        self.end = None
+        self.returncode = None
+        self.stdout_bytes = 0
+        self.error = None
+        self.context = {}
+
+
+# The hooks, replaced as a whole on every change so they can be read without locking
+_registered = ()
+_lock = threading.Lock()
+
+_operation_var = contextvars.ContextVar("speedify_operation", default=None)
+_call_var = contextvars.ContextVar("speedify_command_call", default=None)
+
+
+def add_hook(before=None, after=None):
+    """
+    Adds functions to call before and after every command, in every thread.
+
+    :param before: Called with the CommandCall before the command runs.
+    :type before: function
+    :param after: Called with the CommandCall once the command has ended, even if it raised.
+    :type after: function
+    :returns: speedify.hooks.Hook -- The hook, to pass to remove_hook().
+    """
+    global _registered
+    hook = Hook(before, after)
+    with _lock:
+        _registered = _registered + (hook,)
+    return hook
+
+
+def remove_hook(hook):
+    """
+    Removes a hook added with add_hook().
+
+    :param hook: The hook.
+    :type hook: speedify.hooks.Hook
+    """
+    global _registered
+    with _lock:
+        _registered = tuple(h for h in _registered if h is not hook)
+
+
+def current_operation():
+    """
+    :returns: speedify.hooks.Operation -- The operation open in this thread or task, or None.
+    """
+    return _operation_var.get()
+
+
+@contextmanager
+def operation(name, **context):
+    """
+    Context manager that groups the commands run inside it, in this thread or
+    task, into one operation.  Operations opened inside it (including those of
+    the speedify functions called) are part of it.
+
+    :param name: Name of the operation.
+    :type name: str
+    :param context: Initial operation context, e.g. a parent span.
+    :returns: speedify.hooks.Operation -- The operation.
+    """
+    current = _operation_var.get()
+    if current is not None:
+        current.context.update(context)
+        yield current
+        return
+    current = Operation(name, context)
+    token = _operation_var.set(current)
+    try:
+        yield current
+    finally:
+        _operation_var.reset(token)
+
+
+def _start_call(args):
+    """Starts a CommandCall and runs the before hooks."""
+    call = CommandCall(args, _operation_var.get())
+    for hook in _registered:
+        if hook.before is not None:
+            _call_hook(hook.before, call)
+    return call
+
+
+def _end_call(call, error=None):
+    """Ends a CommandCall and runs the after hooks."""
+    call.end = time.monotonic()
+    call.error = error
+    if isinstance(error, SpeedifyError) and error.operation is None:
+        error.operation = call.operation
+    for hook in _registered:
+        if hook.after is not None:
+            _call_hook(hook.after, call)
+
+
+def _begin(args):
+    """Starts a CommandCall that the CLI processes run in this context are added to."""
+    call = _start_call(args)
+    return call, _call_var.set(call)
+
+
+def _finish(call, token, error=None):
+    """Ends a CommandCall started by _begin()."""
+    _call_var.reset(token)
+    _end_call(call, error)
+
+
+def _run_hooked(args, function, *function_args):
+    """Runs function(*function_args) as the command args, calling the hooks around it."""
+    call, token = _begin(args)
+    try:
+        result = function(*function_args)
+    except BaseException as err:
+        _finish(call, token, err)
+        raise
+    _finish(call, token)
+    return result
+
+
+def _note_process(returncode, stdout_bytes):
+    """Adds a finished CLI process to the CommandCall in progress, if any."""
+    call = _call_var.get()
+    if call is not None:
+        call.returncode = returncode
+        call.stdout_bytes += stdout_bytes
+
+
+def _call_hook(function, call):
+    try:
+        function(call)
+    except Exception as err:
+        logger.error("Error in command hook: " + str(err))
@@ -0,0 +1,205 @@
+"""
+.. module:: speedify.hub
+   :synopsis: One stats stream shared by any number of subscribers
+
+A StatsHub runs a single "speedify_cli stats 0" process, parses each event once
+and hands it to every subscriber.  Each Subscription has its own bounded queue, so
+a slow subscriber loses its own oldest events (counted in dropped) without holding
+up the hub or the other subscribers.  Other overflow policies can be chosen, see
+speedify.dispatch.Overflow; with BLOCK, a slow subscriber holds up everyone.
+
+The stream starts when the first subscriber arrives and is stopped (the CLI killed)
+when the last one leaves.  If it ends by itself (the CLI exits or can't be started),
+the subscriptions end, with the error in Subscription.error, and the next
+subscribe() starts a new stream.  Given a RestartPolicy, the hub restarts the stream
+instead, and every subscriber gets a ["gap", {...}] event and fresh state and
+adapters events (see speedify.StreamHandle).
+
+Subscribers can ask for some event types only.  The stream skips the events no
+subscriber wants without parsing them, and the skip rate is in the client's
+metrics (MetricsRegistry.skip_rate("stats")).
+
+Events are shared between subscribers: treat them as read-only.
+
+Example:
+    from speedify.hub import default_hub
+
+    with default_hub.subscribe(maxsize=100) as events:
+        for event_type, data in events:
+            ...
+
+    # elsewhere, with the same CLI process
+    subscription = default_hub.subscribe(types=["state"])
+    event = subscription.get(timeout=5)
+    subscription.close()
+"""
+
+import threading
+
+from . import StreamHandle, _active_client, _stats_args
+from .dispatch import EventQueue, Overflow
+
+
+class Subscription(EventQueue):
+    """
+    A subscriber's queue of stats events.  Iterating over it blocks for each event
+    and stops once the subscription is closed or the stream has ended.
+
+    :ivar types: The event types the subscriber gets, or None for all.
+    :ivar dropped: Events dropped because the queue was full.
+    :ivar coalesced: Events replaced by a newer event of the same type (Overflow.COALESCE).
+    :ivar error: The error that ended the stream, if any.
+    """
+
+    def __init__(self, hub, maxsize, types=None, overflow=Overflow.DROP_OLDEST):
+        super().__init__(maxsize, overflow)
+        self.hub = hub
+        self.types = None if types is None else frozenset(types)
+
+    def close(self):
+        """Leaves the hub.  The hub's stream stops if this was its last subscriber."""
+        self.hub._unsubscribe(self)
+        self._end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StatsHub:
+    """
+    Shares one stats stream between subscribers.
+
+    :param client: The client running the stream.  Defaults to the active client
+        when the stream starts.
+    :type client: speedify.SpeedifyClient
+    :param periods: Periods to report usage for, as in speedify.iter_stats().
+    :type periods: list
+    :param networksharing: Include Pair & Share stats.
+    :type networksharing: bool
+    :param maxsize: Default queue size of subscriptions.
+    :type maxsize: int
+    :param typed: Publish speedify.events classes, parsed on first access, instead of lists.
+    :type typed: bool
+    :param restart: Restart the stream when the CLI exits by itself, or None to end the subscriptions.
+    :type restart: speedify.retry.RestartPolicy
+    """
+
+    def __init__(self, client=None, periods=(), networksharing=False, maxsize=1000, typed=False, restart=None):
+        self.client = client
+        self.args = _stats_args(0, periods, networksharing)
+        self.maxsize = maxsize
+        self.typed = typed
+        self.restart = restart
+        self._lock = threading.Lock()
+        # Replaced as a whole on every change, so events are published without locking
+        self._subscribers = ()
+        self._handle = None
+
+    def subscribe(self, maxsize=None, types=None, overflow=Overflow.DROP_OLDEST):
+        """
+        Adds a subscriber, starting the stream if it is the first.
+
+        :param maxsize: Most events queued for this subscriber; older ones are dropped.
+        :type maxsize: int
+        :param types: Event types to get, e.g. ["state", "adapters"], or None for all.
+        :type types: list
+        :param overflow: What to do with events when the queue is full.
+        :type overflow: speedify.dispatch.Overflow
+        :returns: speedify.hub.Subscription -- The subscriber's queue.
+        """
+        subscription = Subscription(self, maxsize or self.maxsize, types, overflow)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+            if self._handle is None:
+                client = self.client or _active_client()
+                # The stream's thread runs in the context it is created in
+                with client.activate():
+                    self._handle = StreamHandle(
+                        client.command_line(self.args),
+                        self._publish,
+                        self._ended,
+                        self._wanted(),
+                        self.typed,
+                        restart=self.restart,
+                    )
+                self._handle.start()
+            else:
+                self._handle._types.set(self._wanted())
+        return subscription
+
+    @property
+    def subscribers(self):
+        """Number of subscribers."""
+        return len(self._subscribers)
+
+    @property
+    def running(self):
+        """True while the stream is running."""
+        handle = self._handle
+        return handle is not None and handle.running
+
+    def close(self):
+        """Ends every subscription and stops the stream."""
+        with self._lock:
+            subscribers = self._subscribers
+            self._subscribers = ()
+            handle = self._handle
+            self._handle = None
+        if handle is not None:
+            handle.stop()
+        for subscription in subscribers:
+            subscription._end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _unsubscribe(self, subscription):
+        handle = None
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+            if not self._subscribers:
+                handle = self._handle
+                self._handle = None
+            elif self._handle is not None:
+                self._handle._types.set(self._wanted())
+        if handle is not None:
+            handle.stop()
+
+    def _wanted(self):
+        """Returns the event types any subscriber wants, or None for all.  Called with the lock held."""
+        wanted = set()
+        for subscription in self._subscribers:
+            if subscription.types is None:
+                return None
+            wanted |= subscription.types
+        return wanted
+
+    def _publish(self, event):
+        event_type = event[0]
+        for subscription in self._subscribers:
+            # Everyone hears about gaps
+            if subscription.types is None or event_type in subscription.types or event_type == "gap":
+                subscription.put(event)
+
+    def _ended(self, handle):
+        """Called from the stream's thread when it ends."""
+        if handle.stopped:
+            return
+        with self._lock:
+            if self._handle is not handle:
+                return
+            self._handle = None
+            subscribers = self._subscribers
+            self._subscribers = ()
+        for subscription in subscribers:
+            subscription._end(handle.error)
+
+
+# Shared by the whole process, on the client active when its stream starts (normally the default client)
+default_hub = StatsHub()
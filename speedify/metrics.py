@@ -0,0 +1,302 @@
+"""
+.. module:: speedify.metrics
+   :synopsis: Counters and latency histograms for the CLI commands run
+
+Every speedify_cli process started by a SpeedifyClient is recorded in its
+MetricsRegistry, keyed by command name ("show adapters", "connect", "stats"...):
+how many ran, how many failed and why (exit code, timeout...), how long they took,
+how much they printed and how long parsing their JSON took.  The latencies of the
+most recent runs are also kept, for rolling percentiles.  Streams (stats,
+safebrowsing errors) also count the events they read and how many were skipped
+without being parsed because nobody wanted their type.  Results served from
+a ReadCache, or shared with a concurrent identical command, start no process and
+are not counted.
+
+Clients share default_registry unless given their own.
+
+Example:
+    import speedify
+    from speedify.metrics import default_registry
+
+    speedify.show_adapters()
+    default_registry.snapshot()["show adapters"]["calls"]  # 1
+    default_registry.percentile("show adapters", 95)  # seconds
+
+    # e.g. from a /metrics HTTP handler
+    body = default_registry.prometheus()
+"""
+
+import bisect
+import math
+import threading
+from collections import deque
+
+# Latency histogram bucket bounds, in seconds.  speedtest and streamtest take ~30s.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Errors that have no exit code
+TIMEOUT = "timeout"
+SPAWN_FAILED = "spawn"
+INVALID_OUTPUT = "invalid_output"
+
+
+class _CommandMetrics:
+    __slots__ = (
+        "calls",
+        "errors",
+        "bucket_counts",
+        "latency_sum",
+        "stdout_bytes",
+        "parse_seconds",
+        "recent",
+        "events",
+        "skipped",
+    )
+
+    def __init__(self, bucket_count, window):
+        self.calls = 0
+        self.errors = {}
+        # The last bucket is +Inf
+        self.bucket_counts = [0] * (bucket_count + 1)
+        self.latency_sum = 0.0
+        self.stdout_bytes = 0
+        self.parse_seconds = 0.0
+        self.recent = deque(maxlen=window)
+        self.events = 0
+        self.skipped = 0
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of per-command CLI metrics.
+
+    :param buckets: Upper bounds of the latency histogram buckets, in seconds.
+    :type buckets: tuple
+    :param window: Number of recent latencies kept per command for percentile().
+    :type window: int
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=200):
+        self.buckets = tuple(sorted(buckets))
+        self.window = window
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def record(self, command, seconds, error=None, stdout_bytes=0, parse_seconds=0.0):
+        """
+        Records one CLI process.
+
+        :param command: Command name, e.g. "show adapters".
+        :type command: str
+        :param seconds: How long the command ran.
+        :type seconds: float
+        :param error: None if it succeeded, else its exit code, or TIMEOUT,
+            SPAWN_FAILED or INVALID_OUTPUT.
+        :type error: int or str
+        :param stdout_bytes: Size of its output.
+        :type stdout_bytes: int
+        :param parse_seconds: Time spent parsing its JSON output.
+        :type parse_seconds: float
+        """
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            metrics = self._metrics(command)
+            metrics.calls += 1
+            if error is not None:
+                metrics.errors[error] = metrics.errors.get(error, 0) + 1
+            metrics.bucket_counts[bucket] += 1
+            metrics.latency_sum += seconds
+            metrics.stdout_bytes += stdout_bytes
+            metrics.parse_seconds += parse_seconds
+            # A process that never started says nothing about how long commands take
+            if error != SPAWN_FAILED:
+                metrics.recent.append(seconds)
+
+    def record_events(self, command, events, skipped=0):
+        """
+        Counts events read by a stream while it runs.
+
+        :param command: Command name, e.g. "stats".
+        :type command: str
+        :param events: Events read, including skipped ones.
+        :type events: int
+        :param skipped: Events skipped without being parsed.
+        :type skipped: int
+        """
+        with self._lock:
+            metrics = self._metrics(command)
+            metrics.events += events
+            metrics.skipped += skipped
+
+    def skip_rate(self, command):
+        """
+        :param command: Command name, e.g. "stats".
+        :type command: str
+        :returns: float -- Fraction of the command's events skipped without being parsed,
+            or None if it read none.
+        """
+        with self._lock:
+            metrics = self._commands.get(command)
+            if metrics is None or not metrics.events:
+                return None
+            return metrics.skipped / metrics.events
+
+    def percentile(self, command, q, min_samples=1):
+        """
+        Returns a percentile of the command's recent latencies (see window).
+
+        Example:
+            registry.percentile("state", 99)
+
+        :param command: Command name, e.g. "show adapters".
+        :type command: str
+        :param q: Percentile, from 0 to 100.
+        :type q: float
+        :param min_samples: Fewest latencies to compute it from.
+        :type min_samples: int
+        :returns: float -- Seconds, or None if fewer than min_samples latencies were recorded.
+        """
+        with self._lock:
+            metrics = self._commands.get(command)
+            if metrics is None or len(metrics.recent) < max(1, min_samples):
+                return None
+            recent = sorted(metrics.recent)
+        # Nearest rank
+        rank = max(1, math.ceil(q / 100 * len(recent)))
+        return recent[min(rank, len(recent)) - 1]
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self._lock:
+            self._commands = {}
+
+    def snapshot(self):
+        """
+        Returns a copy of the metrics.
+
+        Example:
+            {"show adapters": {
+                "calls": 2,
+                "errors": {1: 1},
+                "latency": {"count": 2, "sum": 0.043, "buckets": [(0.005, 0), ..., (inf, 2)]},
+                "stdout_bytes": 2048,
+                "parse_seconds": 0.0001,
+                "events": 0,
+                "skipped_events": 0,
+            }}
+
+        :returns: dict -- Metrics by command name.  Latency buckets are cumulative
+            (upper bound, commands at most that long), the last bound is infinity.
+        """
+        bounds = self.buckets + (math.inf,)
+        with self._lock:
+            snapshot = {}
+            for command, metrics in self._commands.items():
+                cumulative = []
+                total = 0
+                for bound, count in zip(bounds, metrics.bucket_counts):
+                    total += count
+                    cumulative.append((bound, total))
+                snapshot[command] = {
+                    "calls": metrics.calls,
+                    "errors": dict(metrics.errors),
+                    "latency": {"count": metrics.calls, "sum": metrics.latency_sum, "buckets": cumulative},
+                    "stdout_bytes": metrics.stdout_bytes,
+                    "parse_seconds": metrics.parse_seconds,
+                    "events": metrics.events,
+                    "skipped_events": metrics.skipped,
+                }
+        return snapshot
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        :returns: str -- speedify_cli_* counters and a latency histogram, labelled by command.
+        """
+        snapshot = self.snapshot()
+        commands = sorted(snapshot)
+        lines = [
+            "# HELP speedify_cli_calls_total speedify_cli processes run.",
+            "# TYPE speedify_cli_calls_total counter",
+        ]
+        for command in commands:
+            lines.append(_sample("speedify_cli_calls_total", command, snapshot[command]["calls"]))
+
+        lines += [
+            "# HELP speedify_cli_errors_total speedify_cli processes that failed, by exit code or reason.",
+            "# TYPE speedify_cli_errors_total counter",
+        ]
+        for command in commands:
+            errors = snapshot[command]["errors"]
+            for error in sorted(errors, key=str):
+                lines.append(
+                    _sample("speedify_cli_errors_total", command, errors[error], exit_code=str(error))
+                )
+
+        lines += [
+            "# HELP speedify_cli_duration_seconds Time from starting speedify_cli to its exit.",
+            "# TYPE speedify_cli_duration_seconds histogram",
+        ]
+        for command in commands:
+            latency = snapshot[command]["latency"]
+            for bound, count in latency["buckets"]:
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(_sample("speedify_cli_duration_seconds_bucket", command, count, le=le))
+            lines.append(_sample("speedify_cli_duration_seconds_sum", command, latency["sum"]))
+            lines.append(_sample("speedify_cli_duration_seconds_count", command, latency["count"]))
+
+        lines += [
+            "# HELP speedify_cli_stdout_bytes_total Bytes printed by speedify_cli on stdout.",
+            "# TYPE speedify_cli_stdout_bytes_total counter",
+        ]
+        for command in commands:
+            lines.append(_sample("speedify_cli_stdout_bytes_total", command, snapshot[command]["stdout_bytes"]))
+
+        lines += [
+            "# HELP speedify_cli_parse_seconds_total Time spent parsing speedify_cli JSON output.",
+            "# TYPE speedify_cli_parse_seconds_total counter",
+        ]
+        for command in commands:
+            lines.append(_sample("speedify_cli_parse_seconds_total", command, snapshot[command]["parse_seconds"]))
+
+        # Only streams read events
+        streams = [command for command in commands if snapshot[command]["events"]]
+        lines += [
+            "# HELP speedify_cli_stream_events_total Events read from speedify_cli streams.",
+            "# TYPE speedify_cli_stream_events_total counter",
+        ]
+        for command in streams:
+            lines.append(_sample("speedify_cli_stream_events_total", command, snapshot[command]["events"]))
+
+        lines += [
+            "# HELP speedify_cli_stream_skipped_events_total Stream events skipped without being parsed.",
+            "# TYPE speedify_cli_stream_skipped_events_total counter",
+        ]
+        for command in streams:
+            lines.append(
+                _sample("speedify_cli_stream_skipped_events_total", command, snapshot[command]["skipped_events"])
+            )
+        return "\n".join(lines) + "\n"
+
+    def _metrics(self, command):
+        """Returns the metrics of a command, creating them.  Called with the lock held."""
+        metrics = self._commands.get(command)
+        if metrics is None:
+            metrics = self._commands[command] = _CommandMetrics(len(self.buckets), self.window)
+        return metrics
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name, command, value, **labels):
+    text = 'command="' + _label(command) + '"'
+    for label, label_value in labels.items():
+        text += "," + label + '="' + _label(label_value) + '"'
+    return name + "{" + text + "} " + repr(value)
+
+
+# Shared by every SpeedifyClient that isn't given a registry of its own
+default_registry = MetricsRegistry()
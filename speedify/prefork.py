@@ -0,0 +1,309 @@
+"""
+.. module:: speedify.prefork
+   :synopsis: Launch speedify_cli from small pre-started helper processes
+
+Every command normally costs a fork+exec of speedify_cli from the Python process
+using the library.  When that process is large, or the machine is small, the fork
+dominates the latency of a command.  PreforkSpawner starts a few small helper
+processes up front; each receives the command over a pipe, launches the CLI with
+os.posix_spawn and streams its stdout, stderr and exit code back.
+
+Only available where os.posix_spawn is (Linux and macOS, Python 3.8+).
+
+Example:
+    import speedify
+    from speedify import PreforkSpawner, SpeedifyClient
+
+    speedify.set_default_client(SpeedifyClient(transport=PreforkSpawner(workers=2)))
+    speedify.show_state()
+
+See benchmarks/bench_spawn.py for a comparison with the subprocess.run path.
+"""
+
+import json
+import logging
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+
+from speedify import SpeedifyError
+from speedify.transports import Stream, Transport
+
+logger = logging.getLogger(__name__)
+
+_HELPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_spawn_helper.py")
+
+# Frame header written by the helper: kind, payload length
+_HEADER = struct.Struct(">cI")
+
+
+def _read_exact(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class _Helper:
+    """One helper process, running one command at a time."""
+
+    def __init__(self):
+        # -S: the helper only needs the standard library, skip site-packages
+        self.proc = subprocess.Popen(
+            [sys.executable, "-S", _HELPER],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+
+    def send(self, request):
+        self.proc.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+
+    def frames(self):
+        """Yields (kind, payload) frames until the helper reports how the command ended."""
+        while True:
+            header = _read_exact(self.proc.stdout, _HEADER.size)
+            if header is None:
+                return
+            kind, size = _HEADER.unpack(header)
+            payload = _read_exact(self.proc.stdout, size) if size else b""
+            if payload is None:
+                return
+            yield kind, payload
+            if kind in (b"x", b"t", b"f"):
+                return
+
+    def cancel(self):
+        try:
+            self.send({"cancel": True})
+        except OSError:
+            pass
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+
+
+class _HelperStream(Stream):
+    """Output of a streaming command, holding its helper until the command ends."""
+
+    def __init__(self, spawner, helper, capture_stderr):
+        self._spawner = spawner
+        self._helper = helper
+        self._capture_stderr = capture_stderr
+        self._stderr = []
+        self._frames = helper.frames()
+        self._lock = threading.Lock()
+        # Held while reading a frame, so close() from another thread waits its turn
+        self._read_lock = threading.Lock()
+        self._cancelled = False
+
+    def __iter__(self):
+        pending = b""
+        try:
+            while True:
+                with self._read_lock:
+                    frame = next(self._frames, None)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == b"o":
+                    lines = (pending + payload).split(b"\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        yield line + b"\n"
+                elif kind == b"e":
+                    self._keep_stderr(payload)
+                elif kind in (b"x", b"t", b"f"):
+                    self._end(kind, payload)
+                    if kind == b"f":
+                        code, message = payload.decode("utf-8").split(" ", 1)
+                        raise OSError(int(code), message)
+                    break
+            if pending:
+                yield pending
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._helper is None:
+                return
+            if not self._cancelled:
+                self._cancelled = True
+                self._helper.cancel()
+        # Let the helper report the kill, so it can be reused
+        with self._read_lock:
+            for kind, payload in self._frames:
+                if kind == b"e":
+                    self._keep_stderr(payload)
+                elif kind in (b"x", b"t", b"f"):
+                    self._end(kind, payload)
+                    return
+            self._end(None, b"")
+
+    @property
+    def stderr(self):
+        return b"".join(self._stderr)
+
+    def _keep_stderr(self, payload):
+        if self._capture_stderr:
+            self._stderr.append(payload)
+
+    def _end(self, kind, payload):
+        with self._lock:
+            helper, self._helper = self._helper, None
+        if helper is None:
+            return
+        self.returncode = int(payload) if kind == b"x" else -9
+        self._spawner._checkin(helper, kind is not None)
+
+
+# Put on the idle queue by close(), to wake the callers waiting for a helper
+_CLOSED = object()
+
+
+class PreforkSpawner(Transport):
+    """
+    Transport that runs commands through a pool of pre-started helper processes.
+
+    run() has the same outcomes as subprocess.run(): it returns the exit code and
+    output, raises subprocess.TimeoutExpired if the command ran out of time (it is
+    killed by the helper), and OSError (e.g. FileNotFoundError) if it could not be started.
+
+    Callers beyond the number of workers wait for a free helper.  A helper that
+    dies is replaced; a command that was running in it fails with SpeedifyError.
+
+    :param workers: Number of helper processes, i.e. commands that can run at once.
+    :type workers: int
+    :raises SpeedifyError: If os.posix_spawn is not available on this platform.
+    """
+
+    def __init__(self, workers: int = 2):
+        if not hasattr(os, "posix_spawn"):
+            raise SpeedifyError("PreforkSpawner needs os.posix_spawn (Linux or macOS, Python 3.8+)")
+        self.workers = workers
+        self._closed = False
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(_Helper())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, cmd, timeout=None):
+        """
+        Runs a command to completion.
+
+        :param cmd: The command and its arguments.
+        :type cmd: list
+        :param timeout: Seconds before the command is killed, or None to wait forever.
+        :type timeout: float
+        :returns: tuple -- (returncode, stdout bytes, stderr bytes)
+        """
+        helper = self._checkout()
+        finished = False
+        try:
+            try:
+                helper.send({"argv": [str(arg) for arg in cmd], "timeout": timeout})
+            except OSError:
+                logger.error("Spawner helper is not accepting commands")
+                raise SpeedifyError("Spawner helper exited unexpectedly")
+            stdout = []
+            stderr = []
+            for kind, payload in helper.frames():
+                if kind == b"o":
+                    stdout.append(payload)
+                elif kind == b"e":
+                    stderr.append(payload)
+                elif kind == b"x":
+                    finished = True
+                    return int(payload), b"".join(stdout), b"".join(stderr)
+                elif kind == b"t":
+                    finished = True
+                    raise subprocess.TimeoutExpired(cmd, timeout, b"".join(stdout), b"".join(stderr))
+                elif kind == b"f":
+                    finished = True
+                    code, message = payload.decode("utf-8").split(" ", 1)
+                    raise OSError(int(code), message, cmd[0])
+            logger.error("Spawner helper exited while running " + str(cmd[0]))
+            raise SpeedifyError("Spawner helper exited unexpectedly")
+        finally:
+            self._checkin(helper, finished)
+
+    def stream(self, cmd, capture_stderr=False):
+        """
+        Starts a command whose output is read while it runs.  The command keeps
+        one helper busy until it ends or the stream is closed.
+
+        :param cmd: The command and its arguments.
+        :type cmd: list
+        :param capture_stderr: Collect the command's stderr in Stream.stderr (otherwise it is discarded).
+        :type capture_stderr: bool
+        :returns: speedify.transports.Stream -- The command's output.
+        """
+        helper = self._checkout()
+        try:
+            helper.send({"argv": [str(arg) for arg in cmd], "timeout": None})
+        except OSError:
+            self._checkin(helper, False)
+            logger.error("Spawner helper is not accepting commands")
+            raise SpeedifyError("Spawner helper exited unexpectedly")
+        return _HelperStream(self, helper, capture_stderr)
+
+    def close(self):
+        """
+        Stops the helper processes.  Commands still running finish first; callers
+        waiting for a helper get SpeedifyError.
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                helper = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if helper is not _CLOSED:
+                helper.close()
+        self._idle.put(_CLOSED)
+
+    def _checkout(self):
+        if self._closed:
+            raise SpeedifyError("PreforkSpawner is closed")
+        helper = self._idle.get()
+        if helper is _CLOSED:
+            # Left for the next caller waiting
+            self._idle.put(helper)
+            raise SpeedifyError("PreforkSpawner is closed")
+        if helper.proc.poll() is not None:
+            # Died while idle (e.g. killed from outside): start a new one
+            helper.close()
+            helper = _Helper()
+        return helper
+
+    def _checkin(self, helper, healthy):
+        if not healthy:
+            # Interrupted mid-command, or the helper died: its pipe can't be trusted
+            helper.cancel()
+            helper.close()
+        with self._lock:
+            if self._closed:
+                if healthy:
+                    helper.close()
+                return
+            self._idle.put(helper if healthy else _Helper())
@@ -0,0 +1,325 @@
+"""
+.. module:: speedify.retry
+   :synopsis: Retries, backoff and hedged requests for CLI commands
+
+A SpeedifyClient given a RetryPolicy retries commands that failed for reasons
+that may go away: the CLI being killed or crashing, or (for read-only commands)
+the CLI timing out or the daemon answering errorCode 3841 "Timeout waiting for
+result".  Commands that change the daemon's state are not retried after a
+timeout of either kind, since they may have taken effect.  Invalid, missing or
+unknown parameters are never retried.  Retries wait with exponential backoff and
+full jitter, and all attempts together can be bounded by a deadline.
+
+Read-only commands (show_*, state, ...) can also be hedged: if an attempt takes
+longer than the command's recent 95th percentile latency, a duplicate is started
+and whichever answers first wins.  In speedify.aio the slower one is stopped; in
+the synchronous API it is left to finish in the background.
+
+Streams that should never end (stats_stream(0, ...), StatsHub) can be
+supervised with a RestartPolicy: when the CLI dies, because the daemon restarted
+or the CLI crashed, it is started again after a backoff.
+
+Example:
+    import speedify
+    from speedify.retry import RestartPolicy, RetryPolicy
+
+    client = speedify.SpeedifyClient(retry=RetryPolicy(attempts=4, deadline=10, hedge=True))
+    client.show_adapters()
+
+    speedify.stats_stream(0, on_stats, restart=RestartPolicy(max_backoff=60))
+"""
+
+import asyncio
+import contextvars
+import logging
+import queue
+import random
+import threading
+import time
+
+from . import SpeedifyAPIError, SpeedifyError, SpeedifyTimeoutError, _command_name, _is_read_only
+
+logger = logging.getLogger(__name__)
+
+# errorCodes of daemon errors (exit code 1) that are worth retrying
+RETRYABLE_ERROR_CODES = frozenset({
+    3841,  # Timeout waiting for result
+})
+
+# errorCodes of daemon timeouts: like a CLI timeout, the command may have taken
+# effect, so only read-only commands are retried
+TIMEOUT_ERROR_CODES = frozenset({
+    3841,
+})
+
+# Exit codes that can't succeed on retry: invalid, missing and unknown parameters.
+# Exit code 1 is retried according to its errorCode; any other exit code (the CLI
+# crashed or was killed) is retried.
+PERMANENT_EXIT_CODES = frozenset({1, 2, 3, 4})
+
+
+class RetryPolicy:
+    """
+    When and how a client retries and hedges commands.
+
+    :param attempts: Most times a command is run, including the first.
+    :type attempts: int
+    :param backoff: Delay before the first retry in seconds; it doubles for each later one.
+        The actual delay is random, between 0 and this.
+    :type backoff: float
+    :param max_backoff: Longest delay between attempts, in seconds.
+    :type max_backoff: float
+    :param deadline: Seconds all attempts together may take, or None for no limit.
+        Each attempt's timeout is cut to the time left.
+    :type deadline: float
+    :param error_codes: errorCodes of daemon errors to retry.  Those in TIMEOUT_ERROR_CODES
+        are only retried for read-only commands.
+    :type error_codes: frozenset
+    :param permanent_exit_codes: Exit codes never to retry (other than daemon errors with a retryable errorCode).
+    :type permanent_exit_codes: frozenset
+    :param retry_timeouts: Retry read-only commands that timed out.  Commands that change
+        the daemon's state are never retried after a timeout, since they may have taken effect.
+    :type retry_timeouts: bool
+    :param hedge: Start a duplicate of a slow read-only command.
+    :type hedge: bool
+    :param hedge_percentile: Percentile of the command's recent latencies after which to hedge.
+    :type hedge_percentile: float
+    :param hedge_min_samples: Latencies needed before a command is hedged.
+    :type hedge_min_samples: int
+    """
+
+    def __init__(
+        self,
+        attempts=3,
+        backoff=0.2,
+        max_backoff=5.0,
+        deadline=None,
+        error_codes=RETRYABLE_ERROR_CODES,
+        permanent_exit_codes=PERMANENT_EXIT_CODES,
+        retry_timeouts=True,
+        hedge=False,
+        hedge_percentile=95,
+        hedge_min_samples=20,
+    ):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.error_codes = frozenset(error_codes)
+        self.permanent_exit_codes = frozenset(permanent_exit_codes)
+        self.retry_timeouts = retry_timeouts
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        # Counters, for monitoring; hedged attempts update them from other threads
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def is_retryable(self, args, error):
+        """
+        :param args: The command arguments.
+        :type args: list
+        :param error: The error the command raised.
+        :type error: SpeedifyError
+        :returns: bool -- Whether running the command again may succeed.
+        """
+        if isinstance(error, SpeedifyAPIError):
+            if error.error_code in TIMEOUT_ERROR_CODES:
+                return error.error_code in self.error_codes and _is_read_only(args)
+            return error.error_code in self.error_codes
+        if isinstance(error, SpeedifyTimeoutError):
+            return self.retry_timeouts and _is_read_only(args)
+        return error.returncode is not None and error.returncode not in self.permanent_exit_codes
+
+    def backoff_delay(self, retry):
+        """
+        :param retry: Number of the retry, from 1.
+        :type retry: int
+        :returns: float -- Seconds to wait before it, with full jitter.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (retry - 1)))
+
+    def run(self, client, args, cmdtimeout=None):
+        """
+        Runs a command through client._execute(), retrying and hedging it.
+
+        :param client: The client running the command.
+        :type client: speedify.SpeedifyClient
+        :param args: The command arguments.
+        :type args: list
+        :param cmdtimeout: Timeout of each attempt, overriding the client's timeouts.
+        :type cmdtimeout: float
+        :returns: dict -- Parsed JSON response object from the CLI
+        """
+        deadline = self._deadline()
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._timeout(client, args, cmdtimeout, deadline)
+            try:
+                hedge_after = self._hedge_after(client, args, timeout)
+                if hedge_after is None:
+                    return client._execute(args, timeout)
+                return self._hedged(client, args, timeout, hedge_after)
+            except SpeedifyError as err:
+                delay = self._retry_delay(args, err, attempt, deadline)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def run_async(self, client, args, cmdtimeout, execute):
+        """
+        Asyncio counterpart of run(), used by speedify.aio.
+
+        :param execute: Coroutine function running one attempt: execute(client, args, timeout).
+        :type execute: function
+        """
+        deadline = self._deadline()
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._timeout(client, args, cmdtimeout, deadline)
+            try:
+                hedge_after = self._hedge_after(client, args, timeout)
+                if hedge_after is None:
+                    return await execute(client, args, timeout)
+                return await self._hedged_async(client, args, timeout, hedge_after, execute)
+            except SpeedifyError as err:
+                delay = self._retry_delay(args, err, attempt, deadline)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _deadline(self):
+        if self.deadline is None:
+            return None
+        return time.monotonic() + self.deadline
+
+    def _timeout(self, client, args, cmdtimeout, deadline):
+        timeout = client.timeout_for(args, cmdtimeout)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return timeout
+
+    def _retry_delay(self, args, error, attempt, deadline):
+        """Returns the delay before the next attempt, or None to give up."""
+        if attempt >= self.attempts or not self.is_retryable(args, error):
+            return None
+        delay = self.backoff_delay(attempt)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        self._count("retries")
+        logger.debug("Retrying " + _command_name(args) + " after: " + str(error.message))
+        return delay
+
+    def _hedge_after(self, client, args, timeout):
+        """Returns the seconds after which to hedge the command, or None not to."""
+        if not self.hedge or not _is_read_only(args):
+            return None
+        latency = client.metrics.percentile(_command_name(args), self.hedge_percentile, self.hedge_min_samples)
+        if latency is None or latency >= timeout:
+            return None
+        return latency
+
+    def _hedged(self, client, args, timeout, hedge_after):
+        results = queue.Queue()
+
+        def attempt(index, attempt_timeout):
+            try:
+                results.put((index, None, client._execute(args, attempt_timeout)))
+            except BaseException as err:
+                results.put((index, err, None))
+
+        def start(index, attempt_timeout):
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(attempt, index, attempt_timeout), daemon=True).start()
+
+        start(0, timeout)
+        try:
+            index, error, result = results.get(timeout=hedge_after)
+            outstanding = 0
+        except queue.Empty:
+            self._count("hedges")
+            start(1, timeout - hedge_after)
+            index, error, result = results.get()
+            outstanding = 1
+        if error is not None and outstanding:
+            # The other attempt may still succeed
+            index, error, result = results.get()
+        if error is not None:
+            raise error
+        if index == 1:
+            self._count("hedge_wins")
+        return result
+
+    async def _hedged_async(self, client, args, timeout, hedge_after, execute):
+        first = asyncio.ensure_future(execute(client, args, timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        self._count("hedges")
+        second = asyncio.ensure_future(execute(client, args, timeout - hedge_after))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+        finally:
+            # Stops the slower CLI process
+            for task in pending:
+                task.cancel()
+        raise error
+
+
+class RestartPolicy:
+    """
+    When and how a supervised stream is restarted after its CLI exits by itself: when it
+    fails, or when a stream asked to run until stopped (a time of 0) ends.  A stream of a
+    set time that exits cleanly once it is up is not restarted.
+
+    :param backoff: Delay before the first restart in seconds; it doubles for each later one.
+        The actual delay is random, between 0 and this.
+    :type backoff: float
+    :param max_backoff: Longest delay between restarts, in seconds.
+    :type max_backoff: float
+    :param max_restarts: Most restarts in a row before giving up, or None to keep trying.
+    :type max_restarts: int
+    :param reset_after: Seconds a restarted stream must run for its next failure to count
+        as the first again.
+    :type reset_after: float
+    """
+
+    def __init__(self, backoff=0.5, max_backoff=30.0, max_restarts=None, reset_after=60.0):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts
+        self.reset_after = reset_after
+
+    def backoff_delay(self, restart):
+        """
+        :param restart: Number of the restart in a row, from 1.
+        :type restart: int
+        :returns: float -- Seconds to wait before it, with full jitter.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (restart - 1)))
+
+    def gives_up(self, restart):
+        """
+        :param restart: Number of the restart in a row, from 1.
+        :type restart: int
+        :returns: bool -- Whether to stop trying instead.
+        """
+        return self.max_restarts is not None and restart > self.max_restarts
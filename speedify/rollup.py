@@ -0,0 +1,309 @@
+"""
+.. module:: speedify.rollup
+   :synopsis: Multi-resolution rollups of connection_stats, in constant memory
+
+A StatsRollup fed connection_stats events keeps, for each adapter and metric, the
+count, sum, min and max of the samples falling in each time bucket, at several
+resolutions at once.  The defaults keep 1-second buckets for the last 10
+minutes, 1-minute buckets for the last day and 1-hour buckets for the last 30
+days.  No event is kept: each sample updates one bucket per resolution, in
+array.array buffers allocated when the adapter is first seen, which are reused
+as the buckets age out (about 460 KB per adapter with the defaults).
+
+An adapter's sample is taken from its connections in each event: their rates
+(receiveBps, sendBps) are added up and the other metrics (latencyMs, lossReceive,
+lossSend) averaged.  Buckets are aligned on Unix time, so 1-minute buckets start
+on the minute.
+
+Example:
+    from speedify.rollup import StatsRollup
+
+    rollup = StatsRollup()
+    handle = speedify.stats_stream(0, rollup, types=["connection_stats"], restart=RestartPolicy())
+    ...
+    # The last hour of download rates of wlan0, minute by minute
+    for bucket in rollup.query("wlan0", "receiveBps", start=time.time() - 3600, resolution=60):
+        print(bucket.start, bucket.mean, bucket.max)
+"""
+
+import math
+import time
+from array import array
+
+from .timeseries import DEFAULT_FIELDS
+
+# (bucket seconds, buckets kept): 1s for 10 minutes, 1 minute for a day, 1 hour for 30 days
+DEFAULT_RESOLUTIONS = ((1, 600), (60, 24 * 60), (3600, 30 * 24))
+
+# Metrics added up over an adapter's connections; the others are averaged
+_SUMMED = frozenset(("receiveBps", "sendBps"))
+
+
+class Bucket:
+    """
+    The samples of one metric of one adapter in a time bucket.
+
+    :ivar start: Unix time at which the bucket starts.
+    :ivar seconds: Length of the bucket.
+    :ivar count: Samples in the bucket.
+    :ivar sum: Their sum.
+    :ivar min: The smallest.
+    :ivar max: The largest.
+    """
+
+    __slots__ = ("start", "seconds", "count", "sum", "min", "max")
+
+    def __init__(self, start, seconds, count, sum, min, max):
+        self.start = start
+        self.seconds = seconds
+        self.count = count
+        self.sum = sum
+        self.min = min
+        self.max = max
+
+    @property
+    def mean(self):
+        """Mean of the samples."""
+        return self.sum / self.count
+
+    def as_dict(self):
+        return {
+            "start": self.start,
+            "seconds": self.seconds,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+        }
+
+    def __repr__(self):
+        return "Bucket(start=" + repr(self.start) + ", count=" + repr(self.count) + ", mean=" + repr(self.mean) + ")"
+
+
+class _Ring:
+    """
+    The buckets of one adapter at one resolution.  Slot i holds bucket numbers
+    (Unix time // seconds) equal to i modulo the number of buckets; a slot is
+    cleared when a newer bucket takes it over.
+    """
+
+    __slots__ = ("seconds", "buckets", "newest", "_width", "_numbers", "_counts", "_sums", "_mins", "_maxs")
+
+    def __init__(self, seconds, buckets, width):
+        self.seconds = seconds
+        self.buckets = buckets
+        # Number of the newest bucket held
+        self.newest = -1
+        self._width = width
+        self._numbers = array("q", [-1]) * buckets
+        self._counts = array("q", [0]) * (buckets * width)
+        self._sums = array("d", [0.0]) * (buckets * width)
+        self._mins = array("d", [math.inf]) * (buckets * width)
+        self._maxs = array("d", [-math.inf]) * (buckets * width)
+
+    @property
+    def nbytes(self):
+        return sum(
+            buffer.itemsize * len(buffer)
+            for buffer in (self._numbers, self._counts, self._sums, self._mins, self._maxs)
+        )
+
+    def add(self, timestamp, values):
+        number = int(timestamp // self.seconds)
+        slot = number % self.buckets
+        held = self._numbers[slot]
+        if number < held:
+            # Older than the bucket now in the slot, so no longer kept
+            return
+        base = slot * self._width
+        counts, sums, mins, maxs = self._counts, self._sums, self._mins, self._maxs
+        if number != held:
+            self._numbers[slot] = number
+            if number > self.newest:
+                self.newest = number
+            for index in range(base, base + self._width):
+                counts[index] = 0
+                sums[index] = 0.0
+                mins[index] = math.inf
+                maxs[index] = -math.inf
+        for index, value in enumerate(values, base):
+            if value is None:
+                continue
+            counts[index] += 1
+            sums[index] += value
+            if value < mins[index]:
+                mins[index] = value
+            if value > maxs[index]:
+                maxs[index] = value
+
+    @property
+    def oldest_start(self):
+        """Unix time from which buckets are still held."""
+        return (self.newest - self.buckets + 1) * self.seconds
+
+    def query(self, metric, start, end):
+        first = int(start // self.seconds)
+        last = int(end // self.seconds)
+        first = max(first, last - self.buckets + 1)
+        buckets = []
+        for number in range(first, last + 1):
+            slot = number % self.buckets
+            if self._numbers[slot] != number:
+                continue
+            index = slot * self._width + metric
+            count = self._counts[index]
+            if count:
+                bucket_start = number * self.seconds
+                buckets.append(
+                    Bucket(bucket_start, self.seconds, count, self._sums[index], self._mins[index], self._maxs[index])
+                )
+        return buckets
+
+
+class StatsRollup:
+    """
+    Rolls up the connection_stats events it is fed into per-adapter buckets at
+    several resolutions; other events are ignored.  Can be used as a stream callback.
+
+    :param resolutions: (bucket seconds, buckets kept) of each resolution.
+    :type resolutions: tuple
+    :param metrics: Numeric fields of the connections to roll up.
+    :type metrics: tuple
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS, metrics=DEFAULT_FIELDS):
+        resolutions = sorted((int(seconds), int(buckets)) for seconds, buckets in resolutions)
+        if not resolutions:
+            raise ValueError("At least one resolution is needed")
+        for seconds, buckets in resolutions:
+            if seconds < 1 or buckets < 1:
+                raise ValueError("Resolutions need at least 1 second and 1 bucket: " + repr((seconds, buckets)))
+        if len({seconds for seconds, _ in resolutions}) != len(resolutions):
+            raise ValueError("Resolutions must have different bucket lengths")
+        self._resolutions = tuple(resolutions)
+        self.metrics = tuple(metrics)
+        self._metric_index = {metric: index for index, metric in enumerate(self.metrics)}
+        self._adapters = {}
+
+    @property
+    def resolutions(self):
+        """list -- The bucket lengths, in seconds, finest first."""
+        return [seconds for seconds, _ in self._resolutions]
+
+    def retention(self, resolution):
+        """
+        :param resolution: A bucket length, in seconds.
+        :type resolution: int
+        :returns: int -- How many seconds of buckets are kept at that resolution.
+        """
+        for seconds, buckets in self._resolutions:
+            if seconds == resolution:
+                return seconds * buckets
+        raise ValueError("No such resolution: " + repr(resolution))
+
+    def add(self, event, timestamp=None):
+        """
+        Rolls up a connection_stats event.
+
+        :param event: A stats event, as a list or a speedify.events class.
+        :param timestamp: Unix time of the event.  Defaults to when a typed event
+            was received, else now.
+        :type timestamp: float
+        """
+        if event[0] != "connection_stats":
+            return
+        if timestamp is None:
+            received = getattr(event, "received", None)
+            timestamp = time.time() if received is None else time.time() - (time.monotonic() - received)
+        for adapter_id, values in self._samples(event[1].get("connections") or ()).items():
+            rings = self._adapters.get(adapter_id)
+            if rings is None:
+                width = len(self.metrics)
+                rings = self._adapters[adapter_id] = [
+                    _Ring(seconds, buckets, width) for seconds, buckets in self._resolutions
+                ]
+            for ring in rings:
+                ring.add(timestamp, values)
+
+    __call__ = add
+
+    def adapters(self):
+        """
+        :returns: list -- The adapters rolled up.
+        """
+        return list(self._adapters)
+
+    def query(self, adapter_id, metric, start=None, end=None, resolution=None):
+        """
+        Returns the buckets of a metric of an adapter over a time range.  Buckets
+        without samples are left out.
+
+        :param adapter_id: The adapter, e.g. "wlan0".
+        :type adapter_id: str
+        :param metric: The metric, e.g. "receiveBps".
+        :type metric: str
+        :param start: Unix time from which to return buckets.  Defaults to as far
+            back as the resolution goes.
+        :type start: float
+        :param end: Unix time up to which to return buckets.  Defaults to now.
+        :type end: float
+        :param resolution: Bucket length, in seconds, e.g. 60.  Defaults to the
+            finest resolution still holding buckets as old as start.
+        :type resolution: int
+        :returns: list -- speedify.rollup.Bucket, oldest first.
+        :raises ValueError: If the metric or resolution isn't rolled up.
+        """
+        index = self._metric_index.get(metric)
+        if index is None:
+            raise ValueError("No such metric: " + repr(metric))
+        if end is None:
+            end = time.time()
+        if resolution is not None:
+            self.retention(resolution)
+        rings = self._adapters.get(adapter_id)
+        if rings is None:
+            return []
+        if resolution is None:
+            ring = self._ring_for(rings, start)
+        else:
+            ring = next(ring for ring in rings if ring.seconds == resolution)
+        if start is None:
+            start = end - ring.seconds * ring.buckets
+        return ring.query(index, start, end)
+
+    @property
+    def nbytes(self):
+        """Memory used by all the buffers."""
+        return sum(ring.nbytes for rings in self._adapters.values() for ring in rings)
+
+    def _ring_for(self, rings, start):
+        """Returns the finest of an adapter's rings (finest first) still holding buckets from start."""
+        if start is not None:
+            for ring in rings:
+                if start >= ring.oldest_start:
+                    return ring
+            return rings[-1]
+        return rings[0]
+
+    def _samples(self, connections):
+        """Returns each adapter's values of the metrics (None where missing) in one event."""
+        totals = {}
+        for connection in connections:
+            adapter_id = connection.get("adapterID")
+            adapter = totals.get(adapter_id)
+            if adapter is None:
+                # [sum, count] per metric
+                adapter = totals[adapter_id] = [[0.0, 0] for _ in self.metrics]
+            for metric, total in zip(self.metrics, adapter):
+                value = connection.get(metric)
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                    total[0] += value
+                    total[1] += 1
+        return {
+            adapter_id: [
+                None if count == 0 else value if metric in _SUMMED else value / count
+                for metric, (value, count) in zip(self.metrics, adapter)
+            ]
+            for adapter_id, adapter in totals.items()
+        }
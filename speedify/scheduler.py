@@ -0,0 +1,303 @@
+"""
+.. module:: speedify.scheduler
+   :synopsis: Process-wide limits on how fast speedify_cli processes are started
+
+Every speedify_cli process started by a SpeedifyClient first gets permission from
+its SpawnScheduler.  The scheduler can limit how many commands run at once and,
+with a token bucket, how many are started per second.  Commands that have to wait
+are queued in two lanes: INTERACTIVE commands (anything that changes the daemon's
+state, such as connect or disconnect) are started before any queued BACKGROUND
+commands (read-only polling such as show_state or show_adapters), so a busy
+monitoring loop can't starve them.
+
+Clients share default_scheduler unless given their own.  It has no limits until
+configured, and then costs one uncontended lock per command.
+
+Example:
+    from speedify.scheduler import Lane, default_scheduler, use_lane
+
+    # At most 4 CLI processes at once, 10 started per second (bursts of 20)
+    default_scheduler.configure(max_concurrent=4, rate=10, burst=20)
+
+    # A read that a user is waiting for
+    with use_lane(Lane.INTERACTIVE):
+        speedify.show_state()
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+
+from . import _is_read_only
+
+
+class Lane(IntEnum):
+    """Queues of commands waiting to start; lower values go first."""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+# Lane chosen by the caller with use_lane(), for the current thread or task
+_lane_var = contextvars.ContextVar("speedify_lane", default=None)
+
+
+@contextmanager
+def use_lane(lane):
+    """
+    Context manager that runs the commands started in the current thread (or
+    asyncio task) in the given lane, whatever they are.
+
+    :param lane: The lane to use.
+    :type lane: speedify.scheduler.Lane
+    """
+    token = _lane_var.set(Lane(lane))
+    try:
+        yield
+    finally:
+        _lane_var.reset(token)
+
+
+def lane_for(args):
+    """
+    Returns the lane of a command: the one set with use_lane(), else BACKGROUND
+    for read-only commands and INTERACTIVE for the rest.
+
+    :param args: List of command arguments.
+    :type args: list
+    :returns: speedify.scheduler.Lane -- The lane.
+    """
+    lane = _lane_var.get()
+    if lane is not None:
+        return lane
+    return Lane.BACKGROUND if _is_read_only(args) else Lane.INTERACTIVE
+
+
+class _Waiter:
+    __slots__ = ("hold", "wake", "granted", "cancelled")
+
+    def __init__(self, hold, wake):
+        self.hold = hold
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+class SpawnScheduler:
+    """
+    Limits the number of CLI processes running at once and the rate they are
+    started at, starting queued commands by lane, then in arrival order.
+
+    :param max_concurrent: Most commands running at once, or None for no limit.
+    :type max_concurrent: int
+    :param rate: Most commands started per second on average, or None for no limit.
+    :type rate: float
+    :param burst: Commands that can be started at once after a quiet period.  Defaults to rate, at least 1.
+    :type burst: float
+    """
+
+    def __init__(self, max_concurrent=None, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._order = itertools.count()
+        self._timer = None
+        self.running = 0
+        self.configure(max_concurrent, rate, burst)
+
+    def configure(self, max_concurrent=None, rate=None, burst=None):
+        """
+        Changes the limits.  Commands already running are not affected.
+
+        :param max_concurrent: Most commands running at once, or None for no limit.
+        :type max_concurrent: int
+        :param rate: Most commands started per second on average, or None for no limit.
+        :type rate: float
+        :param burst: Commands that can be started at once after a quiet period.  Defaults to rate, at least 1.
+        :type burst: float
+        """
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive")
+        with self._lock:
+            self.max_concurrent = max_concurrent
+            self.rate = rate
+            self.burst = max(1.0, float(burst if burst is not None else rate or 1))
+            self._tokens = self.burst
+            self._refilled = time.monotonic()
+            wake = self._dispatch()
+        for waiter in wake:
+            waiter.wake()
+
+    def waiting(self):
+        """
+        :returns: dict -- Number of commands waiting to start, by lane.
+        """
+        counts = dict.fromkeys(Lane, 0)
+        with self._lock:
+            for lane, _, waiter in self._waiters:
+                if not waiter.cancelled:
+                    counts[lane] += 1
+        return counts
+
+    def acquire(self, args, hold=True):
+        """
+        Waits until the command may be started.
+
+        :param args: List of command arguments, used to pick the lane.
+        :type args: list
+        :param hold: The command counts as running until release() is called.
+            False for commands that run indefinitely (stats streams), which are
+            only limited in how often they start.
+        :type hold: bool
+        """
+        event = threading.Event()
+        waiter = self._enqueue(lane_for(args), hold, event.set)
+        if waiter is None:
+            return
+        try:
+            event.wait()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def acquire_async(self, args, hold=True):
+        """
+        Like acquire(), without blocking the event loop.  If the waiting task is
+        cancelled, it gives up its place.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(_resolve, future)
+
+        waiter = self._enqueue(lane_for(args), hold, wake)
+        if waiter is None:
+            return
+        try:
+            await future
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def release(self):
+        """Marks a command started with hold=True as finished."""
+        with self._lock:
+            self.running -= 1
+            wake = self._dispatch()
+        for waiter in wake:
+            waiter.wake()
+
+    @contextmanager
+    def slot(self, args):
+        """Context manager that holds a place for the command while it runs."""
+        self.acquire(args)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _enqueue(self, lane, hold, wake):
+        """Queues a waiter, or returns None if the command may start right away."""
+        with self._lock:
+            if not self._waiters and self._take(hold):
+                return None
+            waiter = _Waiter(hold, wake)
+            heapq.heappush(self._waiters, (lane, next(self._order), waiter))
+            ready = self._dispatch()
+        for other in ready:
+            other.wake()
+        return waiter
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if not waiter.granted:
+                waiter.cancelled = True
+                return
+        if waiter.hold:
+            self.release()
+
+    def _full(self):
+        return self.max_concurrent is not None and self.running >= self.max_concurrent
+
+    def _take(self, hold):
+        """
+        Takes a running slot (if hold) and a token if they are available.  Called
+        with the lock held.
+        """
+        if hold and self._full():
+            return False
+        if self.rate is not None:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens < 1:
+                self._start_timer((1 - self._tokens) / self.rate)
+                return False
+            self._tokens -= 1
+        if hold:
+            self.running += 1
+        return True
+
+    def _dispatch(self):
+        """Grants queued waiters in order while there is room.  Called with the lock held."""
+        ready = []
+        while self._waiters:
+            waiter = self._waiters[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._waiters)
+                continue
+            if not self._take(waiter.hold):
+                break
+            heapq.heappop(self._waiters)
+            waiter.granted = True
+            ready.append(waiter)
+        if self._waiters and self._full():
+            # Commands that don't hold a slot (streams) don't wait for one to be freed
+            ready.extend(self._dispatch_unheld())
+        return ready
+
+    def _dispatch_unheld(self):
+        """Grants queued waiters not holding a slot, in order, while there are tokens.  Called with the lock held."""
+        ready = []
+        for _, _, waiter in sorted(self._waiters):
+            if waiter.hold or waiter.cancelled:
+                continue
+            if not self._take(False):
+                break
+            waiter.granted = True
+            ready.append(waiter)
+        if ready:
+            self._waiters = [entry for entry in self._waiters if not entry[2].granted]
+            heapq.heapify(self._waiters)
+        return ready
+
+    def _start_timer(self, delay):
+        """Wakes the queue when the next token is due.  Called with the lock held."""
+        if self._timer is not None or not self._waiters:
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            wake = self._dispatch()
+        for waiter in wake:
+            waiter.wake()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Shared by every SpeedifyClient that isn't given a scheduler of its own
+default_scheduler = SpawnScheduler()
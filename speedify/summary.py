@@ -0,0 +1,213 @@
+"""
+.. module:: speedify.summary
+   :synopsis: Constant-memory views of a stream of events
+
+stats() and safebrowsing_error() normally return every event they read, so their
+memory grows with how long they run.  Given last=N, they keep only the latest N
+events of each type in a LastEvents ring buffer.  Given summary=True, stats()
+keeps no events at all and returns a StatsSummary: per-adapter byte totals and
+mean and peak rates, and the state transitions.
+
+Both can also be fed from any stream, e.g. a StatsHub subscription.
+
+Example:
+    summary = speedify.stats(3600, summary=True)
+    for adapter in summary.adapters.values():
+        print(adapter.adapter_id, adapter.receive_bytes, adapter.max_receive_bps)
+
+    recent = speedify.stats(3600, last=5)  # at most 5 events of each type
+"""
+
+import heapq
+import itertools
+import time
+from collections import deque
+
+from .dispatch import _type_of
+
+
+class LastEvents:
+    """
+    Ring buffers of the latest events of each type.
+
+    :param size: Events kept per type.
+    :type size: int
+    :ivar seen: Events added, including those no longer kept.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self.seen = 0
+        self._order = itertools.count()
+        self._buffers = {}
+
+    def add(self, event):
+        """
+        Adds an event, forgetting the oldest of its type if there are already size.
+
+        :param event: A stats event, e.g. ["state", {...}], or any other event
+            (safebrowsing errors), which are kept together.
+        """
+        self.seen += 1
+        event_type = _type_of(event)
+        buffer = self._buffers.get(event_type)
+        if buffer is None:
+            buffer = self._buffers[event_type] = deque(maxlen=self.size)
+        buffer.append((next(self._order), event))
+
+    __call__ = add
+
+    def events(self):
+        """
+        :returns: list -- The events kept, in the order they were added.
+        """
+        return [event for _, event in heapq.merge(*self._buffers.values(), key=lambda entry: entry[0])]
+
+    def by_type(self):
+        """
+        :returns: dict -- The events kept, oldest first, by event type (None for untyped events).
+        """
+        return {event_type: [event for _, event in buffer] for event_type, buffer in self._buffers.items()}
+
+
+class AdapterSummary:
+    """
+    Traffic through one adapter, from connection_stats events.  Byte totals are
+    estimated from the rates reported and the time between events.
+    """
+
+    __slots__ = (
+        "adapter_id",
+        "samples",
+        "receive_bytes",
+        "send_bytes",
+        "max_receive_bps",
+        "max_send_bps",
+        "_receive_bps_sum",
+        "_send_bps_sum",
+    )
+
+    def __init__(self, adapter_id):
+        self.adapter_id = adapter_id
+        self.samples = 0
+        self.receive_bytes = 0.0
+        self.send_bytes = 0.0
+        self.max_receive_bps = 0.0
+        self.max_send_bps = 0.0
+        self._receive_bps_sum = 0.0
+        self._send_bps_sum = 0.0
+
+    @property
+    def mean_receive_bps(self):
+        """Mean download rate over the samples, in bytes per second."""
+        return self._receive_bps_sum / self.samples if self.samples else 0.0
+
+    @property
+    def mean_send_bps(self):
+        """Mean upload rate over the samples, in bytes per second."""
+        return self._send_bps_sum / self.samples if self.samples else 0.0
+
+    def _add(self, receive_bps, send_bps, seconds):
+        self.samples += 1
+        self._receive_bps_sum += receive_bps
+        self._send_bps_sum += send_bps
+        self.max_receive_bps = max(self.max_receive_bps, receive_bps)
+        self.max_send_bps = max(self.max_send_bps, send_bps)
+        self.receive_bytes += receive_bps * seconds
+        self.send_bytes += send_bps * seconds
+
+    def as_dict(self):
+        return {
+            "adapterID": self.adapter_id,
+            "samples": self.samples,
+            "receiveBytes": self.receive_bytes,
+            "sendBytes": self.send_bytes,
+            "meanReceiveBps": self.mean_receive_bps,
+            "meanSendBps": self.mean_send_bps,
+            "maxReceiveBps": self.max_receive_bps,
+            "maxSendBps": self.max_send_bps,
+        }
+
+
+class StatsSummary:
+    """
+    A running summary of stats events, using the same memory however many it is fed.
+
+    :param max_transitions: State transitions kept; older ones are only counted.
+    :type max_transitions: int
+    :ivar events: Number of events added, by type.
+    :ivar adapters: AdapterSummary by adapter ID.
+    :ivar state: The latest state, e.g. "CONNECTED", or None.
+    :ivar transitions: The latest state transitions, as (seconds since the first event, old state, new state).
+    :ivar transition_count: Number of state transitions, including those no longer kept.
+    """
+
+    def __init__(self, max_transitions=100):
+        self.events = {}
+        self.adapters = {}
+        self.state = None
+        self.transitions = deque(maxlen=max_transitions)
+        self.transition_count = 0
+        self._start = None
+        self._last_sample = None
+
+    def add(self, event, received=None):
+        """
+        Adds an event.
+
+        :param event: A stats event, as a list or a speedify.events class.
+        :param received: time.monotonic() when it was read.  Defaults to the event's
+            received time if it has one, else now.
+        :type received: float
+        """
+        if received is None:
+            received = getattr(event, "received", None) or time.monotonic()
+        if self._start is None:
+            self._start = received
+        event_type, data = event
+        self.events[event_type] = self.events.get(event_type, 0) + 1
+        if event_type == "state":
+            self._add_state(data.get("state"), received)
+        elif event_type == "connection_stats":
+            self._add_connections(data.get("connections") or (), received)
+
+    __call__ = add
+
+    def as_dict(self):
+        """
+        :returns: dict -- The summary, as JSON-serializable values.
+        """
+        return {
+            "events": dict(self.events),
+            "state": self.state,
+            "transitions": [list(transition) for transition in self.transitions],
+            "transitionCount": self.transition_count,
+            "adapters": {adapter_id: adapter.as_dict() for adapter_id, adapter in self.adapters.items()},
+        }
+
+    def _add_state(self, state, received):
+        if state != self.state:
+            if self.state is not None:
+                self.transitions.append((received - self._start, self.state, state))
+                self.transition_count += 1
+            self.state = state
+
+    def _add_connections(self, connections, received):
+        # Bytes are estimated from the rates at the end of each interval
+        seconds = received - self._last_sample if self._last_sample is not None else 0.0
+        self._last_sample = received
+        rates = {}
+        for connection in connections:
+            adapter_id = connection.get("adapterID")
+            receive_bps, send_bps = rates.get(adapter_id, (0.0, 0.0))
+            rates[adapter_id] = (
+                receive_bps + (connection.get("receiveBps") or 0),
+                send_bps + (connection.get("sendBps") or 0),
+            )
+        for adapter_id, (receive_bps, send_bps) in rates.items():
+            adapter = self.adapters.get(adapter_id)
+            if adapter is None:
+                adapter = self.adapters[adapter_id] = AdapterSummary(adapter_id)
+            adapter._add(receive_bps, send_bps, seconds)
@@ -0,0 +1,250 @@
+"""
+.. module:: speedify.timeseries
+   :synopsis: Per-connection time series of connection_stats, in fixed-size arrays
+
+A TimeSeriesRecorder fed connection_stats events keeps the numeric fields of
+each connection (throughput, latency, loss) in ring buffers backed by
+array.array, preallocated to a fixed capacity, so memory use doesn't grow with
+how long it runs: capacity * (8 + 4 * fields) bytes per connection, e.g. about
+2.4 MB for a day of 1 Hz samples of the 5 default fields.
+
+Series are found by connectionID or adapterID.  Connection IDs include the
+subnet, so they change as the device roams or gets new addresses: at most
+max_connections series are kept, the least recently updated being dropped to
+make room, and forget() drops one sooner.  With NumPy installed (the numpy
+extra), view() exposes a buffer as a NumPy array without copying it.
+
+Example:
+    from speedify.timeseries import TimeSeriesRecorder
+
+    recorder = TimeSeriesRecorder(capacity=24 * 3600)
+    with speedify.stats_stream(0, recorder.add, types=["connection_stats"]):
+        ...
+    for series in recorder.by_adapter("wlan0"):
+        print(series.connection_id, max(series.values("receiveBps")))
+        latency = series.view("latencyMs")  # numpy.ndarray sharing the buffer
+"""
+
+import logging
+import math
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Fields of connection_stats connections recorded by default
+DEFAULT_FIELDS = ("receiveBps", "sendBps", "latencyMs", "lossReceive", "lossSend")
+
+
+class ConnectionSeries:
+    """
+    The samples of one connection: their receive times and a ring buffer per field.
+    A field missing from a sample is recorded as NaN.
+
+    :ivar connection_id: The connection, e.g. "wlan0%10.0.0.0/24".
+    :ivar adapter_id: Its adapter, e.g. "wlan0".
+    :ivar capacity: Most samples kept; older ones are overwritten.
+    :ivar count: Samples kept.
+    """
+
+    __slots__ = ("connection_id", "adapter_id", "capacity", "count", "_next", "_updated", "_times", "_values")
+
+    def __init__(self, connection_id, adapter_id, capacity, fields, typecode):
+        self.connection_id = connection_id
+        self.adapter_id = adapter_id
+        self.capacity = capacity
+        self.count = 0
+        self._next = 0
+        # Number of the recorder's last event that updated it
+        self._updated = 0
+        self._times = _zeros("d", capacity)
+        self._values = {field: _zeros(typecode, capacity) for field in fields}
+
+    @property
+    def fields(self):
+        """The fields recorded."""
+        return tuple(self._values)
+
+    @property
+    def start(self):
+        """Index in the buffers of the oldest sample."""
+        return (self._next - self.count) % self.capacity
+
+    @property
+    def nbytes(self):
+        """Memory used by the buffers."""
+        return sum(buffer.itemsize * self.capacity for buffer in (self._times, *self._values.values()))
+
+    def times(self):
+        """
+        :returns: array.array -- The time.monotonic() of each sample, oldest first (a copy).
+        """
+        return self._ordered(self._times)
+
+    def values(self, field):
+        """
+        :param field: The field, e.g. "receiveBps".
+        :type field: str
+        :returns: array.array -- Its value in each sample, oldest first (a copy).
+        """
+        return self._ordered(self._values[field])
+
+    def view(self, field=None):
+        """
+        Returns the samples kept as a NumPy array sharing the buffer's memory, in
+        buffer order: oldest first until the buffer is full, then starting at
+        start.  Fine as is for order-independent analysis (mean, max, percentiles,
+        masks across fields); see to_numpy() for time order.  The view changes as
+        samples are added.
+
+        :param field: The field, or None for the times.
+        :type field: str
+        :returns: numpy.ndarray -- The view.
+        :raises ImportError: If NumPy isn't installed.
+        """
+        if numpy is None:
+            raise ImportError("NumPy views need numpy: pip install speedify-py[numpy]")
+        buffer = self._times if field is None else self._values[field]
+        return numpy.frombuffer(buffer, dtype=buffer.typecode)[:self.count]
+
+    def to_numpy(self, field=None):
+        """
+        :param field: The field, or None for the times.
+        :type field: str
+        :returns: numpy.ndarray -- The samples kept, oldest first.  A view until the
+            buffer wraps around, then a copy.
+        """
+        view = self.view(field)
+        start = self.start
+        if start == 0:
+            return view
+        return numpy.concatenate((view[start:], view[:start]))
+
+    def _append(self, received, connection):
+        index = self._next
+        self._times[index] = received
+        for field, buffer in self._values.items():
+            value = connection.get(field)
+            try:
+                buffer[index] = math.nan if value is None else value
+            except TypeError:
+                buffer[index] = math.nan
+        self._next = (index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _ordered(self, buffer):
+        start = self.start
+        if self.count < self.capacity:
+            return buffer[:self.count]
+        return buffer[start:] + buffer[:start]
+
+
+class TimeSeriesRecorder:
+    """
+    Records the connections of connection_stats events; other events are ignored.
+
+    :param capacity: Samples kept per connection.
+    :type capacity: int
+    :param fields: Numeric fields of the connections to record.
+    :type fields: tuple
+    :param typecode: array typecode of the values: "f" (float32) or "d" (float64).
+    :type typecode: str
+    :param max_connections: Most connections recorded; the least recently updated
+        one is dropped to make room for a new one.  None for no limit.
+    :type max_connections: int
+    """
+
+    def __init__(self, capacity=24 * 3600, fields=DEFAULT_FIELDS, typecode="f", max_connections=16):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if max_connections is not None and max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.typecode = typecode
+        self.max_connections = max_connections
+        self._series = {}
+        self._events = 0
+
+    def add(self, event, received=None):
+        """
+        Records the connections of a connection_stats event.
+
+        :param event: A stats event, as a list or a speedify.events class.
+        :param received: time.monotonic() when it was read.  Defaults to the event's
+            received time if it has one, else now.
+        :type received: float
+        """
+        if event[0] != "connection_stats":
+            return
+        if received is None:
+            received = getattr(event, "received", None) or time.monotonic()
+        self._events += 1
+        for connection in event[1].get("connections") or ():
+            connection_id = connection.get("connectionID")
+            series = self._series.get(connection_id)
+            if series is None:
+                if self.max_connections is not None and len(self._series) >= self.max_connections:
+                    self._evict()
+                series = self._series[connection_id] = ConnectionSeries(
+                    connection_id, connection.get("adapterID"), self.capacity, self.fields, self.typecode
+                )
+            series._updated = self._events
+            series._append(received, connection)
+
+    __call__ = add
+
+    def connection_ids(self):
+        """
+        :returns: list -- The connections recorded.
+        """
+        return list(self._series)
+
+    def series(self, connection_id):
+        """
+        :param connection_id: The connection, e.g. "wlan0%10.0.0.0/24".
+        :type connection_id: str
+        :returns: speedify.timeseries.ConnectionSeries -- Its samples, or None if it was never seen.
+        """
+        return self._series.get(connection_id)
+
+    def by_adapter(self, adapter_id):
+        """
+        :param adapter_id: The adapter, e.g. "wlan0".
+        :type adapter_id: str
+        :returns: list -- The ConnectionSeries of its connections.
+        """
+        return [series for series in self._series.values() if series.adapter_id == adapter_id]
+
+    def forget(self, connection_id):
+        """
+        Stops recording a connection, freeing its buffers.  It is recorded afresh if
+        it shows up again.
+
+        :param connection_id: The connection, e.g. "wlan0%10.0.0.0/24".
+        :type connection_id: str
+        :returns: speedify.timeseries.ConnectionSeries -- Its samples, or None if it wasn't recorded.
+        """
+        return self._series.pop(connection_id, None)
+
+    @property
+    def nbytes(self):
+        """Memory used by all the buffers."""
+        return sum(series.nbytes for series in self._series.values())
+
+    def _evict(self):
+        """Forgets the least recently updated connection."""
+        stalest = min(self._series.values(), key=lambda series: series._updated)
+        logger.debug("Forgetting the time series of " + str(stalest.connection_id))
+        del self._series[stalest.connection_id]
+
+
+def _zeros(typecode, length):
+    # Allocated in one go rather than grown
+    return array(typecode, bytes(array(typecode).itemsize * length))
@@ -0,0 +1,534 @@
+"""
+.. module:: speedify.transports
+   :synopsis: How speedify_cli commands are launched
+
+A transport runs a complete speedify_cli command line, either to completion
+(run(), used by the command wrappers) or as a stream of output lines (stream(),
+used by stats and safebrowsing_error).  SpeedifyClient runs every command through
+its transport, so replacing the transport changes how all of the wrappers reach the
+daemon.
+
+Transports:
+
+- SubprocessTransport: runs the real CLI with subprocess.  The default.
+- speedify.PreforkSpawner: runs the real CLI from small pre-started helper processes.
+- FakeTransport: answers in-process with canned results; no CLI or daemon needed.
+- RecordingTransport / ReplayTransport: record what another transport saw to a
+  file, and play it back later.
+
+Example:
+    import speedify
+    from speedify import FakeTransport, SpeedifyClient
+
+    fake = FakeTransport()
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("show adapters", [{"adapterID": "eth0", "state": "connected"}])
+
+    client = SpeedifyClient(transport=fake)
+    client.show_state()  # State.CONNECTED
+"""
+
+import json
+import logging
+import subprocess
+import threading
+import time
+
+from speedify import SpeedifyError, _command_name, use_shell
+
+logger = logging.getLogger(__name__)
+
+
+def _cli_args(cmd):
+    """Returns the speedify_cli arguments of a command line, without the CLI path and -s flag."""
+    args = list(cmd[1:])
+    if args and args[0] == "-s":
+        args = args[1:]
+    return args
+
+
+class Stream:
+    """
+    The output of a running command, read one line at a time.
+
+    Iterating gives each line of stdout as bytes (including the line ending) until
+    the command exits.  returncode is set once the command has ended, and stderr
+    holds what the command printed to stderr if it was captured.  Leaving the with
+    block, or calling close(), stops the command if it is still running.  close()
+    may be called from another thread to stop a stream that is being read.
+    """
+
+    returncode = None
+    stderr = b""
+
+    def __iter__(self):
+        return iter(())
+
+    def close(self):
+        """Stops the command if it is still running and waits for it to end."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Transport:
+    """
+    Base class for the ways of running speedify_cli.
+
+    cmd is always the complete command line, starting with the CLI path.
+
+    :ivar needs_cli: False if the transport never starts the CLI, so the client
+        doesn't have to find it.
+    """
+
+    needs_cli = True
+
+    def run(self, cmd, timeout=None):
+        """
+        Runs a command to completion.
+
+        :param cmd: The command line, e.g. ["/usr/share/speedify/speedify_cli", "-s", "state"].
+        :type cmd: list
+        :param timeout: Seconds to wait for the command, or None to wait forever.
+        :type timeout: float
+        :returns: tuple -- (returncode, stdout bytes, stderr bytes)
+        :raises subprocess.TimeoutExpired: If the command did not finish in time.
+        :raises OSError: If the command could not be started.
+        """
+        raise NotImplementedError
+
+    def stream(self, cmd, capture_stderr=False):
+        """
+        Starts a command whose output is read while it runs.
+
+        :param cmd: The command line.
+        :type cmd: list
+        :param capture_stderr: Collect the command's stderr in Stream.stderr, rather
+            than letting it through to this process's stderr (or discarding it).
+        :type capture_stderr: bool
+        :returns: Stream -- The command's output.
+        """
+        raise NotImplementedError
+
+
+# ============================================================================
+# subprocess
+# ============================================================================
+
+class _SubprocessStream(Stream):
+    def __init__(self, proc):
+        self.proc = proc
+        self._stderr = []
+        self._stderr_reader = None
+        if proc.stderr is not None:
+            # Drained on its own thread so a chatty stderr can't block stdout
+            self._stderr_reader = threading.Thread(
+                target=lambda: self._stderr.append(proc.stderr.read()), daemon=True
+            )
+            self._stderr_reader.start()
+
+    @property
+    def stderr(self):
+        return b"".join(self._stderr)
+
+    @property
+    def returncode(self):
+        return self.proc.returncode
+
+    def __iter__(self):
+        try:
+            for line in self.proc.stdout:
+                yield line
+        except ValueError:
+            # stdout was closed by close() from another thread
+            if not self.proc.stdout.closed:
+                raise
+
+    def close(self):
+        killed = self.proc.poll() is None
+        if killed:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+        if self._stderr_reader is not None:
+            # Something the CLI started may still hold stderr open; don't wait for it
+            self._stderr_reader.join(1 if killed else None)
+            if not self._stderr_reader.is_alive():
+                self.proc.stderr.close()
+
+
+class SubprocessTransport(Transport):
+    """
+    Runs the CLI with subprocess.run() and subprocess.Popen().
+
+    :param shell: Run the CLI through the shell.  Defaults to use_shell() for this platform.
+    :type shell: bool
+    """
+
+    def __init__(self, shell=None):
+        self.shell = use_shell() if shell is None else shell
+
+    def run(self, cmd, timeout=None):
+        try:
+            result = subprocess.run(
+                cmd,
+                stdout=subprocess.PIPE,  # Capture stdout for JSON response
+                stderr=subprocess.PIPE,  # Capture stderr for error messages
+                shell=self.shell,        # Platform-specific: True on Windows, False on Unix
+                check=True,              # Raise CalledProcessError on non-zero exit
+                timeout=timeout,         # Prevent indefinite hangs
+            )
+        except subprocess.CalledProcessError as cpe:
+            return cpe.returncode, cpe.stdout, cpe.stderr
+        return result.returncode, result.stdout, result.stderr
+
+    def stream(self, cmd, capture_stderr=False):
+        return _SubprocessStream(
+            subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE if capture_stderr else None
+            )
+        )
+
+
+# ============================================================================
+# In-process fake
+# ============================================================================
+
+def _as_bytes(value):
+    if value is None:
+        return b""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return json.dumps(value).encode("utf-8")
+
+
+def _as_line(value):
+    line = _as_bytes(value)
+    return line if line.endswith(b"\n") else line + b"\n"
+
+
+class _FakeStream(Stream):
+    def __init__(self, lines, returncode, interval, stderr=b""):
+        self._lines = lines
+        self.stderr = stderr
+        self._final_returncode = returncode
+        self._interval = interval
+        self._finished = False
+        self._stopped = threading.Event()
+
+    def __iter__(self):
+        for position, line in enumerate(self._lines):
+            if position and self._interval and self._stopped.wait(self._interval):
+                break
+            if self._stopped.is_set():
+                break
+            yield line
+        else:
+            self._finished = True
+        self.close()
+
+    def close(self):
+        self._stopped.set()
+        if self.returncode is None:
+            # Stopped early: report it like a killed process
+            self.returncode = self._final_returncode if self._finished else -9
+
+
+class FakeTransport(Transport):
+    """
+    Answers commands in-process with results added beforehand, without running the CLI.
+
+    Commands are matched first on their exact arguments, then on the command name
+    (e.g. "show adapters" or "adapter priority", see SpeedifyClient.set_timeout()).
+    A command given several results returns them in turn and then keeps returning
+    the last one.  Commands without a result exit with code 4, like an unknown CLI
+    parameter.  Every command run is appended to calls.
+
+    Example:
+        fake = FakeTransport()
+        fake.add("show adapters", [{"adapterID": "eth0"}], delay=0.05)
+        fake.add("connect", returncode=1,
+                 stderr={"errorCode": 3841, "errorType": "Timeout", "errorMessage": "Timeout"})
+        fake.add_stream("stats", [["state", {"state": "CONNECTED"}]], interval=1)
+        fake.add(["adapter", "priority", "wlan0", "always"], lambda args: {"priorities": args[2:]})
+
+    :ivar calls: The CLI arguments of every command run, in order.
+    """
+
+    needs_cli = False
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+        self._results = {}
+        self._streams = {}
+
+    def add(self, command, result=None, returncode=0, stderr=None, delay=0.0):
+        """
+        Adds a result for a command.
+
+        :param command: A command name such as "state" or "show adapters", or a complete argument list.
+        :type command: str or list
+        :param result: What the command prints: a JSON-serializable value, bytes, or a
+            function that takes the CLI arguments and returns either.
+        :param returncode: The command's exit code.
+        :type returncode: int
+        :param stderr: What the command prints to stderr, e.g. a daemon error dict.
+        :param delay: Seconds the command takes.
+        :type delay: float
+        """
+        with self._lock:
+            self._results.setdefault(self._key(command), []).append((result, returncode, stderr, delay))
+
+    def add_stream(self, command, messages, returncode=0, interval=0.0, stderr=None):
+        """
+        Adds the output of a streaming command, such as stats.
+
+        :param command: A command name or a complete argument list.
+        :type command: str or list
+        :param messages: Lines the command prints: JSON-serializable values or bytes.
+        :type messages: list
+        :param returncode: The command's exit code once all messages are printed.
+        :type returncode: int
+        :param interval: Seconds between messages.
+        :type interval: float
+        :param stderr: What the command prints to stderr.
+        """
+        with self._lock:
+            self._streams.setdefault(self._key(command), []).append(
+                ([_as_line(message) for message in messages], returncode, interval, _as_bytes(stderr))
+            )
+
+    def run(self, cmd, timeout=None):
+        args = _cli_args(cmd)
+        with self._lock:
+            self.calls.append(args)
+            response = self._next(self._results, args)
+        if response is None:
+            return 4, b"", b"Unknown parameter\n"
+
+        result, returncode, stderr, delay = response
+        if delay:
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            time.sleep(delay)
+        if callable(result):
+            result = result(args)
+        stdout = _as_line(result) if result is not None else b""
+        return returncode, stdout, _as_bytes(stderr)
+
+    def stream(self, cmd, capture_stderr=False):
+        args = _cli_args(cmd)
+        with self._lock:
+            self.calls.append(args)
+            response = self._next(self._streams, args)
+        if response is None:
+            return _FakeStream([], 4, 0, b"Unknown parameter\n" if capture_stderr else b"")
+        lines, returncode, interval, stderr = response
+        return _FakeStream(lines, returncode, interval, stderr if capture_stderr else b"")
+
+    @staticmethod
+    def _key(command):
+        if isinstance(command, str):
+            return command
+        return tuple(str(arg) for arg in command)
+
+    @staticmethod
+    def _next(table, args):
+        if not args:
+            return None
+        responses = table.get(tuple(args)) or table.get(_command_name(args))
+        if not responses:
+            return None
+        if len(responses) > 1:
+            return responses.pop(0)
+        return responses[0]
+
+
+# ============================================================================
+# Record / replay
+# ============================================================================
+
+def _recorded_args(args):
+    # Don't write credentials to disk
+    if args and args[0] == "login" and args[1:] not in ([], ["auto"]):
+        return ["login"] + ["*"] * (len(args) - 1)
+    return list(args)
+
+
+def _as_text(data):
+    return (data or b"").decode("utf-8", "surrogateescape")
+
+
+def _from_text(text):
+    return text.encode("utf-8", "surrogateescape")
+
+
+class _RecordingStream(Stream):
+    def __init__(self, transport, args, stream):
+        self._transport = transport
+        self._args = args
+        self._stream = stream
+        self._lines = []
+        self._start = time.monotonic()
+        self._recorded = False
+
+    @property
+    def returncode(self):
+        return self._stream.returncode
+
+    @property
+    def stderr(self):
+        return self._stream.stderr
+
+    def __iter__(self):
+        for line in self._stream:
+            self._lines.append(_as_text(line))
+            yield line
+        self.close()
+
+    def close(self):
+        self._stream.close()
+        if not self._recorded:
+            self._recorded = True
+            self._transport._write(
+                {
+                    "args": self._args,
+                    "stream": self._lines,
+                    "returncode": self._stream.returncode,
+                    "stderr": _as_text(self._stream.stderr),
+                    "duration": time.monotonic() - self._start,
+                }
+            )
+
+
+class RecordingTransport(Transport):
+    """
+    Runs commands through another transport and appends each one, with its output,
+    to a file of JSON lines that ReplayTransport can play back.
+
+    Arguments to login are not written to the file.
+
+    Example:
+        with RecordingTransport("session.jsonl") as recorder:
+            client = SpeedifyClient(transport=recorder)
+            client.show_adapters()
+            client.stats(5)
+
+    :param path: File to append the recording to.
+    :type path: str
+    :param transport: The transport that really runs the commands.  Defaults to SubprocessTransport().
+    :type transport: speedify.Transport
+    """
+
+    def __init__(self, path, transport=None):
+        self.transport = transport if transport is not None else SubprocessTransport()
+        self.needs_cli = self.transport.needs_cli
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes the recording file."""
+        with self._lock:
+            self._file.close()
+
+    def run(self, cmd, timeout=None):
+        args = _recorded_args(_cli_args(cmd))
+        start = time.monotonic()
+        try:
+            returncode, stdout, stderr = self.transport.run(cmd, timeout)
+        except subprocess.TimeoutExpired:
+            self._write({"args": args, "timeout": True, "duration": time.monotonic() - start})
+            raise
+        self._write(
+            {
+                "args": args,
+                "returncode": returncode,
+                "stdout": _as_text(stdout),
+                "stderr": _as_text(stderr),
+                "duration": time.monotonic() - start,
+            }
+        )
+        return returncode, stdout, stderr
+
+    def stream(self, cmd, capture_stderr=False):
+        return _RecordingStream(
+            self, _recorded_args(_cli_args(cmd)), self.transport.stream(cmd, capture_stderr)
+        )
+
+    def _write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+
+class ReplayTransport(Transport):
+    """
+    Plays back a file written by RecordingTransport, without running the CLI.
+
+    Commands are matched on their arguments.  A command recorded several times
+    returns the recordings in order and then keeps returning the last one.  A
+    command that was never recorded raises SpeedifyError.
+
+    :param path: The recording.
+    :type path: str
+    :param realtime: Take as long as the recorded commands took, e.g. for load tests.
+    :type realtime: bool
+    """
+
+    needs_cli = False
+
+    def __init__(self, path, realtime=False):
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._records = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    kind = "stream" if "stream" in record else "run"
+                    self._records.setdefault((kind, tuple(record["args"])), []).append(record)
+
+    def run(self, cmd, timeout=None):
+        record = self._next("run", cmd)
+        duration = record.get("duration", 0) if self.realtime else 0
+        if record.get("timeout") or (timeout is not None and duration > timeout):
+            if duration:
+                time.sleep(duration if timeout is None else min(duration, timeout))
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if duration:
+            time.sleep(duration)
+        return record["returncode"], _from_text(record["stdout"]), _from_text(record["stderr"])
+
+    def stream(self, cmd, capture_stderr=False):
+        record = self._next("stream", cmd)
+        lines = [_from_text(line) for line in record["stream"]]
+        interval = 0.0
+        if self.realtime and len(lines) > 1:
+            interval = record.get("duration", 0) / len(lines)
+        stderr = _from_text(record.get("stderr", "")) if capture_stderr else b""
+        return _FakeStream(lines, record["returncode"], interval, stderr)
+
+    def _next(self, kind, cmd):
+        args = _recorded_args(_cli_args(cmd))
+        with self._lock:
+            records = self._records.get((kind, tuple(args)))
+            if not records:
+                logger.error("No recording for: " + " ".join(args))
+                raise SpeedifyError("No recorded output for command " + " ".join(args))
+            if len(records) > 1:
+                return records.pop(0)
+            return records[0]
@@ -0,0 +1,184 @@
+"""
+Unit tests for the speedify.aio module using mocking.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_aio.py -m unit
+"""
+import asyncio
+import os
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import speedify
+from speedify import aio
+from speedify import State, SpeedifyError, SpeedifyAPIError
+
+
+def _fake_process(returncode=0, stdout=b"", stderr=b""):
+    proc = MagicMock()
+    proc.returncode = returncode
+    proc.communicate = AsyncMock(return_value=(stdout, stderr))
+    proc.wait = AsyncMock(return_value=returncode)
+    return proc
+
+
+@pytest.mark.unit
+def test_aio_mirrors_command_wrappers():
+    """Test that aio exposes coroutine versions of the CLI wrappers only."""
+    for name in ["connect", "show_adapters", "adapter_priority", "streamingbypass_service"]:
+        assert asyncio.iscoroutinefunction(getattr(aio, name))
+    assert not hasattr(aio, "set_cli")
+    assert not hasattr(aio, "stats_callback")
+
+
+@pytest.mark.unit
+def test_aio_show_state_converts_result():
+    """Test that aio.show_state() runs the CLI and returns a State."""
+    proc = _fake_process(stdout=b'{"state": "CONNECTED"}\n')
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)) as mock_exec:
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            result = asyncio.run(aio.show_state())
+
+    assert result == State.CONNECTED
+    assert mock_exec.call_args[0] == ("/path/to/cli", "-s", "state")
+
+
+@pytest.mark.unit
+def test_aio_builds_same_command_as_sync_wrapper():
+    """Test that aio wrappers pass their arguments through the sync argument handling."""
+    proc = _fake_process(stdout=b'{"encrypted": false}')
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)) as mock_exec:
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            result = asyncio.run(aio.encryption(False))
+
+    assert result == {"encrypted": False}
+    assert mock_exec.call_args[0] == ("/path/to/cli", "-s", "encryption", "off")
+
+
+@pytest.mark.unit
+def test_aio_api_error_mapping():
+    """Test that exit code 1 raises SpeedifyAPIError like the sync API."""
+    proc = _fake_process(
+        returncode=1,
+        stderr=b'{"errorCode": 3841, "errorType": "Timeout waiting for result", "errorMessage": "Timeout"}',
+    )
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)):
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            with pytest.raises(SpeedifyAPIError) as exc_info:
+                asyncio.run(aio.show_settings())
+
+    assert exc_info.value.error_code == 3841
+
+
+@pytest.mark.unit
+def test_aio_timeout_kills_process():
+    """Test that a timed out command kills the CLI and raises SpeedifyError."""
+    proc = _fake_process()
+    proc.returncode = None
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    proc.communicate = hang
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)):
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            with pytest.raises(SpeedifyError):
+                asyncio.run(aio._run_speedify_cmd(["state"], cmdtimeout=0.01))
+
+    proc.kill.assert_called_once()
+
+
+@pytest.mark.unit
+def test_aio_does_not_leak_interceptor_into_sync_calls():
+    """Test that the sync API is unaffected after an aio call."""
+    proc = _fake_process(stdout=b'{"state": "LOGGED_IN"}')
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)):
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            asyncio.run(aio.show_state())
+
+    assert speedify._cmd_interceptor.get() is None
+
+
+@pytest.mark.unit
+def test_aio_concurrent_reads_are_coalesced():
+    """Test that identical reads awaited together share one CLI process."""
+    proc = _fake_process(stdout=b'[{"adapterID": "eth0"}]')
+
+    async def main():
+        return await asyncio.gather(*[aio.show_adapters() for _ in range(20)])
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)) as mock_exec:
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            results = asyncio.run(main())
+
+    assert mock_exec.call_count == 1
+    assert all(result == [{"adapterID": "eth0"}] for result in results)
+    assert results[0] is not results[1]
+
+
+@pytest.mark.unit
+def test_aio_cancelling_every_coalesced_awaiter_kills_process():
+    """Test that the shared CLI process is killed once all its awaiters are cancelled, and not before."""
+    proc = _fake_process()
+    proc.returncode = None
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    proc.communicate = hang
+
+    async def main():
+        awaiters = [asyncio.ensure_future(aio.show_adapters()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        awaiters[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not proc.kill.called
+        for awaiter in awaiters[1:]:
+            awaiter.cancel()
+        await asyncio.gather(*awaiters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        # Before asyncio.run() cancels whatever is left
+        proc.kill.assert_called_once()
+
+    with patch("asyncio.create_subprocess_exec", AsyncMock(return_value=proc)) as mock_exec:
+        with patch("speedify.get_cli", return_value="/path/to/cli"):
+            asyncio.run(main())
+
+    assert mock_exec.call_count == 1
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not os.path.exists("/bin/sh"), reason="needs /bin/sh")
+def test_aio_speedtest_progress(tmp_path):
+    """Test that aio wrappers pass each object to progress as the CLI prints it."""
+    cli = tmp_path / "speedify_cli"
+    cli.write_text("#!/bin/sh\necho '{\"percent\": 50}'\necho '[{\"downloadSpeed\": 1}]'\n")
+    cli.chmod(0o755)
+    reports = []
+
+    with speedify.SpeedifyClient(cli_path=str(cli)).activate():
+        result = asyncio.run(aio.speedtest(progress=reports.append))
+
+    assert result == [{"downloadSpeed": 1}]
+    assert reports == [{"percent": 50}, [{"downloadSpeed": 1}]]
+
+
+@pytest.mark.unit
+def test_aio_progress_with_other_transports():
+    """Test that progress works for transports run on the executor."""
+    fake = speedify.FakeTransport()
+    fake.add_stream("connect", [{"state": "CONNECTING"}, {"tag": "us-nyc-1"}])
+    reports = []
+
+    with speedify.SpeedifyClient(transport=fake).activate():
+        result = asyncio.run(aio.connect("closest", progress=reports.append))
+
+    assert result == {"tag": "us-nyc-1"}
+    assert reports == [{"state": "CONNECTING"}, {"tag": "us-nyc-1"}]
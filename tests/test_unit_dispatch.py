@@ -0,0 +1,167 @@
+"""
+Unit tests for speedify.dispatch.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_dispatch.py -m unit
+"""
+import queue
+import threading
+import time
+
+import pytest
+
+from speedify import FakeTransport, SpeedifyClient
+from speedify.dispatch import EventQueue, Overflow
+from speedify.events import from_message
+
+
+def _events(count, event_type="state"):
+    return [[event_type, {"n": n}] for n in range(count)]
+
+
+@pytest.mark.unit
+def test_drop_oldest_and_drop_newest():
+    """Test that a full queue drops the oldest or the newest events, and counts them."""
+    oldest = EventQueue(3, Overflow.DROP_OLDEST)
+    newest = EventQueue(3, "drop_newest")
+    for event in _events(5):
+        oldest.put(event)
+        newest.put(event)
+    oldest.close()
+    newest.close()
+
+    assert list(oldest) == _events(5)[2:]
+    assert list(newest) == _events(5)[:3]
+    assert oldest.dropped == newest.dropped == 2
+
+
+@pytest.mark.unit
+def test_coalesce_keeps_latest_per_type_in_place():
+    """Test that a queued event is replaced by a newer one of its type, keeping its place."""
+    events = EventQueue(10, Overflow.COALESCE)
+    events.put(["state", {"n": 0}])
+    events.put(["adapters", []])
+    events.put(["state", {"n": 1}])
+    events.put(from_message(["state", {"n": 2}]))
+    events.put({"error": 1})  # untyped events are never coalesced
+    events.put({"error": 1})
+
+    assert events.get() == ["state", {"n": 2}]
+    # Once read, a type is queued again
+    events.put(["state", {"n": 3}])
+    events.close()
+    assert list(events) == [["adapters", []], {"error": 1}, {"error": 1}, ["state", {"n": 3}]]
+    assert events.coalesced == 2
+    assert events.dropped == 0
+
+
+@pytest.mark.unit
+def test_coalesce_drops_oldest_when_full_of_other_types():
+    """Test that COALESCE drops the oldest event when no event of the same type is queued."""
+    events = EventQueue(2, Overflow.COALESCE)
+    for event_type in ("state", "adapters", "connection_stats"):
+        events.put([event_type, {}])
+    events.close()
+
+    assert [event[0] for event in events] == ["adapters", "connection_stats"]
+    assert events.dropped == 1
+
+
+@pytest.mark.unit
+def test_block_waits_for_room_until_closed():
+    """Test that BLOCK makes the producer wait, and that closing the queue releases it."""
+    events = EventQueue(1, Overflow.BLOCK)
+    events.put(1)
+    done = threading.Event()
+
+    def producer():
+        events.put(2)
+        events.put(3)
+        done.set()
+
+    threading.Thread(target=producer, daemon=True).start()
+    assert not done.wait(0.1)
+    assert events.get(timeout=5) == 1
+    assert events.get(timeout=5) == 2
+    events.close()
+    assert done.wait(5)
+    assert events.dropped == 0
+    with pytest.raises(queue.Empty):
+        EventQueue(1).get(timeout=0.01)
+
+
+@pytest.mark.unit
+def test_slow_callback_does_not_stall_reading():
+    """Test that with a queue, the CLI is read at full speed while the callback lags behind."""
+    fake = FakeTransport()
+    fake.add_stream("stats", _events(200))
+    received = []
+
+    def slow(message):
+        time.sleep(0.01)
+        received.append(message)
+
+    handle = SpeedifyClient(transport=fake).stats_stream(1, slow, queue_size=5, overflow="drop_oldest")
+
+    assert handle.join(5)
+    assert handle.error is None
+    # Reading finished long before 200 slow callbacks could have
+    assert 0 < len(received) < 200
+    assert received[-1] == _events(200)[-1]
+    assert handle.dropped == 200 - len(received)
+    assert handle.coalesced == 0
+
+
+@pytest.mark.unit
+def test_queued_stream_coalesces():
+    """Test that a stream queue with COALESCE hands the callback the latest event of each type."""
+    fake = FakeTransport()
+    fake.add_stream("stats", _events(50) + _events(50, "adapters"))
+    received = []
+    release = threading.Event()
+
+    def callback(message):
+        release.wait(5)
+        received.append(message)
+
+    handle = SpeedifyClient(transport=fake).stats_stream(1, callback, queue_size=10, overflow="coalesce")
+    time.sleep(0.2)
+    release.set()
+
+    assert handle.join(5)
+    assert received[-2:] == [_events(50)[-1], _events(50, "adapters")[-1]]
+    assert handle.coalesced + len(received) == 100
+
+
+@pytest.mark.unit
+def test_queued_callback_errors_end_the_stream():
+    """Test that an error raised by a queued callback is kept and stops the CLI."""
+    fake = FakeTransport()
+    fake.add_stream("stats", _events(1000), interval=0.005)
+
+    def callback(message):
+        raise RuntimeError("database down")
+
+    handle = SpeedifyClient(transport=fake).stats_stream(0, callback, queue_size=10)
+
+    assert handle.join(5)
+    assert isinstance(handle.error, RuntimeError)
+
+
+@pytest.mark.unit
+def test_stop_from_queued_callback():
+    """Test that a queued callback can stop its own stream."""
+    fake = FakeTransport()
+    fake.add_stream("stats", _events(1000), interval=0.005)
+    received = []
+
+    def callback(message):
+        received.append(message)
+        handle.stop()
+
+    handle = SpeedifyClient(transport=fake).stats_stream(0, callback, queue_size=10, overflow="block")
+
+    assert handle.join(5)
+    assert handle.stopped
+    assert received == _events(1)
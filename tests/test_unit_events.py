@@ -0,0 +1,166 @@
+"""
+Unit tests for speedify.events.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_events.py -m unit
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+import speedify
+from speedify import FakeTransport, SpeedifyClient, StatsHub
+from speedify.events import (
+    AdaptersEvent,
+    ConnectionStatsEvent,
+    CurrentServerEvent,
+    SessionStatsEvent,
+    StateEvent,
+    StatsEvent,
+    from_message,
+)
+
+ADAPTERS = [
+    {"adapterID": "wlan0", "type": "Wi-Fi", "state": "connected", "connectedNetworkName": "home"},
+    {"adapterID": "wwan0", "type": "Cellular", "state": "connecting"},
+]
+CONNECTIONS = {
+    "connections": [
+        {
+            "adapterID": "wlan0",
+            "connectionID": "wlan0%10.0.0.0/24",
+            "connected": True,
+            "receiveBps": 1500.5,
+            "latencyMs": 30,
+        },
+    ]
+}
+STATS = [
+    ["state", {"state": "CONNECTED"}],
+    ["adapters", ADAPTERS],
+    ["connection_stats", CONNECTIONS],
+    ["session_stats", {"current": {"totalBytes": 10}}],
+    ["current_server", {"tag": "us-atlanta-3", "country": "us", "city": "atlanta", "friendlyName": "Atlanta #3"}],
+    ["streaming_stats", {"streams": []}],
+]
+
+
+@pytest.mark.unit
+def test_from_message():
+    """Test the class and fields of each event type."""
+    state, adapters, connections, session, server, other = [from_message(message) for message in STATS]
+
+    assert isinstance(state, StateEvent) and state.state == "CONNECTED"
+    assert isinstance(adapters, AdaptersEvent)
+    assert [a.adapter_id for a in adapters.adapters] == ["wlan0", "wwan0"]
+    assert adapters.by_id()["wlan0"].network_name == "home"
+    assert adapters.by_id()["wwan0"].network_name is None
+    assert isinstance(connections, ConnectionStatsEvent)
+    connection = connections.connections[0]
+    assert connection.connection_id == "wlan0%10.0.0.0/24"
+    assert (connection.adapter_id, connection.receive_bps, connection.latency_ms) == ("wlan0", 1500.5, 30)
+    assert connection.loss_send is None
+    assert isinstance(session, SessionStatsEvent) and session.period("current") == {"totalBytes": 10}
+    assert session.period("day") is None
+    assert isinstance(server, CurrentServerEvent)
+    assert (server.tag, server.friendly_name) == ("us-atlanta-3", "Atlanta #3")
+    assert type(other) is StatsEvent and other.type == "streaming_stats"
+
+
+@pytest.mark.unit
+def test_events_behave_like_lists():
+    """Test that events index, unpack and compare like the lists they replace."""
+    event = from_message(STATS[0])
+    event_type, data = event
+
+    assert (event_type, data) == ("state", {"state": "CONNECTED"})
+    assert event[0] == "state" and event[1] == data and event[-1] == data
+    assert event == STATS[0]
+    assert event != ["state", {}]
+    assert not hasattr(event, "__dict__")
+
+
+@pytest.mark.unit
+def test_iter_stats_typed_parses_lazily():
+    """Test that typed events are parsed on first access, with a receive timestamp."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [STATS[0], b'["connection_stats", {"connections": ['])
+    before = time.monotonic()
+
+    state, broken = SpeedifyClient(transport=fake).iter_stats(1, typed=True)
+
+    assert isinstance(broken, ConnectionStatsEvent)
+    assert not state.parsed and not broken.parsed
+    assert broken[0] == "connection_stats" and not broken.parsed
+    assert before <= state.received <= broken.received <= time.monotonic()
+    assert state.state == "CONNECTED" and state.parsed
+    with pytest.raises(ValueError):
+        broken.connections
+
+
+@pytest.mark.unit
+def test_ids_and_types_are_interned():
+    """Test that events share their type names and IDs."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [json.dumps(STATS[1]).encode() for _ in range(2)])
+
+    first, second = SpeedifyClient(transport=fake).iter_stats(1, typed=True)
+
+    assert first.type is second.type
+    assert first.adapters[0].adapter_id is second.adapters[0].adapter_id
+    assert first.adapters[1].state is second.adapters[1].state
+    # Interned in the parsed data itself, not copied on each read
+    assert first.data[0]["adapterID"] is second.data[0]["adapterID"]
+
+
+@pytest.mark.unit
+def test_data_is_interned_when_parsed():
+    """Test that IDs and state names are interned in place once, as each event is parsed."""
+    lines = [json.dumps(message).encode() for message in (STATS[0], STATS[2], STATS[4])] * 2
+    fake = FakeTransport()
+    fake.add_stream("stats", lines)
+
+    events = list(SpeedifyClient(transport=fake).iter_stats(1, typed=True))
+
+    for first, second in zip(events[:3], events[3:]):
+        assert first is not second
+    assert events[0].data["state"] is events[3].data["state"]
+    first, second = events[1].data["connections"][0], events[4].data["connections"][0]
+    assert first["connectionID"] is second["connectionID"]
+    assert first["adapterID"] is second["adapterID"]
+    assert events[2].data["tag"] is events[5].data["tag"]
+    assert events[2].data["friendlyName"] == events[5].data["friendlyName"]
+
+
+@pytest.mark.unit
+def test_astats_typed():
+    """Test typed events from the asyncio stream."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS)
+
+    async def main():
+        return [event async for event in speedify.astats(1, types=["state", "adapters"], typed=True)]
+
+    with SpeedifyClient(transport=fake).activate():
+        events = asyncio.run(main())
+
+    assert [type(event) for event in events] == [StateEvent, AdaptersEvent]
+
+
+@pytest.mark.unit
+def test_hub_typed_filters_without_parsing():
+    """Test that a typed hub hands events to subscribers without parsing them."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.002)
+    hub = StatsHub(client=SpeedifyClient(transport=fake), typed=True)
+
+    with hub.subscribe(types=["state"]) as states, hub.subscribe() as everything:
+        event = states.get(timeout=5)
+        other = everything.get(timeout=5)
+
+    assert isinstance(event, StateEvent) and not event.parsed
+    assert isinstance(other, StatsEvent)
+    assert event.state == "CONNECTED"
@@ -0,0 +1,136 @@
+"""
+Unit tests for speedify.hooks.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_hooks.py -m unit
+"""
+import asyncio
+
+import pytest
+
+from speedify import aio, hooks
+from speedify import FakeTransport, SpeedifyAPIError, SpeedifyClient, State
+
+
+API_ERROR = {"errorCode": 3841, "errorType": "Timeout waiting for result", "errorMessage": "Timeout"}
+
+
+@pytest.fixture
+def calls():
+    """Records every CommandCall seen by an after hook."""
+    seen = []
+    hook = hooks.add_hook(after=seen.append)
+    yield seen
+    hooks.remove_hook(hook)
+
+
+@pytest.fixture
+def client():
+    fake = FakeTransport()
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("show adapters", [{"adapterID": "eth0"}])
+    fake.add("connect", returncode=1, stderr=API_ERROR)
+    fake.add_stream("stats", [["state", {"state": "CONNECTED"}]])
+    return SpeedifyClient(transport=fake)
+
+
+@pytest.mark.unit
+def test_hooks_see_each_command(client, calls):
+    """Test that hooks receive the arguments, timing, exit code and output size."""
+    started = []
+    hook = hooks.add_hook(before=lambda call: started.append(call.end))
+    try:
+        assert client.show_state() == State.CONNECTED
+    finally:
+        hooks.remove_hook(hook)
+
+    assert started == [None]
+    [call] = calls
+    assert call.args == ["state"]
+    assert call.command == "state"
+    assert call.operation.name == "show_state"
+    assert call.start <= call.end
+    assert call.returncode == 0
+    assert call.stdout_bytes == len(b'{"state": "CONNECTED"}\n')
+    assert call.error is None
+
+
+@pytest.mark.unit
+def test_hooks_see_errors(client, calls):
+    """Test that failed commands report their error, and the error its operation."""
+    with pytest.raises(SpeedifyAPIError) as exc_info:
+        client.connect_closest()
+
+    [call] = calls
+    assert call.error is exc_info.value
+    assert call.returncode == 1
+    assert exc_info.value.operation is call.operation
+    # connect_closest() runs through connect(), the decorated function
+    assert call.operation.name == "connect"
+
+
+@pytest.mark.unit
+def test_operations_group_commands(client, calls):
+    """Test that an application operation and its context are shared by its commands."""
+    def before(call):
+        call.context["span"] = call.operation.context["trace"] + "/" + call.command
+
+    hook = hooks.add_hook(before=before)
+    try:
+        with hooks.operation("refresh", trace="t1") as operation:
+            client.show_state()
+            client.show_adapters()
+    finally:
+        hooks.remove_hook(hook)
+
+    assert [call.operation for call in calls] == [operation, operation]
+    assert operation.name == "refresh"
+    assert [call.context["span"] for call in calls] == ["t1/state", "t1/show adapters"]
+    assert hooks.current_operation() is None
+
+
+@pytest.mark.unit
+def test_failing_hooks_dont_break_commands(client, calls):
+    """Test that an exception in a hook is logged, not raised."""
+    hook = hooks.add_hook(before=lambda call: 1 / 0, after=lambda call: 1 / 0)
+    try:
+        assert client.show_state() == State.CONNECTED
+    finally:
+        hooks.remove_hook(hook)
+    assert len(calls) == 1
+
+
+@pytest.mark.unit
+def test_removed_hooks_are_not_called(client):
+    """Test that remove_hook() stops the calls."""
+    seen = []
+    hook = hooks.add_hook(after=seen.append)
+    client.show_state()
+    hooks.remove_hook(hook)
+    client.show_state()
+
+    assert len(seen) == 1
+    assert hooks._registered == ()
+
+
+@pytest.mark.unit
+def test_hooks_see_streams(client, calls):
+    """Test that streams run through _run_long_command() are reported."""
+    client.stats(1)
+
+    [call] = calls
+    assert call.args == ["stats", "1"]
+    assert call.returncode == 0
+    assert call.stdout_bytes > 0
+
+
+@pytest.mark.unit
+def test_hooks_see_aio_commands(client, calls):
+    """Test that awaited commands are reported, with their operation."""
+    with client.activate():
+        assert asyncio.run(aio.show_state()) == State.CONNECTED
+
+    [call] = calls
+    assert call.operation.name == "show_state"
+    assert call.returncode == 0
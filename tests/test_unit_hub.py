@@ -0,0 +1,147 @@
+"""
+Unit tests for speedify.hub.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_hub.py -m unit
+"""
+import queue
+import time
+
+import pytest
+
+from speedify import FakeTransport, MetricsRegistry, SpeedifyClient, StatsHub
+from speedify.events import GapEvent, StateEvent
+from speedify.retry import RestartPolicy
+
+STATS = [["state", {"state": "CONNECTED"}], ["adapters", []], ["connection_stats", {"connections": []}]]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.unit
+def test_subscribers_share_one_stream():
+    """Test that every subscriber receives the same parsed events from one CLI process."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.005)
+    hub = StatsHub(client=SpeedifyClient(transport=fake))
+    assert fake.calls == []
+
+    with hub.subscribe() as first, hub.subscribe() as second:
+        a = [first.get(timeout=5) for _ in range(20)]
+        b = [second.get(timeout=5) for _ in range(3)]
+        assert hub.subscribers == 2
+
+    assert a[:3] == STATS
+    # The second subscriber may have joined a few events in, and gets the same objects
+    offset = next(i for i, event in enumerate(a) if event is b[0])
+    assert all(x is y for x, y in zip(a[offset:], b))
+    assert fake.calls == [["stats", "0"]]
+
+
+@pytest.mark.unit
+def test_stream_stops_after_last_subscriber_and_restarts():
+    """Test lazy start, stop when the last subscriber leaves, and restart on the next."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.005)
+    hub = StatsHub(client=SpeedifyClient(transport=fake))
+
+    first = hub.subscribe()
+    second = hub.subscribe()
+    first.get(timeout=5)
+    first.close()
+    assert hub.running
+    second.close()
+    assert not hub.running
+    assert second.closed
+
+    with hub.subscribe() as third:
+        third.get(timeout=5)
+    assert len(fake.calls) == 2
+
+
+@pytest.mark.unit
+def test_subscribers_get_their_types():
+    """Test per-subscriber event types, and that types nobody wants are skipped unparsed."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.002)
+    metrics = MetricsRegistry()
+    hub = StatsHub(client=SpeedifyClient(transport=fake, metrics=metrics))
+
+    with hub.subscribe(types=["state"]) as states, hub.subscribe(types=["adapters"]) as adapters:
+        assert [states.get(timeout=5)[0] for _ in range(3)] == ["state"] * 3
+        assert [adapters.get(timeout=5)[0] for _ in range(3)] == ["adapters"] * 3
+        with hub.subscribe() as everything:
+            assert {everything.get(timeout=5)[0] for _ in range(6)} == {"state", "adapters", "connection_stats"}
+
+    snapshot = metrics.snapshot()["stats"]
+    assert 0 < snapshot["skipped_events"] < snapshot["events"]
+
+
+@pytest.mark.unit
+def test_restarted_hub_reprimes_subscribers():
+    """Test that a hub with a restart policy keeps its subscriptions across a CLI crash."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [STATS[1]], returncode=1)
+    fake.add_stream("stats", STATS * 1000, interval=0.005)
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("show adapters", [])
+    hub = StatsHub(client=SpeedifyClient(transport=fake), typed=True, restart=RestartPolicy(backoff=0.01))
+
+    with hub.subscribe(types=["state"]) as states:
+        gap = states.get(timeout=5)
+        snapshot = states.get(timeout=5)
+        assert hub.running
+
+    assert isinstance(gap, GapEvent) and gap.restarts == 1 and gap.seconds > 0
+    assert isinstance(snapshot, StateEvent) and snapshot.state == "CONNECTED"
+
+
+@pytest.mark.unit
+def test_slow_subscriber_drops_its_oldest_events():
+    """Test that a full queue drops the oldest events and counts them."""
+    events = [["state", {"n": n}] for n in range(10)]
+    fake = FakeTransport()
+    fake.add_stream("stats", events)
+    hub = StatsHub(client=SpeedifyClient(transport=fake))
+
+    subscription = hub.subscribe(maxsize=3)
+    wait_until(lambda: subscription.closed)
+
+    assert list(subscription) == events[-3:]
+    assert subscription.dropped == 7
+    assert subscription.error is None
+    with pytest.raises(EOFError):
+        subscription.get(timeout=0)
+
+
+@pytest.mark.unit
+def test_subscriptions_end_with_stream_error(tmp_path):
+    """Test that a stream that can't start ends its subscriptions with the error."""
+    hub = StatsHub(client=SpeedifyClient(cli_path=str(tmp_path / "missing")))
+
+    subscription = hub.subscribe()
+    with pytest.raises(EOFError):
+        subscription.get(timeout=5)
+    assert isinstance(subscription.error, OSError)
+    assert not hub.running
+
+
+@pytest.mark.unit
+def test_get_timeout():
+    """Test that get() raises queue.Empty when no event arrives in time."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS, interval=10)
+    hub = StatsHub(client=SpeedifyClient(transport=fake))
+
+    with hub:
+        subscription = hub.subscribe()
+        assert subscription.get(timeout=5) == STATS[0]
+        with pytest.raises(queue.Empty):
+            subscription.get(timeout=0.05)
+    assert subscription.closed
@@ -0,0 +1,159 @@
+"""
+Unit tests for speedify.metrics.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_metrics.py -m unit
+"""
+import asyncio
+import math
+
+import pytest
+
+from speedify import aio
+from speedify import FakeTransport, MetricsRegistry, ReadCache, SpeedifyClient, SpeedifyError
+from speedify.metrics import INVALID_OUTPUT, SPAWN_FAILED, TIMEOUT
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry(buckets=(0.1, 1.0))
+
+
+@pytest.mark.unit
+def test_registry_snapshot(registry):
+    """Test counts, errors and cumulative latency buckets."""
+    registry.record("show adapters", 0.05, stdout_bytes=100, parse_seconds=0.001)
+    registry.record("show adapters", 0.5, error=1, stdout_bytes=20)
+    registry.record("show adapters", 5.0, error=TIMEOUT)
+
+    metrics = registry.snapshot()["show adapters"]
+    assert metrics["calls"] == 3
+    assert metrics["errors"] == {1: 1, TIMEOUT: 1}
+    assert metrics["latency"]["count"] == 3
+    assert metrics["latency"]["sum"] == pytest.approx(5.55)
+    assert metrics["latency"]["buckets"] == [(0.1, 1), (1.0, 2), (math.inf, 3)]
+    assert metrics["stdout_bytes"] == 120
+    assert metrics["parse_seconds"] == pytest.approx(0.001)
+
+    registry.reset()
+    assert registry.snapshot() == {}
+
+
+@pytest.mark.unit
+def test_registry_percentiles():
+    """Test rolling percentiles over the most recent latencies."""
+    registry = MetricsRegistry(window=10)
+    assert registry.percentile("state", 50) is None
+
+    for i in range(1, 21):
+        registry.record("state", i / 10)
+    registry.record("state", 99, error=SPAWN_FAILED)
+
+    # Only 1.1 .. 2.0 are left in the window
+    assert registry.percentile("state", 50) == 1.5
+    assert registry.percentile("state", 100) == 2.0
+    assert registry.percentile("state", 0) == 1.1
+    assert registry.percentile("state", 50, min_samples=11) is None
+
+
+@pytest.mark.unit
+def test_registry_prometheus(registry):
+    """Test the Prometheus text format, including label escaping."""
+    registry.record("show adapters", 0.05, stdout_bytes=100)
+    registry.record('odd "name"', 0.5, error=2)
+
+    text = registry.prometheus()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert "# TYPE speedify_cli_duration_seconds histogram" in lines
+    assert 'speedify_cli_calls_total{command="show adapters"} 1' in lines
+    assert 'speedify_cli_errors_total{command="odd \\"name\\"",exit_code="2"} 1' in lines
+    assert 'speedify_cli_duration_seconds_bucket{command="show adapters",le="0.1"} 1' in lines
+    assert 'speedify_cli_duration_seconds_bucket{command="odd \\"name\\"",le="0.1"} 0' in lines
+    assert 'speedify_cli_duration_seconds_bucket{command="odd \\"name\\"",le="+Inf"} 1' in lines
+    assert 'speedify_cli_duration_seconds_count{command="show adapters"} 1' in lines
+    assert 'speedify_cli_stdout_bytes_total{command="show adapters"} 100' in lines
+
+
+@pytest.mark.unit
+def test_registry_stream_events(registry):
+    """Test the events and skipped events counted by streams."""
+    assert registry.skip_rate("stats") is None
+    registry.record_events("stats", 10, 4)
+    registry.record_events("stats", 10, 1)
+
+    assert registry.snapshot()["stats"]["calls"] == 0
+    assert registry.snapshot()["stats"]["events"] == 20
+    assert registry.skip_rate("stats") == 0.25
+    lines = registry.prometheus().splitlines()
+    assert 'speedify_cli_stream_events_total{command="stats"} 20' in lines
+    assert 'speedify_cli_stream_skipped_events_total{command="stats"} 5' in lines
+
+
+@pytest.mark.unit
+def test_client_records_commands(registry):
+    """Test that a client records successes, exit codes and timeouts, and not cache hits."""
+    fake = FakeTransport()
+    fake.add("show adapters", [{"adapterID": "eth0"}])
+    fake.add("connect", returncode=1, stderr={"errorCode": 3841, "errorType": "Timeout", "errorMessage": "Timeout"})
+    fake.add("show servers", delay=1)
+    fake.add("state", "not json")
+    client = SpeedifyClient(transport=fake, metrics=registry, cache=ReadCache(default_ttl=60))
+
+    client.show_adapters()
+    client.show_adapters()  # cached
+    with pytest.raises(SpeedifyError):
+        client.connect_closest()
+    with pytest.raises(SpeedifyError):
+        client.run(["show", "servers"], cmdtimeout=0.01)
+    with pytest.raises(SpeedifyError):
+        client.run(["state"])
+
+    snapshot = registry.snapshot()
+    assert snapshot["show adapters"]["calls"] == 1
+    assert snapshot["show adapters"]["errors"] == {}
+    assert snapshot["show adapters"]["stdout_bytes"] > 0
+    assert snapshot["connect"]["errors"] == {1: 1}
+    assert snapshot["show servers"]["errors"] == {TIMEOUT: 1}
+    assert snapshot["state"]["errors"] == {INVALID_OUTPUT: 1}
+
+
+@pytest.mark.unit
+def test_client_records_spawn_failures(registry, tmp_path):
+    """Test that a CLI that can't be started is recorded."""
+    client = SpeedifyClient(cli_path=str(tmp_path / "missing"), metrics=registry)
+
+    with pytest.raises(OSError):
+        client.show_state()
+
+    assert registry.snapshot()["state"]["errors"] == {SPAWN_FAILED: 1}
+
+
+@pytest.mark.unit
+def test_client_records_streams(registry):
+    """Test that run_iter() and stats() are recorded."""
+    fake = FakeTransport()
+    fake.add_stream("speedtest", [{"percent": 50}, {"percent": 100}])
+    fake.add_stream("stats", [["state", {"state": "CONNECTED"}]])
+    client = SpeedifyClient(transport=fake, metrics=registry)
+
+    assert len(list(client.run_iter(["speedtest"]))) == 2
+    client.stats(1)
+
+    snapshot = registry.snapshot()
+    assert snapshot["speedtest"]["calls"] == 1
+    assert snapshot["speedtest"]["stdout_bytes"] > 0
+    assert snapshot["stats"]["calls"] == 1
+
+
+@pytest.mark.unit
+def test_aio_records_commands(registry):
+    """Test that aio commands are recorded in the client's registry."""
+    fake = FakeTransport()
+    fake.add("show adapters", [])
+
+    with SpeedifyClient(transport=fake, metrics=registry).activate():
+        asyncio.run(aio.show_adapters())
+
+    assert registry.snapshot()["show adapters"]["calls"] == 1
@@ -0,0 +1,161 @@
+"""
+Unit tests for speedify.prefork.PreforkSpawner.
+
+These tests do NOT require Speedify daemon to be running.  A small shell script
+stands in for speedify_cli.
+
+Run with: pytest tests/test_unit_prefork.py -m unit
+"""
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+from speedify import PreforkSpawner, SpeedifyClient, State, SpeedifyError, SpeedifyAPIError
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "posix_spawn") or not os.path.exists("/bin/sh"),
+    reason="PreforkSpawner needs os.posix_spawn and /bin/sh",
+)
+
+FAKE_CLI = """#!/bin/sh
+case "$2" in
+  state) echo '{"state": "CONNECTED"}';;
+  apierror) echo '{"errorCode": 3841, "errorType": "Timeout waiting for result", "errorMessage": "Timeout"}' >&2; exit 1;;
+  badparam) echo 'Invalid value for mode' >&2; exit 2;;
+  hang) sleep 10;;
+esac
+"""
+
+
+@pytest.fixture
+def fake_cli(tmp_path):
+    path = tmp_path / "speedify_cli"
+    path.write_text(FAKE_CLI)
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def spawner():
+    with PreforkSpawner(workers=2) as spawner:
+        yield spawner
+
+
+@pytest.mark.unit
+def test_prefork_run_returns_output(spawner, fake_cli):
+    """Test that run() returns the exit code and output of the command."""
+    returncode, stdout, stderr = spawner.run([fake_cli, "-s", "state"])
+
+    assert returncode == 0
+    assert stdout == b'{"state": "CONNECTED"}\n'
+    assert stderr == b""
+
+
+@pytest.mark.unit
+def test_prefork_client_parses_result(spawner, fake_cli):
+    """Test that a client using the spawner converts results like the default path."""
+    client = SpeedifyClient(cli_path=fake_cli, transport=spawner)
+
+    assert client.show_state() == State.CONNECTED
+
+
+@pytest.mark.unit
+def test_prefork_client_maps_exit_codes(spawner, fake_cli):
+    """Test that non-zero exit codes raise the same errors as the default path."""
+    client = SpeedifyClient(cli_path=fake_cli, transport=spawner)
+
+    with pytest.raises(SpeedifyAPIError) as exc_info:
+        client.run(["apierror"])
+    assert exc_info.value.error_code == 3841
+
+    with pytest.raises(SpeedifyError) as exc_info:
+        client.run(["badparam"])
+    assert exc_info.value.message == "Invalid value for mode"
+
+
+@pytest.mark.unit
+def test_prefork_timeout_kills_command(spawner, fake_cli):
+    """Test that a command running past its timeout is killed and the helper reused."""
+    client = SpeedifyClient(cli_path=fake_cli, transport=spawner)
+
+    start = time.monotonic()
+    with pytest.raises(SpeedifyError) as exc_info:
+        client.run(["hang"], cmdtimeout=0.2)
+    assert "timed out" in exc_info.value.message
+    assert time.monotonic() - start < 5
+
+    assert client.show_state() == State.CONNECTED
+
+
+@pytest.mark.unit
+def test_prefork_missing_executable(spawner, tmp_path):
+    """Test that a CLI that doesn't exist raises FileNotFoundError, like subprocess.run."""
+    with pytest.raises(FileNotFoundError):
+        spawner.run([str(tmp_path / "missing"), "-s", "state"])
+
+    returncode, _, _ = spawner.run(["/bin/sh", "-c", "exit 3"])
+    assert returncode == 3
+
+
+@pytest.mark.unit
+def test_prefork_replaces_dead_helper(spawner, fake_cli):
+    """Test that a helper process that dies is replaced."""
+    for helper in list(spawner._idle.queue):
+        helper.proc.kill()
+        helper.proc.wait()
+
+    for _ in range(spawner.workers + 1):
+        assert spawner.run([fake_cli, "-s", "state"])[0] == 0
+
+
+@pytest.mark.unit
+def test_prefork_closed_spawner_refuses_commands(fake_cli):
+    """Test that run() after close() raises SpeedifyError."""
+    spawner = PreforkSpawner(workers=1)
+    spawner.close()
+
+    with pytest.raises(SpeedifyError):
+        spawner.run([fake_cli, "-s", "state"])
+
+
+@pytest.mark.unit
+def test_prefork_close_wakes_waiting_callers(fake_cli):
+    """Test that a caller waiting for a helper gets SpeedifyError when the spawner is closed."""
+    spawner = PreforkSpawner(workers=1)
+    errors = []
+
+    def waiting():
+        try:
+            spawner.run([fake_cli, "-s", "state"])
+        except SpeedifyError as err:
+            errors.append(err)
+
+    with spawner.stream(["/bin/sh", "-c", "sleep 10"]):
+        caller = threading.Thread(target=waiting)
+        caller.start()
+        time.sleep(0.1)
+        spawner.close()
+        caller.join(5)
+
+        assert not caller.is_alive()
+        assert [str(err.message) for err in errors] == ["PreforkSpawner is closed"]
+
+
+@pytest.mark.unit
+def test_prefork_stream_lines_and_close(spawner):
+    """Test that streams yield lines as they arrive, and closing early frees the helper."""
+    with spawner.stream(["/bin/sh", "-c", "echo one; echo two; sleep 10"]) as stream:
+        lines = iter(stream)
+        assert next(lines) == b"one\n"
+        assert next(lines) == b"two\n"
+
+    assert stream.returncode == -9
+    for _ in range(spawner.workers):
+        assert spawner.run(["/bin/sh", "-c", "exit 0"])[0] == 0
+
+    with spawner.stream(["/bin/sh", "-c", "echo done"]) as stream:
+        assert list(stream) == [b"done\n"]
+    assert stream.returncode == 0
@@ -0,0 +1,204 @@
+"""
+Unit tests for speedify.retry.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_retry.py -m unit
+"""
+import asyncio
+import time
+
+import pytest
+
+from speedify import aio
+from speedify import (
+    FakeTransport,
+    MetricsRegistry,
+    RestartPolicy,
+    RetryPolicy,
+    SpeedifyAPIError,
+    SpeedifyClient,
+    SpeedifyError,
+    SpeedifyTimeoutError,
+    State,
+)
+
+
+API_TIMEOUT = {"errorCode": 3841, "errorType": "Timeout waiting for result", "errorMessage": "Timeout"}
+API_OTHER = {"errorCode": 3, "errorType": "Invalid", "errorMessage": "Invalid"}
+
+
+def quick_policy(**options):
+    options.setdefault("backoff", 0.001)
+    return RetryPolicy(**options)
+
+
+def client_for(fake, policy, metrics=None):
+    return SpeedifyClient(transport=fake, retry=policy, metrics=metrics or MetricsRegistry())
+
+
+@pytest.mark.unit
+def test_classification():
+    """Test which errors are worth retrying."""
+    policy = RetryPolicy()
+    timed_out = SpeedifyTimeoutError("Command timed out: state")
+    crashed = SpeedifyError("Unknown: ")
+    crashed.returncode = -11
+    bad_parameter = SpeedifyError("Invalid value for mode")
+    bad_parameter.returncode = 2
+    daemon_timeout = SpeedifyAPIError(3841, "Timeout waiting for result", "Timeout")
+
+    assert policy.is_retryable(["state"], daemon_timeout)
+    assert not policy.is_retryable(["connect", "closest"], daemon_timeout)
+    assert not policy.is_retryable(["state"], SpeedifyAPIError(3, "Invalid", "Invalid"))
+    assert policy.is_retryable(["state"], timed_out)
+    assert not policy.is_retryable(["connect", "closest"], timed_out)
+    assert policy.is_retryable(["connect", "closest"], crashed)
+    assert not policy.is_retryable(["mode", "fast"], bad_parameter)
+    assert not policy.is_retryable(["state"], SpeedifyError("Invalid JSON"))
+
+
+@pytest.mark.unit
+def test_backoff_grows_with_jitter():
+    """Test exponential backoff bounds."""
+    policy = RetryPolicy(backoff=0.1, max_backoff=0.3)
+    for _ in range(50):
+        assert 0 <= policy.backoff_delay(1) <= 0.1
+        assert 0 <= policy.backoff_delay(2) <= 0.2
+        assert 0 <= policy.backoff_delay(5) <= 0.3
+
+
+@pytest.mark.unit
+def test_restart_policy():
+    """Test restart backoff bounds and the restart limit."""
+    policy = RestartPolicy(backoff=0.1, max_backoff=0.3, max_restarts=3)
+    for _ in range(50):
+        assert 0 <= policy.backoff_delay(1) <= 0.1
+        assert 0 <= policy.backoff_delay(10) <= 0.3
+    assert not policy.gives_up(3)
+    assert policy.gives_up(4)
+    assert not RestartPolicy().gives_up(1000)
+
+
+@pytest.mark.unit
+def test_retries_transient_api_error():
+    """Test that errorCode 3841 is retried until the command succeeds."""
+    fake = FakeTransport()
+    fake.add("state", returncode=1, stderr=API_TIMEOUT)
+    fake.add("state", returncode=1, stderr=API_TIMEOUT)
+    fake.add("state", {"state": "CONNECTED"})
+    policy = quick_policy()
+
+    assert client_for(fake, policy).show_state() == State.CONNECTED
+    assert len(fake.calls) == 3
+    assert policy.retries == 2
+
+
+@pytest.mark.unit
+def test_gives_up_after_attempts_and_on_permanent_errors():
+    """Test that retries stop after the last attempt, and never start for permanent errors."""
+    fake = FakeTransport()
+    fake.add("state", returncode=1, stderr=API_TIMEOUT)
+    fake.add("mode", returncode=2, stderr="Invalid value for mode")
+    fake.add("disconnect", returncode=1, stderr=API_OTHER)
+    client = client_for(fake, quick_policy(attempts=2))
+
+    with pytest.raises(SpeedifyAPIError) as exc_info:
+        client.show_state()
+    assert exc_info.value.error_code == 3841
+    with pytest.raises(SpeedifyError):
+        client.mode("fast")
+    with pytest.raises(SpeedifyAPIError):
+        client.disconnect()
+
+    assert [call[0] for call in fake.calls] == ["state", "state", "mode", "disconnect"]
+
+
+@pytest.mark.unit
+def test_daemon_timeouts_only_retried_for_reads():
+    """Test that a command that may have changed state is not run again after errorCode 3841."""
+    fake = FakeTransport()
+    fake.add("connect", returncode=1, stderr=API_TIMEOUT)
+    policy = quick_policy()
+
+    with pytest.raises(SpeedifyAPIError):
+        client_for(fake, policy).connect_closest()
+    assert len(fake.calls) == 1
+    assert policy.retries == 0
+
+
+@pytest.mark.unit
+def test_timeouts_only_retried_for_reads():
+    """Test that a timed out command that may have changed state is not run again."""
+    fake = FakeTransport()
+    fake.add("show servers", delay=1)
+    fake.add("show servers", {"public": []})
+    fake.add("connect", delay=1)
+    client = client_for(fake, quick_policy())
+
+    assert client.run(["show", "servers"], cmdtimeout=0.05) == {"public": []}
+    with pytest.raises(SpeedifyTimeoutError):
+        client.run(["connect", "closest"], cmdtimeout=0.05)
+    assert len(fake.calls) == 3
+
+
+@pytest.mark.unit
+def test_deadline_bounds_all_attempts():
+    """Test that attempts are cut short by the overall deadline."""
+    fake = FakeTransport()
+    fake.add("state", delay=5)
+    client = client_for(fake, quick_policy(attempts=10, deadline=0.3))
+
+    start = time.monotonic()
+    with pytest.raises(SpeedifyTimeoutError):
+        client.show_state()
+    assert time.monotonic() - start < 2
+
+
+def slow_then_fast(metrics):
+    """A fake whose first show adapters is slow, after 20 fast ones were recorded."""
+    for _ in range(20):
+        metrics.record("show adapters", 0.01)
+    fake = FakeTransport()
+    fake.add("show adapters", [{"adapterID": "slow"}], delay=2)
+    fake.add("show adapters", [{"adapterID": "fast"}])
+    return fake
+
+
+@pytest.mark.unit
+def test_hedges_slow_reads():
+    """Test that a read slower than its p95 is duplicated and the first answer wins."""
+    metrics = MetricsRegistry()
+    fake = slow_then_fast(metrics)
+    policy = RetryPolicy(hedge=True)
+    client = client_for(fake, policy, metrics)
+
+    start = time.monotonic()
+    assert client.show_adapters() == [{"adapterID": "fast"}]
+    assert time.monotonic() - start < 1.5
+    assert policy.hedges == 1
+    assert policy.hedge_wins == 1
+
+
+@pytest.mark.unit
+def test_hedges_slow_reads_in_aio():
+    """Test hedging of awaited reads."""
+    metrics = MetricsRegistry()
+    fake = slow_then_fast(metrics)
+    policy = RetryPolicy(hedge=True)
+
+    with client_for(fake, policy, metrics).activate():
+        assert asyncio.run(aio.show_adapters()) == [{"adapterID": "fast"}]
+    assert policy.hedge_wins == 1
+
+
+@pytest.mark.unit
+def test_aio_retries_transient_api_error():
+    """Test that aio commands are retried like synchronous ones."""
+    fake = FakeTransport()
+    fake.add("state", returncode=1, stderr=API_TIMEOUT)
+    fake.add("state", {"state": "CONNECTED"})
+
+    with client_for(fake, quick_policy()).activate():
+        assert asyncio.run(aio.show_state()) == State.CONNECTED
+    assert len(fake.calls) == 2
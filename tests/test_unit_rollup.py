@@ -0,0 +1,127 @@
+"""
+Unit tests for speedify.rollup.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_rollup.py -m unit
+"""
+import pytest
+
+from speedify.events import from_message
+from speedify.rollup import StatsRollup
+
+
+def _connections(*connections):
+    return [
+        "connection_stats",
+        {
+            "connections": [
+                {"adapterID": adapter_id, "receiveBps": receive_bps, "latencyMs": latency_ms}
+                for adapter_id, receive_bps, latency_ms in connections
+            ]
+        },
+    ]
+
+
+@pytest.mark.unit
+class TestStatsRollup:
+    """Test rolling up connection_stats events."""
+
+    def test_buckets_at_each_resolution(self):
+        rollup = StatsRollup()
+        for second, receive_bps in enumerate([10, 30, 20]):
+            rollup.add(_connections(("wlan0", receive_bps, 5)), timestamp=6000.0 + second)
+
+        seconds = rollup.query("wlan0", "receiveBps", start=6000, end=6002, resolution=1)
+        assert [(bucket.start, bucket.count, bucket.sum) for bucket in seconds] == [
+            (6000, 1, 10),
+            (6001, 1, 30),
+            (6002, 1, 20),
+        ]
+        (minute,) = rollup.query("wlan0", "receiveBps", start=6000, end=6002, resolution=60)
+        assert (minute.start, minute.seconds, minute.count) == (6000, 60, 3)
+        assert (minute.min, minute.max, minute.sum, minute.mean) == (10, 30, 60, 20)
+        (hour,) = rollup.query("wlan0", "receiveBps", start=6000, end=6002, resolution=3600)
+        assert hour.as_dict() == {
+            "start": 3600, "seconds": 3600, "count": 3, "sum": 60, "min": 10, "max": 30, "mean": 20
+        }
+
+    def test_combines_connections_per_adapter(self):
+        rollup = StatsRollup()
+        rollup.add(_connections(("wlan0", 100, 10), ("wlan0", 50, 30), ("eth0", 7, 1)), timestamp=100.0)
+
+        (receive,) = rollup.query("wlan0", "receiveBps", start=100, end=100, resolution=1)
+        (latency,) = rollup.query("wlan0", "latencyMs", start=100, end=100, resolution=1)
+        assert receive.sum == 150
+        assert latency.sum == 20
+        assert sorted(rollup.adapters()) == ["eth0", "wlan0"]
+
+    def test_missing_values_are_not_counted(self):
+        rollup = StatsRollup()
+        rollup.add(_connections(("wlan0", None, 5)), timestamp=100.0)
+
+        assert rollup.query("wlan0", "receiveBps", start=0, end=200, resolution=1) == []
+        assert rollup.query("wlan0", "latencyMs", start=0, end=200, resolution=1)[0].count == 1
+
+    def test_old_buckets_age_out(self):
+        rollup = StatsRollup(resolutions=[(1, 3), (10, 10)])
+        for second in range(6):
+            rollup.add(_connections(("wlan0", second, 1)), timestamp=float(second))
+
+        latest = rollup.query("wlan0", "receiveBps", start=0, end=5, resolution=1)
+        assert [bucket.start for bucket in latest] == [3, 4, 5]
+        (coarse,) = rollup.query("wlan0", "receiveBps", start=0, end=5, resolution=10)
+        assert coarse.count == 6
+        # Late samples older than the slot's bucket are dropped
+        rollup.add(_connections(("wlan0", 99, 1)), timestamp=2.0)
+        assert rollup.query("wlan0", "receiveBps", start=0, end=5, resolution=1)[0].max == 3
+
+    def test_default_resolution_covers_the_range(self):
+        rollup = StatsRollup()
+        rollup.add(_connections(("wlan0", 1, 1)), timestamp=100000.0)
+
+        assert rollup.query("wlan0", "receiveBps", start=99990, end=100000)[0].seconds == 1
+        assert rollup.query("wlan0", "receiveBps", start=90000, end=100000)[0].seconds == 60
+        assert rollup.query("wlan0", "receiveBps", start=0, end=100000)[0].seconds == 3600
+        assert rollup.query("wlan0", "receiveBps", end=100000)[0].seconds == 1
+        assert rollup.retention(60) == 24 * 3600
+
+    def test_default_resolution_of_a_past_range(self):
+        rollup = StatsRollup()
+        for second in range(2 * 3600):
+            rollup.add(_connections(("wlan0", 1, 1)), timestamp=float(second))
+
+        # The 1-second buckets of an hour ago were overwritten, the minutes are still held
+        buckets = rollup.query("wlan0", "receiveBps", start=3600, end=4200)
+        assert [bucket.start for bucket in buckets] == list(range(3600, 4201, 60))
+        assert rollup.query("wlan0", "receiveBps", start=7000, end=7199)[0].seconds == 1
+
+    def test_memory_is_constant(self):
+        rollup = StatsRollup()
+        rollup.add(_connections(("wlan0", 1, 1)), timestamp=0.0)
+        nbytes = rollup.nbytes
+        for second in range(1, 2000, 7):
+            rollup.add(_connections(("wlan0", second, 1)), timestamp=float(second))
+        assert rollup.nbytes == nbytes
+
+    def test_typed_events_and_other_types(self):
+        rollup = StatsRollup()
+        rollup(["state", {"state": "CONNECTED"}])
+        rollup(from_message(_connections(("wlan0", 5, 1))))
+
+        assert rollup.adapters() == ["wlan0"]
+        assert rollup.query("wlan0", "receiveBps")[0].sum == 5
+        assert rollup.query("usb0", "receiveBps") == []
+
+    def test_bad_arguments(self):
+        with pytest.raises(ValueError):
+            StatsRollup(resolutions=[])
+        with pytest.raises(ValueError):
+            StatsRollup(resolutions=[(0, 10)])
+        with pytest.raises(ValueError):
+            StatsRollup(resolutions=[(60, 10), (60, 20)])
+        rollup = StatsRollup()
+        with pytest.raises(ValueError):
+            rollup.query("wlan0", "bogus")
+        with pytest.raises(ValueError):
+            rollup.query("wlan0", "receiveBps", resolution=5)
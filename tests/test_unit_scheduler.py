@@ -0,0 +1,179 @@
+"""
+Unit tests for speedify.scheduler.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_scheduler.py -m unit
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from speedify import FakeTransport, Lane, SpawnScheduler, SpeedifyClient
+from speedify.scheduler import lane_for, use_lane
+
+
+def start_waiting(scheduler, args, order):
+    """Starts a thread that acquires a slot, notes the command, and releases it."""
+    def run():
+        with scheduler.slot(args):
+            order.append(args[0])
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(scheduler, count):
+    deadline = time.monotonic() + 5
+    while sum(scheduler.waiting().values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.unit
+def test_lanes():
+    """Test that mutating commands are interactive, reads background, unless overridden."""
+    assert lane_for(["connect", "closest"]) == Lane.INTERACTIVE
+    assert lane_for(["show", "adapters"]) == Lane.BACKGROUND
+    with use_lane(Lane.INTERACTIVE):
+        assert lane_for(["state"]) == Lane.INTERACTIVE
+    assert lane_for(["state"]) == Lane.BACKGROUND
+
+
+@pytest.mark.unit
+def test_unlimited_scheduler_never_waits():
+    """Test that the default scheduler lets every command start."""
+    scheduler = SpawnScheduler()
+    for _ in range(100):
+        scheduler.acquire(["state"])
+    assert scheduler.running == 100
+    assert scheduler.waiting() == {Lane.INTERACTIVE: 0, Lane.BACKGROUND: 0}
+
+
+@pytest.mark.unit
+def test_max_concurrent():
+    """Test that no more than max_concurrent commands hold a slot at once."""
+    scheduler = SpawnScheduler(max_concurrent=2)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def run():
+        with scheduler.slot(["state"]):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert scheduler.running == 0
+
+
+@pytest.mark.unit
+def test_interactive_commands_jump_the_queue():
+    """Test that queued interactive commands start before queued reads."""
+    scheduler = SpawnScheduler(max_concurrent=1)
+    order = []
+    scheduler.acquire(["connect"])
+
+    threads = [start_waiting(scheduler, ["state"], order)]
+    wait_for_queue(scheduler, 1)
+    threads.append(start_waiting(scheduler, ["version"], order))
+    wait_for_queue(scheduler, 2)
+    threads.append(start_waiting(scheduler, ["disconnect"], order))
+    wait_for_queue(scheduler, 3)
+    assert scheduler.waiting() == {Lane.INTERACTIVE: 1, Lane.BACKGROUND: 2}
+
+    scheduler.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["disconnect", "state", "version"]
+
+
+@pytest.mark.unit
+def test_spawn_rate():
+    """Test that the token bucket spaces out starts after the burst."""
+    scheduler = SpawnScheduler(rate=50, burst=2)
+
+    start = time.monotonic()
+    for _ in range(7):
+        scheduler.acquire(["stats"], hold=False)
+    elapsed = time.monotonic() - start
+
+    # 2 right away, then 5 at 50 per second
+    assert 0.08 <= elapsed < 2
+    assert scheduler.running == 0
+
+
+@pytest.mark.unit
+def test_streams_are_not_limited_by_max_concurrent():
+    """Test that commands not holding a slot start while every slot is taken, even with others queued."""
+    scheduler = SpawnScheduler(max_concurrent=1)
+    scheduler.acquire(["state"])
+    order = []
+    queued = start_waiting(scheduler, ["version"], order)
+    wait_for_queue(scheduler, 1)
+
+    stream = threading.Thread(target=scheduler.acquire, args=(["stats"],), kwargs={"hold": False}, daemon=True)
+    stream.start()
+    stream.join(1)
+
+    assert not stream.is_alive()
+    assert scheduler.running == 1
+    assert order == []
+    scheduler.release()
+    queued.join()
+    assert order == ["version"]
+
+
+@pytest.mark.unit
+def test_cancelled_async_waiter_gives_up_its_place():
+    """Test that cancelling a waiting task doesn't leak a slot."""
+    scheduler = SpawnScheduler(max_concurrent=1)
+
+    async def main():
+        await scheduler.acquire_async(["state"])
+        waiting = asyncio.ensure_future(scheduler.acquire_async(["state"]))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        scheduler.release()
+        await asyncio.wait_for(scheduler.acquire_async(["state"]), 1)
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.running == 0
+
+
+@pytest.mark.unit
+def test_client_commands_go_through_scheduler():
+    """Test that a client's commands respect its scheduler."""
+    scheduler = SpawnScheduler(max_concurrent=1)
+    fake = FakeTransport()
+    fake.add("connect", {"state": "CONNECTED"})
+    fake.add_stream("speedtest", [{"percent": 100}])
+    client = SpeedifyClient(transport=fake, scheduler=scheduler)
+
+    scheduler.acquire(["show", "adapters"])
+    thread = threading.Thread(target=client.connect_closest)
+    thread.start()
+    wait_for_queue(scheduler, 1)
+    assert fake.calls == []
+
+    scheduler.release()
+    thread.join()
+    assert fake.calls == [["connect", "closest"]]
+    assert list(client.run_iter(["speedtest"])) == [{"percent": 100}]
+    assert scheduler.running == 0
@@ -7,7 +7,10 @@ They test the library logic by mocking CLI interactions.
 Run with: pytest tests/test_unit_speedify.py -m unit
 """
 import json
+import os
 import subprocess
+import threading
+import time
 from unittest.mock import Mock, patch, MagicMock
 
 import pytest
@@ -196,6 +199,36 @@ def test_run_speedify_cmd_timeout():
             assert call_kwargs['timeout'] == 120
 
 
+@pytest.mark.unit
+@pytest.mark.parametrize("stdout, expected", [
+    (b'{"a": 1}', b'{"a": 1}'),
+    (b'{"a": 1}\n{"b": 2}\r\n  \n\n', b'{"b": 2}'),
+    (b'\n  {"only": true}', b'{"only": true}'),
+    (b'', None),
+    (b' \n\n\t\n', None),
+])
+def test_last_line_scans_back_from_end(stdout, expected):
+    """Test that the last non-blank line is found without splitting the whole output."""
+    assert speedify._last_line(stdout) == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("decoder", ["orjson", "json"])
+def test_parse_cmd_output_with_and_without_orjson(decoder):
+    """Test that results are identical whether or not orjson is used."""
+    stdout = '{"progress": 1}\n{"name": "caf\u00e9", "n": [1, 2.5, null, true]}\n'.encode("utf-8")
+    orjson = speedify.orjson if decoder == "orjson" else None
+    if decoder == "orjson" and orjson is None:
+        pytest.skip("orjson not installed")
+
+    with patch('speedify.orjson', orjson):
+        assert speedify._parse_cmd_output(['test'], stdout) == {"name": "caf\u00e9", "n": [1, 2.5, None, True]}
+        with pytest.raises(SpeedifyError):
+            speedify._parse_cmd_output(['test'], b'{"truncated": ')
+        with pytest.raises(SpeedifyError):
+            speedify._parse_cmd_output(['test'], b'{"bad": "\xff"}')
+
+
 # ============================================================================
 # Utility Function Tests
 # ============================================================================
@@ -408,3 +441,533 @@ def test_list_servers_speedify_exclude_test():
         assert "us-nyc-1" in result
         assert "uk-lon-1" in result
         assert "us-test-server" not in result
+
+
+# ============================================================================
+# SpeedifyClient Tests
+# ============================================================================
+
+def _completed(stdout):
+    mock_result = Mock()
+    mock_result.returncode = 0
+    mock_result.stdout = stdout
+    mock_result.stderr = b''
+    return mock_result
+
+
+@pytest.mark.unit
+def test_client_methods_use_client_cli_path():
+    """Test that wrappers called on a client use that client's CLI path."""
+    client = speedify.SpeedifyClient(cli_path='/client/cli')
+
+    with patch('subprocess.run', return_value=_completed(b'{"state": "CONNECTED"}')) as mock_run:
+        with patch('speedify.get_cli', return_value='/module/cli'):
+            assert client.show_state() == State.CONNECTED
+            assert mock_run.call_args[0][0] == ['/client/cli', '-s', 'state']
+
+            speedify.show_state()
+            assert mock_run.call_args[0][0] == ['/module/cli', '-s', 'state']
+
+
+@pytest.mark.unit
+def test_client_per_command_timeouts():
+    """Test default, per-command and built-in long timeouts."""
+    client = speedify.SpeedifyClient(cli_path='/cli', default_timeout=5, timeouts={"show adapters": 2})
+
+    with patch('subprocess.run', return_value=_completed(b'[]')) as mock_run:
+        client.show_adapters()
+        assert mock_run.call_args[1]['timeout'] == 2
+
+        client.show_settings()
+        assert mock_run.call_args[1]['timeout'] == 5
+
+        client.speedtest()
+        assert mock_run.call_args[1]['timeout'] == 600
+
+        client.set_timeout("show settings", 1)
+        client.show_settings()
+        assert mock_run.call_args[1]['timeout'] == 1
+
+
+@pytest.mark.unit
+def test_client_adaptive_timeouts():
+    """Test that timeouts follow recent latencies, within bounds, after enough samples."""
+    registry = speedify.MetricsRegistry()
+    adaptive = speedify.AdaptiveTimeouts(percentile=95, multiplier=3, floor=1, ceiling=20, min_samples=5)
+    client = speedify.SpeedifyClient(
+        cli_path='/cli', default_timeout=60, metrics=registry, adaptive_timeouts=adaptive
+    )
+
+    for _ in range(4):
+        registry.record("state", 0.5)
+    assert client.timeout_for(["state"]) == 60
+
+    registry.record("state", 0.5)
+    assert client.timeout_for(["state"]) == 1.5
+    assert client.timeout_for(["state"], cmdtimeout=7) == 7
+    assert client.timeout_for(["speedtest"]) == 600
+
+    for _ in range(5):
+        registry.record("show adapters", 0.01)
+        registry.record("show servers", 30)
+    assert client.timeout_for(["show", "adapters"]) == 1
+    assert client.timeout_for(["show", "servers"]) == 20
+
+    with patch('subprocess.run', return_value=_completed(b'{"state": "CONNECTED"}')) as mock_run:
+        client.show_state()
+    assert mock_run.call_args[1]['timeout'] == 1.5
+
+
+@pytest.mark.unit
+def test_client_detects_platform_once():
+    """Test that the spawn flags are worked out when the client is created, not per call."""
+    with patch('platform.system', return_value='Linux') as mock_system:
+        client = speedify.SpeedifyClient(cli_path='/cli')
+        calls = mock_system.call_count
+
+        with patch('subprocess.run', return_value=_completed(b'{"state": "CONNECTED"}')) as mock_run:
+            client.show_state()
+            client.show_state()
+
+        assert mock_system.call_count == calls
+        assert mock_run.call_args[1]['shell'] is False
+
+
+@pytest.mark.unit
+def test_set_default_client():
+    """Test that module-level functions delegate to the default client."""
+    client = speedify.SpeedifyClient(cli_path='/default/cli')
+    speedify.set_default_client(client)
+    try:
+        assert speedify.get_default_client() is client
+        with patch('subprocess.run', return_value=_completed(b'{}')) as mock_run:
+            speedify.show_privacy()
+            assert mock_run.call_args[0][0] == ['/default/cli', '-s', 'show', 'privacy']
+    finally:
+        speedify.set_default_client(None)
+
+
+@pytest.mark.unit
+def test_client_rejects_non_command_attributes():
+    """Test that only command wrappers are exposed on the client."""
+    client = speedify.SpeedifyClient(cli_path='/cli')
+    with pytest.raises(AttributeError):
+        client.ping_internet
+    with pytest.raises(AttributeError):
+        client._run_speedify_cmd
+    with pytest.raises(AttributeError):
+        client.no_such_command
+
+
+@pytest.mark.unit
+def test_command_name():
+    """Test command names used to key per-command settings."""
+    assert speedify._command_name(["show", "settings"]) == "show settings"
+    assert speedify._command_name(["adapter", "priority", "wlan0", "always"]) == "adapter priority"
+    assert speedify._command_name(["connect", "us", "nyc"]) == "connect"
+    assert speedify._command_name(["fixeddelay", "100"]) == "fixeddelay"
+    assert speedify._command_name(["login", "user", "secret"]) == "login"
+
+
+# ============================================================================
+# ReadCache Tests
+# ============================================================================
+
+SETTINGS_JSON = b'{"bondingMode": "speed", "encrypted": true, "transportMode": "auto"}'
+
+
+@pytest.mark.unit
+def test_read_cache_serves_repeated_reads():
+    """Test that repeated show_* calls within the TTL spawn the CLI once."""
+    client = speedify.SpeedifyClient(cli_path='/cli', cache=speedify.ReadCache(default_ttl=60))
+
+    with patch('subprocess.run', return_value=_completed(b'[{"adapterID": "eth0"}]')) as mock_run:
+        first = client.show_adapters()
+        first[0]["adapterID"] = "changed by caller"
+        second = client.show_adapters()
+
+    assert mock_run.call_count == 1
+    assert second == [{"adapterID": "eth0"}]
+    assert client.cache.hits == 1
+
+
+@pytest.mark.unit
+def test_read_cache_expires_and_honours_per_command_ttl():
+    """Test that entries expire and a TTL of 0 disables caching for a command."""
+    cache = speedify.ReadCache(default_ttl=60, ttls={"state": 0})
+    client = speedify.SpeedifyClient(cli_path='/cli', cache=cache)
+
+    with patch('subprocess.run', return_value=_completed(b'{"state": "CONNECTED"}')) as mock_run:
+        client.show_state()
+        client.show_state()
+        assert mock_run.call_count == 2
+
+    with patch('subprocess.run', return_value=_completed(b'{"tag": "us-nyc-1"}')) as mock_run:
+        with patch('time.monotonic', return_value=1000.0):
+            client.show_currentserver()
+        with patch('time.monotonic', return_value=1061.0):
+            client.show_currentserver()
+        assert mock_run.call_count == 2
+
+
+@pytest.mark.unit
+def test_read_cache_invalidated_by_setters():
+    """Test that a mutating command empties the cache."""
+    client = speedify.SpeedifyClient(cli_path='/cli', cache=speedify.ReadCache(default_ttl=60))
+
+    with patch('subprocess.run', return_value=_completed(b'[]')) as mock_run:
+        client.show_adapters()
+        client.adapter_priority("eth0", Priority.BACKUP)
+        client.show_adapters()
+
+    assert mock_run.call_count == 3
+
+
+@pytest.mark.unit
+def test_read_cache_failed_setter_still_invalidates():
+    """Test that the cache is emptied even if the setter failed."""
+    client = speedify.SpeedifyClient(cli_path='/cli', cache=speedify.ReadCache(default_ttl=60))
+    error = subprocess.CalledProcessError(returncode=2, cmd=[], output=b'', stderr=b'bad value')
+
+    with patch('subprocess.run', return_value=_completed(b'{"tag": "x"}')):
+        client.show_currentserver()
+    with patch('subprocess.run', side_effect=error):
+        with pytest.raises(SpeedifyError):
+            client.connect("nowhere")
+    with patch('subprocess.run', return_value=_completed(b'{"tag": "y"}')) as mock_run:
+        assert client.show_currentserver() == {"tag": "y"}
+        assert mock_run.call_count == 1
+
+
+@pytest.mark.unit
+def test_read_cache_settings_read_your_writes():
+    """Test that a setter returning the settings JSON refreshes show settings."""
+    client = speedify.SpeedifyClient(cli_path='/cli', cache=speedify.ReadCache(default_ttl=60))
+
+    with patch('subprocess.run', return_value=_completed(SETTINGS_JSON)) as mock_run:
+        client.encryption(True)
+        settings = client.show_settings()
+
+    assert mock_run.call_count == 1
+    assert settings["bondingMode"] == "speed"
+
+
+# ============================================================================
+# Coalescing Tests
+# ============================================================================
+
+def _run_concurrently(function, count):
+    import threading
+
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(i):
+        try:
+            results[i] = function()
+        except Exception as err:
+            errors[i] = err
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def _blocking_run(client, key, followers, outcome):
+    """A subprocess.run stand-in that waits until `followers` callers have joined the leader."""
+    import time
+
+    def fake_run(*args, **kwargs):
+        deadline = time.monotonic() + 5
+        while client._inflight[(key, None)].waiters < followers and time.monotonic() < deadline:
+            time.sleep(0.001)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return fake_run
+
+
+@pytest.mark.unit
+def test_concurrent_identical_reads_share_one_process():
+    """Test that concurrent show_adapters() calls spawn the CLI once."""
+    client = speedify.SpeedifyClient(cli_path='/cli')
+    fake_run = _blocking_run(client, ("show", "adapters"), 9, _completed(b'[{"adapterID": "eth0"}]'))
+
+    with patch('subprocess.run', side_effect=fake_run) as mock_run:
+        threads, results, errors = _run_concurrently(client.show_adapters, 10)
+        for thread in threads:
+            thread.join()
+
+    assert mock_run.call_count == 1
+    assert errors == [None] * 10
+    assert all(result == [{"adapterID": "eth0"}] for result in results)
+    assert len({id(result) for result in results}) == 10
+    assert client._inflight == {}
+
+
+@pytest.mark.unit
+def test_coalesced_callers_all_receive_error():
+    """Test that every coalesced caller gets the leader's exception."""
+    client = speedify.SpeedifyClient(cli_path='/cli')
+    error = subprocess.CalledProcessError(
+        returncode=1, cmd=[], output=b'',
+        stderr=b'{"errorCode": 3841, "errorType": "Timeout waiting for result", "errorMessage": "Timeout"}'
+    )
+    fake_run = _blocking_run(client, ("state",), 4, error)
+
+    with patch('subprocess.run', side_effect=fake_run) as mock_run:
+        threads, results, errors = _run_concurrently(client.show_state, 5)
+        for thread in threads:
+            thread.join()
+
+    assert mock_run.call_count == 1
+    assert all(isinstance(err, SpeedifyAPIError) for err in errors)
+
+
+@pytest.mark.unit
+def test_coalesced_callers_do_not_share_interrupts():
+    """Test that a leader's KeyboardInterrupt isn't raised in its followers, which run the command themselves."""
+    client = speedify.SpeedifyClient(cli_path='/cli')
+    calls = []
+
+    def fake_run(*args, **kwargs):
+        calls.append(threading.current_thread())
+        if len(calls) == 1:
+            deadline = time.monotonic() + 5
+            while client._inflight[(("state",), None)].waiters < 1 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            raise KeyboardInterrupt
+        return _completed(b'{"state": "CONNECTED"}')
+
+    outcomes = {}
+
+    def worker(i):
+        try:
+            outcomes[i] = client.show_state()
+        except BaseException as err:
+            outcomes[i] = err
+
+    with patch('subprocess.run', side_effect=fake_run):
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(calls) == 2
+    assert sorted(type(outcome).__name__ for outcome in outcomes.values()) == ["KeyboardInterrupt", "State"]
+
+
+@pytest.mark.unit
+def test_reads_with_different_timeouts_are_not_coalesced():
+    """Test that a caller's own timeout is used rather than another caller's."""
+    client = speedify.SpeedifyClient(cli_path='/cli')
+    timeouts = []
+
+    def fake_run(*args, **kwargs):
+        timeouts.append(kwargs.get("timeout"))
+        deadline = time.monotonic() + 5
+        while len(client._inflight) < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return _completed(b'{"state": "CONNECTED"}')
+
+    with patch('subprocess.run', side_effect=fake_run):
+        threads = [
+            threading.Thread(target=client.run, args=(["state"],), kwargs={"cmdtimeout": timeout})
+            for timeout in (5, 10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(timeouts) == [5, 10]
+
+
+@pytest.mark.unit
+def test_mutating_commands_are_not_coalesced():
+    """Test that setters always spawn their own CLI process."""
+    client = speedify.SpeedifyClient(cli_path='/cli')
+
+    with patch('subprocess.run', return_value=_completed(SETTINGS_JSON)) as mock_run:
+        threads, results, errors = _run_concurrently(lambda: client.mode("speed"), 5)
+        for thread in threads:
+            thread.join()
+
+    assert mock_run.call_count == 5
+
+
+# ============================================================================
+# Batch Tests
+# ============================================================================
+
+@pytest.mark.unit
+def test_batch_returns_results_in_order():
+    """Test that batch() runs every command and keeps the input order."""
+    def fake_cmd(args, cmdtimeout=None):
+        return {"args": args}
+
+    with patch('speedify._run_speedify_cmd', side_effect=fake_cmd):
+        results = speedify.batch([
+            speedify.BatchCommand(speedify.adapter_priority, args=("eth0", Priority.BACKUP)),
+            (speedify.dscp_queues_add, 46, "on"),
+            speedify.show_settings,
+        ])
+
+    assert [r.ok for r in results] == [True, True, True]
+    assert results[0].result == {"args": ["adapter", "priority", "eth0", "backup"]}
+    assert results[1].result == {"args": ["dscp", "queues", "add", "46", "priority", "on"]}
+    assert results[2].result == {"args": ["show", "settings"]}
+
+
+@pytest.mark.unit
+def test_batch_runs_independent_commands_concurrently():
+    """Test that independent commands overlap on the worker pool."""
+    import threading
+
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fake_cmd(args, cmdtimeout=None):
+        barrier.wait()
+        return {}
+
+    with patch('speedify._run_speedify_cmd', side_effect=fake_cmd):
+        results = speedify.batch([(speedify.mode, "speed")] * 3, max_workers=3)
+
+    assert all(r.ok for r in results)
+
+
+@pytest.mark.unit
+def test_batch_respects_dependencies_and_skips_after_failure():
+    """Test ordering dependencies and that dependents of a failed command are skipped."""
+    order = []
+
+    def fake_cmd(args, cmdtimeout=None):
+        order.append(args[0])
+        if args[0] == "transport":
+            raise SpeedifyError("bad transport")
+        return {}
+
+    with patch('speedify._run_speedify_cmd', side_effect=fake_cmd):
+        results = speedify.batch([
+            speedify.BatchCommand(speedify.connect_closest, name="connect", after=["mode"]),
+            speedify.BatchCommand(speedify.mode, args=("speed",), name="mode"),
+            speedify.BatchCommand(speedify.transport, args=("bogus",), name="transport"),
+            speedify.BatchCommand(speedify.jumbo, args=(True,), after=["transport"]),
+        ], max_workers=1)
+
+    assert order.index("mode") < order.index("connect")
+    assert "jumbo" not in order
+    assert results[0].ok and results[1].ok
+    assert results[2].error.message == "bad transport"
+    assert "transport failed" in results[3].error.message
+
+
+@pytest.mark.unit
+def test_batch_rejects_bad_dependencies():
+    """Test that unknown names and cycles are refused before anything runs."""
+    with patch('speedify._run_speedify_cmd') as mock_cmd:
+        with pytest.raises(ValueError):
+            speedify.batch([speedify.BatchCommand(speedify.mode, args=("speed",), after=["missing"])])
+        with pytest.raises(ValueError):
+            speedify.batch([
+                speedify.BatchCommand(speedify.mode, args=("speed",), name="a", after=["b"]),
+                speedify.BatchCommand(speedify.jumbo, name="b", after=["a"]),
+            ])
+    mock_cmd.assert_not_called()
+
+
+@pytest.mark.unit
+def test_client_batch_uses_client():
+    """Test that client.batch() runs each command against the client."""
+    client = speedify.SpeedifyClient(cli_path='/client/cli')
+
+    with patch('subprocess.run', return_value=_completed(SETTINGS_JSON)) as mock_run:
+        results = client.batch([(speedify.mode, "speed"), (speedify.jumbo, True)])
+
+    assert all(r.ok for r in results)
+    assert {call[0][0][0] for call in mock_run.call_args_list} == {'/client/cli'}
+
+
+# ============================================================================
+# Progress Tests
+# ============================================================================
+
+SPEEDTEST_REPORTS = [
+    {"status": "running", "percent": 50},
+    {"status": "running", "percent": 100},
+    [{"downloadSpeed": 95000000, "isError": False}],
+]
+
+
+def _script_cli(tmp_path, body):
+    """Writes a shell script standing in for speedify_cli."""
+    path = tmp_path / "speedify_cli"
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.mark.unit
+def test_speedtest_progress_and_iter():
+    """Test that every object the CLI prints reaches progress(), or the iterator, in order."""
+    fake = speedify.FakeTransport()
+    fake.add_stream("speedtest", SPEEDTEST_REPORTS)
+    fake.add_stream("streamtest", SPEEDTEST_REPORTS[-1:])
+    client = speedify.SpeedifyClient(transport=fake)
+
+    reports = []
+    assert client.speedtest(progress=reports.append) == SPEEDTEST_REPORTS[-1]
+    assert reports == SPEEDTEST_REPORTS
+    assert list(client.speedtest_iter()) == SPEEDTEST_REPORTS
+    assert client.run_all(["streamtest"]) == SPEEDTEST_REPORTS[-1:]
+    assert fake.calls[-1] == ["streamtest"]
+
+
+@pytest.mark.unit
+def test_connect_without_progress_runs_normally():
+    """Test that connect() only streams when asked to."""
+    fake = speedify.FakeTransport()
+    fake.add("connect", {"tag": "us-nyc-1"})
+    client = speedify.SpeedifyClient(transport=fake)
+
+    assert client.connect("closest") == {"tag": "us-nyc-1"}
+    with pytest.raises(SpeedifyError):
+        client.connect("closest", progress=print)  # no stream added
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not os.path.exists("/bin/sh"), reason="needs /bin/sh")
+def test_run_iter_reports_early_and_maps_errors(tmp_path):
+    """Test that objects arrive before the CLI exits and that exit codes map to errors."""
+    cli = _script_cli(tmp_path, """
+case "$2" in
+  connect) echo '{"state": "CONNECTING"}'; exec sleep 10;;
+  speedtest) echo '{"percent": 10}'; echo '{"errorCode": 3841, "errorType": "Timeout", "errorMessage": "Timeout"}' >&2; exit 1;;
+  streamtest) echo 'Invalid value' >&2; exit 2;;
+esac
+""")
+    client = speedify.SpeedifyClient(cli_path=cli)
+
+    start = time.monotonic()
+    reports = client.connect_iter("closest")
+    assert next(reports) == {"state": "CONNECTING"}
+    reports.close()  # stops the CLI
+    assert time.monotonic() - start < 5
+
+    seen = []
+    with pytest.raises(SpeedifyAPIError) as exc_info:
+        client.speedtest(progress=seen.append)
+    assert exc_info.value.error_code == 3841
+    assert seen == [{"percent": 10}]
+
+    with pytest.raises(SpeedifyError) as exc_info:
+        client.streamtest(progress=seen.append)
+    assert exc_info.value.message == "Invalid value"
+
+    client.set_timeout("connect", 0.3)
+    with pytest.raises(SpeedifyError) as exc_info:
+        client.connect("closest", progress=seen.append)
+    assert "timed out" in exc_info.value.message
@@ -0,0 +1,386 @@
+"""
+Unit tests for the long-running stats and safebrowsing error streams.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_streams.py -m unit
+"""
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+import speedify
+from speedify import aio
+from speedify import FakeTransport, MetricsRegistry, ReadCache, SpeedifyClient
+from speedify.retry import RestartPolicy
+
+STATS = [["state", {"state": "CONNECTED"}], ["adapters", []], ["connection_stats", {"connections": []}]]
+
+
+def _script_cli(tmp_path, body):
+    """Writes a shell script standing in for speedify_cli."""
+    path = tmp_path / "speedify_cli"
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.mark.unit
+def test_stream_handle_runs_to_the_end():
+    """Test that a finite stream delivers every message and can be joined."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS)
+    received = []
+
+    handle = SpeedifyClient(transport=fake).stats_stream(2, received.append)
+
+    assert handle.join(5)
+    assert not handle.running
+    assert handle.error is None
+    assert received == STATS
+
+
+@pytest.mark.unit
+def test_stream_handle_stop():
+    """Test that stop() ends an endless stream, with no callbacks after it returns."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.01)
+    metrics = MetricsRegistry()
+    first = threading.Event()
+    received = []
+
+    def callback(message):
+        received.append(message)
+        first.set()
+
+    handle = SpeedifyClient(transport=fake, metrics=metrics).stats_stream(0, callback)
+    assert first.wait(5)
+    assert handle.stop(5)
+    count = len(received)
+    time.sleep(0.05)
+
+    assert handle.stopped
+    assert len(received) == count < len(STATS) * 1000
+    # Stopping is not an error
+    assert metrics.snapshot()["stats"]["errors"] == {}
+
+
+@pytest.mark.unit
+def test_stream_handle_context_manager_and_stop_from_callback():
+    """Test that leaving the with block stops the stream, and a callback can stop its own stream."""
+    fake = FakeTransport()
+    fake.add_stream(["safebrowsing", "errors", "0"], [{"error": n} for n in range(1000)], interval=0.01)
+    client = SpeedifyClient(transport=fake)
+    received = []
+
+    with client.safebrowsing_error_stream(0, received.append) as handle:
+        pass
+    assert not handle.running
+
+    handles = []
+
+    def stop_after_two(message):
+        received.append(message)
+        if len(received) == 2:
+            handles[0].stop()
+
+    received.clear()
+    handles.append(client.safebrowsing_error_stream(0, stop_after_two))
+    assert handles[0].join(5)
+    assert received == [{"error": 0}, {"error": 1}]
+
+
+@pytest.mark.unit
+def test_stream_handle_kills_and_reaps_cli(tmp_path):
+    """Test that stopping a stream leaves no CLI process behind."""
+    cli = _script_cli(tmp_path, """
+echo "[\\"state\\", {\\"pid\\": $$}]"
+exec sleep 30
+""")
+    pids = []
+    started = threading.Event()
+
+    def callback(message):
+        pids.append(message[1]["pid"])
+        started.set()
+
+    handle = speedify.SpeedifyClient(cli_path=cli).stats_stream(0, callback)
+    assert started.wait(5)
+    assert handle.stop(5)
+
+    with pytest.raises(ProcessLookupError):
+        os.kill(pids[0], 0)
+
+
+@pytest.mark.unit
+def test_stream_handle_keeps_errors(tmp_path):
+    """Test that a stream that can't start records the error instead of raising."""
+    handle = speedify.SpeedifyClient(cli_path=str(tmp_path / "missing")).stats_stream(0, print)
+
+    assert handle.join(5)
+    assert isinstance(handle.error, OSError)
+
+
+@pytest.mark.unit
+def test_iter_stats_yields_lazily_and_stops_cli():
+    """Test that iter_stats() yields events as they arrive and closing it stops the CLI."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.001)
+    client = SpeedifyClient(transport=fake)
+
+    events = client.iter_stats()
+    assert fake.calls == []  # nothing runs until the first event is asked for
+    assert next(events) == STATS[0]
+    assert next(events) == STATS[1]
+    events.close()
+
+    assert fake.calls == [["stats", "0"]]
+
+
+@pytest.mark.unit
+def test_iter_stats_arguments():
+    """Test the stats command line built from the duration, periods and network sharing flag."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS)
+    client = SpeedifyClient(transport=fake)
+
+    assert list(client.iter_stats(5, periods=["current", "day", 24], networksharing=True)) == STATS
+    assert fake.calls == [["stats", "5", "networksharing", "current", "day", "24"]]
+
+    with pytest.raises(speedify.SpeedifyError):
+        client.iter_stats(periods=["fortnight"])
+
+
+@pytest.mark.unit
+def test_stats_periods_are_validated():
+    """Test that hours may be given as numeric strings, and bools, bad hours and too many periods are refused."""
+    assert speedify._stats_args(0, ["24", 48, "week"], False) == ["stats", "0", "24", "48", "week"]
+    # Without a duration, the period must not be taken for one
+    assert speedify._stats_args(None, [24], False) == ["stats", "0", "24"]
+    for periods in ([True], [False], [0], ["-3"], ["0"], [1.5], ["current", "day", "week", "month", "total", 24]):
+        with pytest.raises(speedify.SpeedifyError):
+            speedify._stats_args(0, periods, False)
+
+
+@pytest.mark.unit
+def test_iter_stats_skips_unwanted_types_without_parsing():
+    """Test that events of other types are skipped unparsed, and counted in the metrics."""
+    fake = FakeTransport()
+    # Not valid JSON: parsing it would raise
+    fake.add_stream("stats", STATS + [b'[ "connection_stats", {"connections": [', {"error": 1}, ["state", {}]])
+    metrics = MetricsRegistry()
+    client = SpeedifyClient(transport=fake, metrics=metrics)
+
+    events = list(client.iter_stats(types=["state", "adapters"]))
+
+    # Lines without a type tag are always parsed
+    assert events == [STATS[0], STATS[1], {"error": 1}, ["state", {}]]
+    assert metrics.snapshot()["stats"]["events"] == 6
+    assert metrics.snapshot()["stats"]["skipped_events"] == 2
+    assert metrics.skip_rate("stats") == pytest.approx(2 / 6)
+
+
+@pytest.mark.unit
+def test_stream_handle_types():
+    """Test that stats_stream() only calls back with the wanted event types."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 3)
+    received = []
+
+    handle = SpeedifyClient(transport=fake).stats_stream(1, received.append, types=["adapters"])
+
+    assert handle.join(5)
+    assert received == [STATS[1]] * 3
+
+
+@pytest.mark.unit
+def test_supervised_stream_restarts_with_gap_and_snapshot():
+    """Test that a supervised stream restarts once the daemon answers, after a gap event and a snapshot."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [STATS[0]], returncode=1)
+    fake.add_stream("stats", STATS * 1000, interval=0.005)
+    fake.add("state", stderr={"errorCode": 3841, "errorType": "Timeout", "errorMessage": "Timeout waiting for result"}, returncode=1)
+    fake.add("state", {"state": "LOGGED_IN"})
+    fake.add("show adapters", [{"adapterID": "eth0"}])
+    received = []
+    enough = threading.Event()
+
+    def callback(message):
+        received.append(message)
+        if len(received) == 6:
+            enough.set()
+
+    restart = RestartPolicy(backoff=0.01)
+    with SpeedifyClient(transport=fake).stats_stream(0, callback, restart=restart) as handle:
+        assert enough.wait(5)
+
+    assert handle.restarts == 1
+    assert handle.error is None
+    assert received[0] == STATS[0]
+    gap_type, gap = received[1]
+    assert gap_type == "gap"
+    assert gap["restarts"] == 2  # the daemon didn't answer the first time
+    assert gap["seconds"] > 0
+    assert "code 1" in gap["error"]
+    assert received[2:5] == [["state", {"state": "LOGGED_IN"}], ["adapters", [{"adapterID": "eth0"}]], STATS[0]]
+    assert fake.calls.count(["stats", "0"]) == 2
+
+
+@pytest.mark.unit
+def test_supervised_stream_snapshot_bypasses_cache():
+    """Test that the snapshot after a gap is read from the daemon, not from the client's cache."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [STATS[0]], returncode=1)
+    fake.add_stream("stats", [STATS[0]] * 1000, interval=0.005)
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("state", {"state": "LOGGED_IN"})
+    client = SpeedifyClient(transport=fake, cache=ReadCache(default_ttl=60))
+    assert client.run(["state"]) == {"state": "CONNECTED"}
+    received = []
+    enough = threading.Event()
+
+    def callback(message):
+        received.append(message)
+        if len(received) == 3:
+            enough.set()
+
+    restart = RestartPolicy(backoff=0.001)
+    with client.stats_stream(0, callback, types=["state"], restart=restart):
+        assert enough.wait(5)
+
+    assert received[1][0] == "gap"
+    assert received[2] == ["state", {"state": "LOGGED_IN"}]
+    assert fake.calls.count(["state"]) == 2
+    # The cache was refreshed too
+    assert client.run(["state"]) == {"state": "LOGGED_IN"}
+
+
+@pytest.mark.unit
+def test_supervised_stream_gives_up():
+    """Test that a supervised stream ends with an error after max_restarts restarts in a row."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [STATS[0]], returncode=1)
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("show adapters", [])
+    received = []
+
+    restart = RestartPolicy(backoff=0.001, max_restarts=2)
+    handle = SpeedifyClient(transport=fake).stats_stream(0, received.append, types=["state"], restart=restart)
+
+    assert handle.join(5)
+    assert handle.restarts == 2
+    assert isinstance(handle.error, speedify.SpeedifyError)
+    # Adapters weren't asked for, but gaps always are
+    assert [event[0] for event in received] == ["state", "gap", "state", "state", "gap", "state", "state"]
+    assert ["show", "adapters"] not in fake.calls
+
+
+@pytest.mark.unit
+def test_supervised_stream_ends_after_its_duration():
+    """Test that a supervised stream of a set duration isn't restarted when the CLI exits cleanly."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [STATS[0]], returncode=0)
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("show adapters", [])
+    received = []
+
+    restart = RestartPolicy(backoff=0.001, max_restarts=3)
+    handle = SpeedifyClient(transport=fake).stats_stream(5, received.append, restart=restart)
+
+    assert handle.join(5)
+    assert handle.restarts == 0
+    assert handle.error is None
+    assert received == [STATS[0]]
+    assert fake.calls == [["stats", "5"]]
+
+
+@pytest.mark.unit
+def test_iter_stats_kills_cli_on_close(tmp_path):
+    """Test that closing the generator kills and reaps a real CLI process."""
+    cli = _script_cli(tmp_path, """
+echo "[\\"state\\", {\\"pid\\": $$}]"
+exec sleep 30
+""")
+    events = speedify.SpeedifyClient(cli_path=cli).iter_stats(0)
+    pid = next(events)[1]["pid"]
+    events.close()
+
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+@pytest.mark.unit
+def test_astats_over_fake_transport():
+    """Test that astats() yields events from a blocking transport, and stops it when left."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 1000, interval=0.001)
+    fake.add_stream(["safebrowsing", "errors", "1"], [{"error": 1}, {"error": 2}])
+    metrics = MetricsRegistry()
+
+    async def main():
+        events = []
+        async for event in speedify.astats():
+            events.append(event)
+            if len(events) == 2:
+                break
+        errors = await aio.safebrowsing_error(1)
+        return events, errors
+
+    with SpeedifyClient(transport=fake, metrics=metrics).activate():
+        events, errors = asyncio.run(main())
+
+    assert events == STATS[:2]
+    assert errors == [{"error": 1}, {"error": 2}]
+    assert metrics.snapshot()["stats"]["calls"] == 1
+
+
+@pytest.mark.unit
+def test_astats_types():
+    """Test that astats() skips the events of other types."""
+    fake = FakeTransport()
+    fake.add_stream("stats", STATS * 2)
+    metrics = MetricsRegistry()
+
+    async def main():
+        return [event async for event in speedify.astats(1, types=["connection_stats"])]
+
+    with SpeedifyClient(transport=fake, metrics=metrics).activate():
+        events = asyncio.run(main())
+
+    assert events == [STATS[2]] * 2
+    assert metrics.snapshot()["stats"]["skipped_events"] == 4
+
+
+@pytest.mark.unit
+def test_astats_cancellation_kills_cli(tmp_path):
+    """Test that cancelling a task reading astats() kills and reaps the CLI."""
+    cli = _script_cli(tmp_path, """
+case "$2" in
+  stats) echo "[\\"state\\", {\\"pid\\": $$}]"; exec sleep 30;;
+  safebrowsing) echo '{"error": 1}'; echo '{"error": 2}';;
+esac
+""")
+    pids = []
+
+    async def read():
+        async for event in speedify.astats(0):
+            pids.append(event[1]["pid"])
+
+    async def main():
+        task = asyncio.ensure_future(read())
+        while not pids:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return [error async for error in speedify.asafebrowsing_errors(2)]
+
+    with SpeedifyClient(cli_path=cli).activate():
+        errors = asyncio.run(asyncio.wait_for(main(), 10))
+
+    assert errors == [{"error": 1}, {"error": 2}]
+    with pytest.raises(ProcessLookupError):
+        os.kill(pids[0], 0)
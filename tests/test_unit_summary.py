@@ -0,0 +1,115 @@
+"""
+Unit tests for speedify.summary.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_summary.py -m unit
+"""
+import asyncio
+
+import pytest
+
+import speedify
+from speedify import aio
+from speedify import FakeTransport, SpeedifyClient
+from speedify.events import from_message
+from speedify.summary import LastEvents, StatsSummary
+
+
+def _connections(*connections):
+    return [
+        "connection_stats",
+        {
+            "connections": [
+                {"adapterID": adapter_id, "receiveBps": receive_bps, "sendBps": send_bps}
+                for adapter_id, receive_bps, send_bps in connections
+            ]
+        },
+    ]
+
+
+@pytest.mark.unit
+def test_last_events_keeps_last_per_type():
+    """Test that only the last events of each type are kept, in arrival order."""
+    last = LastEvents(2)
+    for n in range(5):
+        last.add(["state", {"n": n}])
+        last.add(["adapters", [n]])
+    last.add({"error": 1})
+
+    assert last.events() == [
+        ["state", {"n": 3}],
+        ["adapters", [3]],
+        ["state", {"n": 4}],
+        ["adapters", [4]],
+        {"error": 1},
+    ]
+    assert last.by_type()["state"] == [["state", {"n": 3}], ["state", {"n": 4}]]
+    assert last.by_type()[None] == [{"error": 1}]
+    assert last.seen == 11
+    with pytest.raises(ValueError):
+        LastEvents(0)
+
+
+@pytest.mark.unit
+def test_stats_summary():
+    """Test per-adapter byte totals and rates, and state transitions."""
+    summary = StatsSummary(max_transitions=2)
+    summary.add(["state", {"state": "CONNECTING"}], received=100.0)
+    summary.add(_connections(("wlan0", 100, 10), ("wlan0", 50, 0), ("eth0", 1000, 0)), received=100.0)
+    summary.add(["state", {"state": "CONNECTED"}], received=101.0)
+    summary.add(_connections(("wlan0", 300, 30)), received=102.0)
+    summary.add(_connections(("wlan0", 100, 20), ("eth0", 0, 0)), received=103.0)
+    summary.add(["state", {"state": "DISCONNECTING"}], received=104.0)
+    summary.add(["state", {"state": "LOGGED_IN"}], received=105.0)
+
+    wlan = summary.adapters["wlan0"]
+    assert wlan.samples == 3
+    assert wlan.receive_bytes == 300 * 2 + 100 * 1
+    assert wlan.send_bytes == 30 * 2 + 20 * 1
+    assert wlan.mean_receive_bps == pytest.approx((150 + 300 + 100) / 3)
+    assert (wlan.max_receive_bps, wlan.max_send_bps) == (300, 30)
+    assert summary.adapters["eth0"].max_receive_bps == 1000
+    assert summary.state == "LOGGED_IN"
+    assert summary.transition_count == 3
+    assert list(summary.transitions) == [(4.0, "CONNECTED", "DISCONNECTING"), (5.0, "DISCONNECTING", "LOGGED_IN")]
+    assert summary.events == {"state": 4, "connection_stats": 3}
+    assert summary.as_dict()["adapters"]["wlan0"]["receiveBytes"] == 700
+
+
+@pytest.mark.unit
+def test_stats_summary_of_typed_events():
+    """Test that typed events are summarized using their receive time."""
+    first = from_message(_connections(("wlan0", 100, 0)), received=10.0)
+    second = from_message(_connections(("wlan0", 200, 0)), received=12.0)
+    summary = StatsSummary()
+    summary.add(first)
+    summary.add(second)
+
+    assert summary.adapters["wlan0"].receive_bytes == 400
+
+
+@pytest.mark.unit
+def test_stats_last_and_summary():
+    """Test the last and summary modes of stats() and safebrowsing_error()."""
+    fake = FakeTransport()
+    fake.add_stream("stats", [["state", {"state": "CONNECTING"}], ["state", {"state": "CONNECTED"}], ["adapters", []]])
+    fake.add_stream(["safebrowsing", "errors", "1"], [{"error": n} for n in range(5)])
+    client = SpeedifyClient(transport=fake)
+
+    assert client.stats(1, last=1) == [["state", {"state": "CONNECTED"}], ["adapters", []]]
+    summary = client.stats(1, summary=True)
+    assert isinstance(summary, StatsSummary)
+    assert summary.state == "CONNECTED"
+    assert client.safebrowsing_error(1, last=2) == [{"error": 3}, {"error": 4}]
+    with pytest.raises(speedify.SpeedifyError):
+        client.stats(1, last=1, summary=True)
+
+    async def main():
+        return await aio.stats(1, last=1), await aio.stats(1, summary=True), await aio.safebrowsing_error(1, last=1)
+
+    with client.activate():
+        last, summary, errors = asyncio.run(main())
+    assert last == [["state", {"state": "CONNECTED"}], ["adapters", []]]
+    assert summary.transition_count == 1
+    assert errors == [{"error": 4}]
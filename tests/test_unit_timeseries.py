@@ -0,0 +1,149 @@
+"""
+Unit tests for speedify.timeseries.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_timeseries.py -m unit
+"""
+import math
+
+import pytest
+
+from speedify.events import from_message
+from speedify.timeseries import DEFAULT_FIELDS, TimeSeriesRecorder
+
+
+def _connections(*connections):
+    return [
+        "connection_stats",
+        {
+            "connections": [
+                {"connectionID": connection_id, "adapterID": adapter_id, "receiveBps": receive_bps, "latencyMs": 20}
+                for connection_id, adapter_id, receive_bps in connections
+            ]
+        },
+    ]
+
+
+@pytest.mark.unit
+class TestTimeSeriesRecorder:
+    """Test recording connection_stats events."""
+
+    def test_records_each_connection(self):
+        recorder = TimeSeriesRecorder(capacity=10)
+        recorder.add(_connections(("wlan0%a", "wlan0", 100), ("eth0%b", "eth0", 50)), received=1.0)
+        recorder.add(_connections(("wlan0%a", "wlan0", 200)), received=2.0)
+
+        assert recorder.connection_ids() == ["wlan0%a", "eth0%b"]
+        series = recorder.series("wlan0%a")
+        assert series.adapter_id == "wlan0"
+        assert series.count == 2
+        assert list(series.times()) == [1.0, 2.0]
+        assert list(series.values("receiveBps")) == [100, 200]
+        assert list(series.values("latencyMs")) == [20, 20]
+        assert recorder.series("eth0%b").count == 1
+        assert recorder.series("missing") is None
+
+    def test_missing_fields_are_nan(self):
+        recorder = TimeSeriesRecorder(capacity=4)
+        recorder.add(_connections(("wlan0%a", "wlan0", None)), received=1.0)
+
+        values = recorder.series("wlan0%a").values("receiveBps")
+        assert math.isnan(values[0])
+        assert math.isnan(recorder.series("wlan0%a").values("lossSend")[0])
+
+    def test_ignores_other_events(self):
+        recorder = TimeSeriesRecorder()
+        recorder(["state", {"state": "CONNECTED"}])
+        assert recorder.connection_ids() == []
+
+    def test_wraps_around_keeping_the_latest(self):
+        recorder = TimeSeriesRecorder(capacity=3)
+        for second in range(5):
+            recorder.add(_connections(("wlan0%a", "wlan0", second)), received=float(second))
+
+        series = recorder.series("wlan0%a")
+        assert series.count == 3
+        assert series.start == 2
+        assert list(series.times()) == [2.0, 3.0, 4.0]
+        assert list(series.values("receiveBps")) == [2, 3, 4]
+
+    def test_by_adapter(self):
+        recorder = TimeSeriesRecorder(capacity=2)
+        recorder.add(_connections(("wlan0%a", "wlan0", 1), ("wlan0%b", "wlan0", 2), ("eth0%c", "eth0", 3)))
+
+        assert [series.connection_id for series in recorder.by_adapter("wlan0")] == ["wlan0%a", "wlan0%b"]
+        assert recorder.by_adapter("usb0") == []
+
+    def test_typed_events_use_their_received_time(self):
+        recorder = TimeSeriesRecorder(capacity=2)
+        recorder.add(from_message(_connections(("wlan0%a", "wlan0", 5)), received=42.0))
+
+        assert list(recorder.series("wlan0%a").times()) == [42.0]
+
+    def test_memory_is_preallocated(self):
+        recorder = TimeSeriesRecorder(capacity=24 * 3600)
+        for index in range(8):
+            recorder.add(_connections(("conn%d" % index, "wlan0", 1)))
+
+        per_connection = 24 * 3600 * (8 + 4 * len(DEFAULT_FIELDS))
+        assert recorder.nbytes == 8 * per_connection
+        for _ in range(3):
+            recorder.add(_connections(("conn0", "wlan0", 1)))
+        assert recorder.nbytes == 8 * per_connection
+
+    def test_least_recently_updated_connection_is_evicted(self):
+        recorder = TimeSeriesRecorder(capacity=2, max_connections=2)
+        recorder.add(_connections(("wlan0%a", "wlan0", 1), ("wlan0%b", "wlan0", 1)))
+        recorder.add(_connections(("wlan0%a", "wlan0", 2)))
+        # Roamed to a new subnet
+        recorder.add(_connections(("wlan0%a", "wlan0", 3), ("wlan0%c", "wlan0", 3)))
+
+        assert recorder.connection_ids() == ["wlan0%a", "wlan0%c"]
+        assert recorder.series("wlan0%b") is None
+        assert recorder.series("wlan0%a").count == 2
+        assert recorder.nbytes == 2 * recorder.series("wlan0%a").nbytes
+
+    def test_forget(self):
+        recorder = TimeSeriesRecorder(capacity=2)
+        recorder.add(_connections(("wlan0%a", "wlan0", 1), ("eth0%b", "eth0", 1)))
+
+        assert recorder.forget("wlan0%a").connection_id == "wlan0%a"
+        assert recorder.forget("wlan0%a") is None
+        assert recorder.connection_ids() == ["eth0%b"]
+        recorder.add(_connections(("wlan0%a", "wlan0", 5)))
+        assert list(recorder.series("wlan0%a").values("receiveBps")) == [5]
+
+    def test_capacity_must_be_positive(self):
+        with pytest.raises(ValueError):
+            TimeSeriesRecorder(capacity=0)
+        with pytest.raises(ValueError):
+            TimeSeriesRecorder(max_connections=0)
+
+
+@pytest.mark.unit
+class TestNumpyViews:
+    """Test the NumPy views of the buffers."""
+
+    def test_view_shares_memory(self):
+        numpy = pytest.importorskip("numpy")
+        recorder = TimeSeriesRecorder(capacity=4)
+        recorder.add(_connections(("wlan0%a", "wlan0", 1)), received=1.0)
+        series = recorder.series("wlan0%a")
+
+        view = series.view("receiveBps")
+        assert view.dtype == numpy.float32
+        assert view.tolist() == [1.0]
+        series._values["receiveBps"][0] = 7
+        assert view[0] == 7
+
+    def test_to_numpy_is_chronological(self):
+        pytest.importorskip("numpy")
+        recorder = TimeSeriesRecorder(capacity=3)
+        for second in range(4):
+            recorder.add(_connections(("wlan0%a", "wlan0", second)), received=float(second))
+        series = recorder.series("wlan0%a")
+
+        assert series.view().tolist() == [3.0, 1.0, 2.0]
+        assert series.to_numpy().tolist() == [1.0, 2.0, 3.0]
+        assert series.to_numpy("receiveBps").tolist() == [1.0, 2.0, 3.0]
@@ -0,0 +1,155 @@
+"""
+Unit tests for speedify.transports.
+
+These tests do NOT require Speedify daemon to be running.
+
+Run with: pytest tests/test_unit_transports.py -m unit
+"""
+import asyncio
+import json
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+import speedify
+from speedify import aio
+from speedify import (
+    FakeTransport,
+    RecordingTransport,
+    ReplayTransport,
+    SpeedifyClient,
+    State,
+    SpeedifyError,
+    SpeedifyAPIError,
+)
+
+
+API_ERROR = {"errorCode": 3841, "errorType": "Timeout waiting for result", "errorMessage": "Timeout"}
+
+
+@pytest.mark.unit
+def test_fake_transport_needs_no_cli():
+    """Test that a client using FakeTransport never looks for the CLI."""
+    fake = FakeTransport()
+    fake.add("state", {"state": "CONNECTED"})
+    client = SpeedifyClient(transport=fake)
+
+    with patch('speedify.get_cli', side_effect=SpeedifyError("Speedify CLI not found")):
+        assert client.show_state() == State.CONNECTED
+
+    assert fake.calls == [["state"]]
+
+
+@pytest.mark.unit
+def test_fake_transport_matching_and_sequences():
+    """Test exact argument matches, command name matches and result sequences."""
+    fake = FakeTransport()
+    fake.add("adapter priority", {"generic": True})
+    fake.add(["adapter", "priority", "wlan0", "always"], lambda args: {"adapter": args[2]})
+    fake.add("state", {"state": "CONNECTING"})
+    fake.add("state", {"state": "CONNECTED"})
+    client = SpeedifyClient(transport=fake)
+
+    assert client.run(["adapter", "priority", "wlan0", "always"]) == {"adapter": "wlan0"}
+    assert client.run(["adapter", "priority", "eth0", "backup"]) == {"generic": True}
+    assert [client.show_state() for _ in range(3)] == [State.CONNECTING, State.CONNECTED, State.CONNECTED]
+
+
+@pytest.mark.unit
+def test_fake_transport_errors():
+    """Test that fake exit codes map to errors like the real CLI."""
+    fake = FakeTransport()
+    fake.add("connect", returncode=1, stderr=API_ERROR)
+    fake.add("show servers", delay=1)
+    client = SpeedifyClient(transport=fake)
+
+    with pytest.raises(SpeedifyAPIError) as exc_info:
+        client.connect_closest()
+    assert exc_info.value.error_code == 3841
+
+    with pytest.raises(SpeedifyError) as exc_info:
+        client.run(["show", "servers"], cmdtimeout=0.01)
+    assert "timed out" in exc_info.value.message
+
+    # Nothing added for this command: unknown parameter
+    with pytest.raises(SpeedifyError):
+        client.show_adapters()
+
+
+@pytest.mark.unit
+def test_fake_transport_streams_stats():
+    """Test that stats() reads its messages from the transport."""
+    messages = [["state", {"state": "CONNECTED"}], ["adapters", []]]
+    fake = FakeTransport()
+    fake.add_stream("stats", messages)
+    client = SpeedifyClient(transport=fake)
+
+    assert client.stats(2) == messages
+    assert fake.calls == [["stats", "2"]]
+
+
+@pytest.mark.unit
+def test_fake_transport_in_aio():
+    """Test that aio runs non-subprocess transports without blocking the loop."""
+    fake = FakeTransport()
+    fake.add("show adapters", [{"adapterID": "eth0"}])
+
+    with SpeedifyClient(transport=fake).activate():
+        result = asyncio.run(aio.show_adapters())
+
+    assert result == [{"adapterID": "eth0"}]
+
+
+@pytest.mark.unit
+def test_subprocess_transport_stream_is_killed_on_close():
+    """Test that closing a stream early stops the command."""
+    transport = speedify.SubprocessTransport()
+
+    with transport.stream(["sh", "-c", "echo one; sleep 10"]) as stream:
+        assert next(iter(stream)) == b"one\n"
+
+    assert stream.returncode is not None
+
+
+@pytest.mark.unit
+def test_record_and_replay(tmp_path):
+    """Test that a recorded session plays back without the recorded transport."""
+    path = str(tmp_path / "session.jsonl")
+    fake = FakeTransport()
+    fake.add("state", {"state": "CONNECTED"})
+    fake.add("connect", returncode=1, stderr=API_ERROR)
+    fake.add_stream("stats", [["state", {"state": "CONNECTED"}]])
+
+    with RecordingTransport(path, transport=fake) as recorder:
+        client = SpeedifyClient(transport=recorder)
+        client.show_state()
+        with pytest.raises(SpeedifyAPIError):
+            client.connect_closest()
+        client.stats(1)
+        with pytest.raises(SpeedifyError):
+            client.login("user@example.com", "hunter2")  # unknown to the fake, still recorded
+
+    with open(path) as f:
+        recorded = f.read()
+    assert "hunter2" not in recorded
+    assert len(recorded.splitlines()) == 4
+
+    client = SpeedifyClient(transport=ReplayTransport(path))
+    assert client.show_state() == State.CONNECTED
+    with pytest.raises(SpeedifyAPIError):
+        client.connect_closest()
+    assert client.stats(1) == [["state", {"state": "CONNECTED"}]]
+    with pytest.raises(SpeedifyError):
+        client.show_adapters()
+
+
+@pytest.mark.unit
+def test_replay_transport_timeouts(tmp_path):
+    """Test that recorded timeouts are replayed as timeouts."""
+    path = tmp_path / "session.jsonl"
+    path.write_text(json.dumps({"args": ["show", "servers"], "timeout": True, "duration": 60}) + "\n")
+
+    transport = ReplayTransport(str(path))
+    with pytest.raises(subprocess.TimeoutExpired):
+        transport.run(["speedify_cli", "-s", "show", "servers"], timeout=60)